@@ -0,0 +1,165 @@
+"""头像处理：边读取请求体边解析上传的表单并限制大小，在原生线程池中解码、校验并缩放为固定尺寸的缩略图，原子写入"""
+
+import hashlib
+import io
+import os
+from eventlet import tpool
+from PIL import Image, ImageOps, UnidentifiedImageError
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from static_assets import write_atomic
+
+# 上传文件的字节上限，multipart表单的其余部分额外允许FORM_OVERHEAD字节
+MAX_UPLOAD_BYTES = int(os.environ.get("STARBALL_AVATAR_MAX_BYTES", str(2 * 1024 * 1024)))
+FORM_OVERHEAD = 16 * 1024
+CHUNK_BYTES = 64 * 1024
+
+# 解码前检查像素数量，防止小文件解压出巨大的图片
+MAX_PIXELS = 4096 * 4096
+FORMATS = {"PNG", "JPEG", "GIF", "WEBP"}
+# 上述格式的文件头，读到MAGIC_BYTES字节后立即检查，不是图片的上传不必读完
+SIGNATURES = (b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"GIF87a", b"GIF89a")
+MAGIC_BYTES = 12
+
+# 缩略图边长；DEFAULT_SIZE为其他玩家看到的小图，保存在头像目录下，其余尺寸保存在以边长命名的子目录
+SIZES = (256, 128, 64)
+DEFAULT_SIZE = 64
+MAX_PENDING = int(os.environ.get("STARBALL_AVATAR_MAX_PENDING", "8"))
+
+_pending = 0
+
+
+class AvatarTooLarge(Exception):
+    """上传文件超过字节上限"""
+
+
+class InvalidAvatar(Exception):
+    """文件不是可识别的图片或尺寸不合法"""
+
+
+class AvatarPoolBusy(Exception):
+    """缩略图任务排队已满，调用方应返回503让客户端稍后重试"""
+
+
+def _is_image(head):
+    """文件头是否属于支持的图片格式"""
+    return head.startswith(SIGNATURES) or (head[:4] == b"RIFF" and head[8:12] == b"WEBP")
+
+
+def read_upload(stream, content_type, field="head", limit=MAX_UPLOAD_BYTES):
+    """
+    边读取请求体边解析multipart表单，返回 (普通字段, 文件名, 文件内容)，没有该文件时文件名为None；
+    文件超过limit字节或文件头不是支持的图片格式时立即停止读取，不等待请求体传完
+    """
+    mimetype, options = parse_options_header(content_type)
+    boundary = options.get("boundary")
+    if mimetype != "multipart/form-data" or not boundary:
+        raise ValueError("请求不是multipart表单")
+    decoder = MultipartDecoder(boundary.encode())
+    fields = {}
+    filename = None
+    chunks = []
+    size = 0
+    part = None
+    value = []
+    while True:
+        chunk = stream.read(CHUNK_BYTES)
+        decoder.receive_data(chunk or None)
+        event = decoder.next_event()
+        while not isinstance(event, (NeedData, Epilogue)):
+            if isinstance(event, (Field, File)):
+                part = event
+                value = []
+                if isinstance(part, File) and part.name == field:
+                    filename = part.filename
+                    chunks = []
+                    size = 0
+            elif isinstance(part, Field):
+                value.append(event.data)
+                if sum(len(data) for data in value) > FORM_OVERHEAD:
+                    raise AvatarTooLarge(f"表单字段{part.name}过长")
+                if not event.more_data:
+                    fields[part.name] = b"".join(value).decode("utf-8", "replace")
+            elif isinstance(event, Data) and part.name == field:
+                checked = size >= MAGIC_BYTES
+                size += len(event.data)
+                if size > limit:
+                    raise AvatarTooLarge(f"头像超过{limit}字节")
+                chunks.append(event.data)
+                if not checked and (size >= MAGIC_BYTES or not event.more_data):
+                    if not _is_image(b"".join(chunks)[:MAGIC_BYTES]):
+                        raise InvalidAvatar("文件头不是支持的图片格式")
+            event = decoder.next_event()
+        if not chunk or isinstance(event, Epilogue):
+            break
+    return fields, filename, b"".join(chunks)
+
+
+def pending():
+    """当前排队及执行中的头像任务数量"""
+    return _pending
+
+
+def variant_path(root, filename, size):
+    """某一尺寸缩略图的保存路径"""
+    if size == DEFAULT_SIZE:
+        return os.path.join(root, filename)
+    return os.path.join(root, str(size), filename)
+
+
+def _render(content):
+    """解码、校验并生成各尺寸的PNG，在线程池中执行"""
+    try:
+        with Image.open(io.BytesIO(content)) as image:
+            if image.format not in FORMATS:
+                raise InvalidAvatar(f"不支持的图片格式{image.format}")
+            width, height = image.size
+            if not width or not height or width * height > MAX_PIXELS:
+                raise InvalidAvatar(f"图片尺寸{width}x{height}不合法")
+            image = ImageOps.exif_transpose(image).convert("RGBA")
+    except (UnidentifiedImageError, OSError, Image.DecompressionBombError) as error:
+        raise InvalidAvatar(f"无法解码图片: {error}") from error
+
+    rendered = {}
+    for size in SIZES:
+        thumbnail = ImageOps.fit(image, (size, size), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        thumbnail.save(buffer, "PNG")
+        rendered[size] = buffer.getvalue()
+    return rendered
+
+
+def _store(root, prefix, content):
+    """
+    生成全部缩略图并原子写入，在线程池中执行；文件名为 前缀.摘要.png，
+    摘要取自各尺寸编码后的字节，同一个文件名总是对应同样的内容
+    """
+    rendered = _render(content)
+    digest = hashlib.sha256()
+    for size in SIZES:
+        digest.update(rendered[size])
+    filename = f"{prefix}.{digest.hexdigest()[:16]}.png"
+    for size, data in rendered.items():
+        write_atomic(variant_path(root, filename, size), data)
+    return filename
+
+
+def store(root, prefix, content):
+    """在线程池中处理头像，返回写入的文件名"""
+    global _pending
+    if _pending >= MAX_PENDING:
+        raise AvatarPoolBusy("头像服务繁忙")
+    _pending += 1
+    try:
+        return tpool.execute(_store, root, prefix, content)
+    finally:
+        _pending -= 1
+
+
+def remove(root, filename):
+    """删除一个头像的全部缩略图"""
+    for size in SIZES:
+        try:
+            os.remove(variant_path(root, filename, size))
+        except OSError:
+            pass
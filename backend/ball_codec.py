@@ -0,0 +1,127 @@
+"""send_pos/opponent_pos 的二进制增量帧：定点坐标、只携带移动过的球、用序号重建完整局面
+
+帧格式(小端)：
+    头部  flags:u8  seq:u16  base:u16  count:u8
+    球    count个 (ball_id:u8, x:u16, y:u16)，坐标为像素值乘以 SCALE
+flags 的最低位为关键帧标记：关键帧携带全部球，base 被忽略，不在帧中的球视为已进袋；
+增量帧只携带相对于 base 号局面移动过的球，接收方当前局面的序号不等于 base 时需要请求关键帧。
+增量帧无法表示球被移除，球进袋后发送方必须发送关键帧
+"""
+
+import struct
+import numpy as np
+
+HEADER = struct.Struct("<BHHB")
+BALL_DTYPE = np.dtype([("id", "u1"), ("x", "<u2"), ("y", "<u2")])
+FLAG_KEYFRAME = 0x01
+
+# 定点精度为1/64像素，球桌坐标范围与send_pos的JSON校验一致
+SCALE = 64
+MAX_BALL_ID = 21
+MAX_X = 800 * SCALE
+MAX_Y = 400 * SCALE
+SLOTS = MAX_BALL_ID + 1
+
+
+class FrameError(ValueError):
+    """帧格式或数据非法"""
+
+
+class StaleFrame(Exception):
+    """增量帧的base与当前局面不一致，需要关键帧重新同步"""
+
+
+def decode(frame):
+    """解析并校验一帧，返回 (flags, seq, base, balls)，balls为BALL_DTYPE结构化数组"""
+    if not isinstance(frame, (bytes, bytearray, memoryview)) or len(frame) < HEADER.size:
+        raise FrameError("帧长度不足")
+    flags, seq, base, count = HEADER.unpack_from(frame)
+    if len(frame) != HEADER.size + count * BALL_DTYPE.itemsize:
+        raise FrameError("帧长度与球数不符")
+    balls = np.frombuffer(frame, dtype=BALL_DTYPE, count=count, offset=HEADER.size)
+    if count and (
+        balls["id"].max() > MAX_BALL_ID
+        or balls["x"].max() > MAX_X
+        or balls["y"].max() > MAX_Y
+        or len(np.unique(balls["id"])) != count
+    ):
+        raise FrameError("球的编号或坐标越界")
+    return flags, seq, base, balls
+
+
+def encode(seq, base, balls, keyframe=False):
+    """把结构化数组balls打包成一帧"""
+    flags = FLAG_KEYFRAME if keyframe else 0
+    return HEADER.pack(flags, seq, base, len(balls)) + balls.tobytes()
+
+
+def from_json(balls):
+    """把JSON格式的球列表转换为结构化数组(调用方已完成范围校验)"""
+    packed = np.empty(len(balls), dtype=BALL_DTYPE)
+    packed["id"] = [ball["ball_id"] for ball in balls]
+    packed["x"] = np.rint([ball["ball_posx"] * SCALE for ball in balls])
+    packed["y"] = np.rint([ball["ball_posy"] * SCALE for ball in balls])
+    return packed
+
+
+class PositionState:
+    """一个房间最近一次同步的全部球位置，以及对应的序号"""
+
+    __slots__ = ("seq", "x", "y", "present")
+
+    def __init__(self):
+        self.seq = 0
+        self.x = np.zeros(SLOTS, dtype=np.uint16)
+        self.y = np.zeros(SLOTS, dtype=np.uint16)
+        self.present = np.zeros(SLOTS, dtype=bool)
+
+    def apply(self, flags, seq, base, balls):
+        """应用一帧，增量帧的base与当前序号不一致时抛出StaleFrame"""
+        if flags & FLAG_KEYFRAME:
+            self.present[:] = False
+        elif base != self.seq:
+            raise StaleFrame(f"局面序号为{self.seq}, 增量帧基于{base}")
+        ids = balls["id"]
+        self.x[ids] = balls["x"]
+        self.y[ids] = balls["y"]
+        self.present[ids] = True
+        self.seq = seq
+
+    def update(self, balls):
+        """
+        用完整的球列表更新局面，不在列表中的球视为已进袋；
+        返回只包含变化球的增量帧，有球被移除时返回关键帧
+        """
+        ids = balls["id"]
+        listed = np.zeros(SLOTS, dtype=bool)
+        listed[ids] = True
+        removed = (self.present & ~listed).any()
+        changed = ~self.present[ids] | (self.x[ids] != balls["x"]) | (self.y[ids] != balls["y"])
+        base = self.seq
+        self.seq = (self.seq + 1) & 0xFFFF
+        self.x[ids] = balls["x"]
+        self.y[ids] = balls["y"]
+        self.present = listed
+        if removed:
+            return encode(self.seq, self.seq, balls, keyframe=True)
+        return encode(self.seq, base, balls[changed])
+
+    def keyframe(self):
+        """当前完整局面的关键帧"""
+        return encode(self.seq, self.seq, self.snapshot(), keyframe=True)
+
+    def snapshot(self):
+        """当前完整局面的结构化数组"""
+        ids = np.flatnonzero(self.present)
+        balls = np.empty(len(ids), dtype=BALL_DTYPE)
+        balls["id"] = ids
+        balls["x"] = self.x[ids]
+        balls["y"] = self.y[ids]
+        return balls
+
+    def to_json(self):
+        """当前完整局面的JSON格式，供未协商二进制格式的客户端使用"""
+        return [
+            {"ball_id": int(ball_id), "ball_posx": x / SCALE, "ball_posy": y / SCALE}
+            for ball_id, x, y in self.snapshot().tolist()
+        ]
@@ -0,0 +1,104 @@
+"""球杆目录缓存：启动时加载bar_info，按bar_possess位掩码记忆拥有/未拥有列表及序列化结果"""
+
+import hashlib
+import json
+
+# 记忆的位掩码数量上限，超过后清空重新记忆
+MAX_MASKS = 4096
+
+
+class BarCatalog:
+    """
+    bar_info只在初始化、上架或调价时变化，修改必须通过add_bar/reprice或在修改后调用invalidate；
+    version为目录内容的摘要，作为ETag的一部分供客户端跳过未变化的目录
+    """
+
+    def __init__(self, db, dumps=json.dumps):
+        self.db = db
+        self.dumps = dumps
+        self.bars = None
+        self.prices = {}
+        self.version = ""
+        self._splits = {}
+        self._listings = {}
+
+    def load(self):
+        """从数据库加载完整目录并清空记忆的结果"""
+        with self.db.connection() as conn:
+            rows = conn.execute("SELECT * FROM bar_info ORDER BY bar_id").fetchall()
+        bars = [dict(row) for row in rows]
+        self.prices = {bar["bar_id"]: bar["price"] for bar in bars}
+        self.version = hashlib.sha1(
+            json.dumps(bars, sort_keys=True).encode("utf-8")
+        ).hexdigest()[:16]
+        self._splits = {}
+        self._listings = {}
+        self.bars = bars
+        return bars
+
+    def invalidate(self):
+        """目录被修改后重新加载"""
+        self.load()
+
+    def _ensure(self):
+        if self.bars is None:
+            self.load()
+        return self.bars
+
+    def price(self, bar_id):
+        """球杆价格，球杆不存在时返回None"""
+        self._ensure()
+        return self.prices.get(bar_id)
+
+    def split(self, mask):
+        """按位掩码返回 (拥有的球杆, 未拥有的球杆)，结果被所有请求共享，调用方不得修改"""
+        bars = self._ensure()
+        cached = self._splits.get(mask)
+        if cached is None:
+            if len(self._splits) >= MAX_MASKS:
+                self._splits.clear()
+            possess = [bar for bar in bars if (1 << (bar["bar_id"] - 1)) & mask]
+            npossess = [bar for bar in bars if not (1 << (bar["bar_id"] - 1)) & mask]
+            cached = self._splits[mask] = (possess, npossess)
+        return cached
+
+    def listing(self, mask):
+        """/api/bar/list 成功响应的序列化结果"""
+        cached = self._listings.get(mask)
+        if cached is None:
+            possess, npossess = self.split(mask)
+            if len(self._listings) >= MAX_MASKS:
+                self._listings.clear()
+            cached = self._listings[mask] = self.dumps(
+                {
+                    "message": "ok",
+                    "data": {"bar_possess": possess, "bar_npossess": npossess},
+                    "error": "",
+                }
+            )
+        return cached
+
+    def etag(self, mask):
+        """目录版本与位掩码共同决定/api/bar/list的响应内容"""
+        self._ensure()
+        return f"{self.version}-{mask:x}"
+
+    def add_bar(self, bar_name, price, bar_picturea="", bar_pictureb=""):
+        """上架新球杆并刷新目录，返回新球杆的id"""
+        with self.db.connection() as conn:
+            cur = conn.execute(
+                "INSERT INTO bar_info (bar_name, price, bar_picturea, bar_pictureb) "
+                "VALUES (?, ?, ?, ?)",
+                (bar_name, price, bar_picturea, bar_pictureb),
+            )
+        self.invalidate()
+        return cur.lastrowid
+
+    def reprice(self, bar_id, price):
+        """修改球杆价格并刷新目录，球杆不存在时返回False"""
+        with self.db.connection() as conn:
+            cur = conn.execute(
+                "UPDATE bar_info SET price = ? WHERE bar_id = ?", (price, bar_id)
+            )
+        self.invalidate()
+        return cur.rowcount == 1
@@ -0,0 +1,330 @@
+"""
+批量物理模拟：所有房间进行中的击球保存在同一组结构化数组中(房间 × 球)，逐帧一起推进
+
+每帧的固定开销(逐个球对的Python循环)由所有房间分摊，房间数较少时吞吐随房间数增加；
+房间数较多时每帧的耗时与房间数成正比，吞吐趋于上限。单核实测开球约为每秒1000杆，
+约1000个房间时接近上限，超过后需要增加工作进程
+"""
+
+import heapq
+import numpy as np
+from physics import (
+    BALL_RADIUS,
+    CONTACT_REACH_SQ,
+    FRAME_TIME,
+    FRICTION,
+    MAX_COLLISION_ITERATIONS,
+    MAX_FRAMES,
+    POCKET_RADIUS,
+    POCKETS,
+    RESTITUTION,
+    TABLE_SIZE,
+    TANGENT_FRICTION,
+    WALL_RESTITUTION,
+    MIN_SPEED,
+    TableState,
+)
+
+# 每张球桌的球数：母球 + 15颗彩球，母球固定在第0列
+BALLS = 16
+
+# 球对遍历顺序与前端一致(i<j, 行优先)，以及每个球参与的球对序号
+PAIR_I, PAIR_J = np.triu_indices(BALLS, k=1)
+_keys = np.full((BALLS, BALLS), -1, dtype=np.int64)
+_keys[PAIR_I, PAIR_J] = np.arange(len(PAIR_I))
+_keys = np.maximum(_keys, _keys.T)
+PARTNERS = [np.delete(np.arange(BALLS), b) for b in range(BALLS)]
+PAIR_KEYS = [_keys[b, PARTNERS[b]] for b in range(BALLS)]
+
+FRICTION_FACTOR = FRICTION ** (FRAME_TIME * 60)
+
+
+class BatchSimulator:
+    """
+    同时模拟多个房间的击球，数组前count行为进行中的房间；
+    静止的房间立即移出，空出的行由最后一行填补，因此每帧的计算量只与进行中的房间数相关
+    """
+
+    def __init__(self, capacity=64):
+        self.count = 0
+        self.keys = []
+        self.rows = {}
+        self.pocketed_ids = []
+        self.capacity = 0
+        self._allocate(capacity)
+
+    def _allocate(self, capacity):
+        """分配或扩容结构化数组"""
+        used = self.count
+        arrays = {
+            "ids": np.zeros((capacity, BALLS), dtype=np.int64),
+            "pos": np.zeros((capacity, BALLS, 2), dtype=np.float64),
+            "vel": np.zeros((capacity, BALLS, 2), dtype=np.float64),
+            "pocketed": np.zeros((capacity, BALLS), dtype=bool),
+            "dirty": np.zeros((capacity, BALLS), dtype=bool),
+            "first_hit": np.full(capacity, -1, dtype=np.int64),
+            "frames": np.zeros(capacity, dtype=np.int64),
+        }
+        for name, array in arrays.items():
+            if used:
+                array[:used] = getattr(self, name)[:used]
+            setattr(self, name, array)
+        self.pocketed_ids.extend([] for _ in range(capacity - self.capacity))
+        self.capacity = capacity
+
+    def __contains__(self, key):
+        return key in self.rows
+
+    @property
+    def active(self):
+        """进行中的击球数量"""
+        return self.count
+
+    def submit(self, key, table, force):
+        """加入一次击球；同一key的上一次击球尚未结束时返回False"""
+        if key in self.rows:
+            return False
+        if len(table.ids) != BALLS or table.ids[0] != 0:
+            raise ValueError("球桌必须包含16颗球且母球位于首位")
+        if self.count == self.capacity:
+            self._allocate(self.capacity * 2)
+        row = self.count
+        self.ids[row] = table.ids
+        self.pos[row] = table.pos
+        self.pocketed[row] = table.pocketed
+        # 第一帧检查全部球对与球袋
+        self.dirty[row] = True
+        self.vel[row] = 0
+        if not table.pocketed[0]:
+            self.vel[row, 0] = force
+        self.first_hit[row] = -1
+        self.frames[row] = 0
+        self.pocketed_ids[row] = []
+        self.keys.append(key)
+        self.rows[key] = row
+        self.count += 1
+        return True
+
+    def cancel(self, key):
+        """放弃进行中的击球(例如房间已结束)，不在模拟中时返回False"""
+        row = self.rows.get(key)
+        if row is None:
+            return False
+        self._retire(np.array([row]))
+        return True
+
+    def advance(self, frames=1):
+        """推进至多frames帧，返回本次结束的击球 [(key, TableState, turn_data)]"""
+        finished = []
+        for _ in range(frames):
+            if not self.count:
+                break
+            finished.extend(self._frame())
+        return finished
+
+    def _frame(self):
+        """
+        所有进行中的房间同时推进一帧(对应前端 PhysicsWorld.step(1/60))。
+        前端每帧检查全部球对与球袋；位置没有变化的球不会产生新的接触或进袋，
+        这里只检查本帧移动过的球与上一帧末尾被挪动(dirty)的球，结果与逐对检查相同
+        """
+        n = self.count
+        pos, vel, pocketed, dirty = self.pos[:n], self.vel[:n], self.pocketed[:n], self.dirty[:n]
+
+        # 位置与速度更新(对应 Ball.update)，进袋的球速度恒为0
+        next_pos = pos + vel * FRAME_TIME
+        vel *= FRICTION_FACTOR
+        speed = np.sqrt(vel[..., 0] * vel[..., 0] + vel[..., 1] * vel[..., 1])
+        vel[speed < MIN_SPEED] = 0
+        moving = (vel != 0).any(axis=2)
+        np.copyto(pos, next_pos, where=moving[..., None])
+
+        # 最多迭代三轮碰撞检测，每轮只检查上一轮中位置变化过的球所在的球对
+        touched = moving | dirty
+        changed = touched
+        for _ in range(MAX_COLLISION_ITERATIONS):
+            changed = self._collide(changed)
+            if not changed.any():
+                break
+            touched = touched | changed
+        # 迭代次数用完时最后一轮挪动的球留到下一帧检查
+        dirty[:] = changed
+
+        # 边界碰撞(对应 Table.handleWallCollision)
+        low = pos - BALL_RADIUS < 0
+        high = (pos + BALL_RADIUS > TABLE_SIZE) & ~low
+        bounced = low | high
+        if bounced.any():
+            pos[low] = BALL_RADIUS
+            np.copyto(pos, np.broadcast_to(TABLE_SIZE - BALL_RADIUS, pos.shape), where=high)
+            vel[bounced] *= -WALL_RESTITUTION
+            bounced = bounced.any(axis=2)
+            dirty |= bounced
+            touched = touched | bounced
+
+        # 进球检测(对应 Table.checkPocket)，只检查本帧位置可能变化的球
+        rows, balls = np.nonzero(touched & ~pocketed)
+        if len(rows):
+            diff = pos[rows, balls][:, None, :] - POCKETS
+            distance = np.sqrt(np.einsum("bpk,bpk->bp", diff, diff))
+            entered = (distance < POCKET_RADIUS + BALL_RADIUS).any(axis=1)
+            for row, ball in zip(rows[entered].tolist(), balls[entered].tolist()):
+                self.pocketed_ids[row].append(int(self.ids[row, ball]))
+            pocketed[rows[entered], balls[entered]] = True
+            vel[rows[entered], balls[entered]] = 0
+
+        self.frames[:n] += 1
+        done = ~(vel != 0).any(axis=(1, 2)) | (self.frames[:n] >= MAX_FRAMES)
+        return self._retire(np.flatnonzero(done))
+
+    def _collide(self, candidates):
+        """
+        执行一轮球与球碰撞，只检查至少一颗球在candidates(房间 × 球)中的球对，返回本轮被挪动的球；
+        按球对序号依次处理，同一序号在所有房间上向量化执行，每个房间内的处理顺序与前端一致
+        """
+        n = self.count
+        pos, pocketed = self.pos[:n], self.pocketed[:n]
+        changed = np.zeros((n, BALLS), dtype=bool)
+        # 粗筛：x、y分量各自连续存放后按球对取值，比按(房间, 球)二维取值快；
+        # 接近的球对很少，之后再按候选球与是否进袋过滤
+        x = np.ascontiguousarray(pos[..., 0])
+        y = np.ascontiguousarray(pos[..., 1])
+        dist_sq = x.take(PAIR_J, axis=1)
+        dist_sq -= x.take(PAIR_I, axis=1)
+        dist_sq *= dist_sq
+        dy = y.take(PAIR_J, axis=1)
+        dy -= y.take(PAIR_I, axis=1)
+        dy *= dy
+        dist_sq += dy
+        rows, keys = np.nonzero(dist_sq < CONTACT_REACH_SQ)
+        i, j = PAIR_I[keys], PAIR_J[keys]
+        check = (candidates[rows, i] | candidates[rows, j]) & ~pocketed[rows, i] & ~pocketed[rows, j]
+        if not check.any():
+            return changed
+        rows, keys = rows[check], keys[check]
+        # 按球对序号存放，取一个球对的全部房间时访问连续内存
+        pending = np.zeros((len(PAIR_I), n), dtype=bool)
+        pending[keys, rows] = True
+        columns = np.unique(keys).tolist()
+
+        queued = set(columns)
+        while columns:
+            k = heapq.heappop(columns)
+            queued.discard(k)
+            members = np.flatnonzero(pending[k])
+            pending[k, members] = False
+            i, j = PAIR_I[k], PAIR_J[k]
+            d = pos[members, j] - pos[members, i]
+            distance = np.sqrt(d[:, 0] * d[:, 0] + d[:, 1] * d[:, 1])
+            touching = distance < 2 * BALL_RADIUS
+            members, d, distance = members[touching], d[touching], distance[touching]
+            if not len(members):
+                continue
+            changed[members, i] = True
+            changed[members, j] = True
+            if i == 0:
+                first = members[self.first_hit[members] < 0]
+                self.first_hit[first] = self.ids[first, j]
+            self._resolve(members, i, j, d, distance)
+
+            # 被分离移动的球可能与排在后面的球对发生新的接触
+            for ball in (i, j):
+                others = PARTNERS[ball]
+                keys = PAIR_KEYS[ball]
+                rel = pos[members][:, others] - pos[members, ball][:, None]
+                near_sq = rel[..., 0] * rel[..., 0] + rel[..., 1] * rel[..., 1]
+                fresh = (
+                    (near_sq < CONTACT_REACH_SQ)
+                    & (keys > k)
+                    & ~pocketed[members][:, others]
+                )
+                if not fresh.any():
+                    continue
+                sub_rows, sub_cols = np.nonzero(fresh)
+                pending[keys[sub_cols], members[sub_rows]] = True
+                for later in np.unique(keys[sub_cols]).tolist():
+                    if later not in queued:
+                        queued.add(later)
+                        heapq.heappush(columns, later)
+        return changed
+
+    def _resolve(self, members, i, j, d, distance):
+        """在members房间上同时解决球i与球j的碰撞(对应 PhysicsWorld.resolveCollision)"""
+        valid = distance != 0
+        members, d, distance = members[valid], d[valid], distance[valid]
+        if not len(members):
+            return
+        pos, vel = self.pos, self.vel
+        nx = d[:, 0] / distance
+        ny = d[:, 1] / distance
+
+        # 分离重叠的球，静止的球不移动
+        overlap = 2 * BALL_RADIUS - distance + 0.5
+        sep = np.stack((nx * overlap / 2, ny * overlap / 2), axis=1)
+        vi, vj = vel[members, i], vel[members, j]
+        still_i = (vi == 0).all(axis=1)
+        still_j = (vj == 0).all(axis=1)
+        only_j = still_i & ~still_j
+        only_i = ~still_i & still_j
+        both = ~(only_j | only_i)
+        pi, pj = pos[members, i], pos[members, j]
+        pj[only_j] += sep[only_j] * 2
+        pi[only_i] -= sep[only_i] * 2
+        pi[both] -= sep[both]
+        pj[both] += sep[both]
+        pos[members, i] = pi
+        pos[members, j] = pj
+
+        # 正在分离的球不处理
+        dvx = vj[:, 0] - vi[:, 0]
+        dvy = vj[:, 1] - vi[:, 1]
+        dvn = dvx * nx + dvy * ny
+        closing = ~(dvn > 0)
+        if not closing.any():
+            return
+
+        # 法向冲量与切向摩擦
+        impulse = -(1 + RESTITUTION) * dvn / 2
+        tx, ty = -ny, nx
+        tangent_impulse = -(dvx * tx + dvy * ty) * TANGENT_FRICTION
+        vi[:, 0] -= np.where(closing, impulse * nx, 0)
+        vi[:, 1] -= np.where(closing, impulse * ny, 0)
+        vj[:, 0] += np.where(closing, impulse * nx, 0)
+        vj[:, 1] += np.where(closing, impulse * ny, 0)
+        vi[:, 0] -= np.where(closing, tangent_impulse * tx, 0)
+        vi[:, 1] -= np.where(closing, tangent_impulse * ty, 0)
+        vj[:, 0] += np.where(closing, tangent_impulse * tx, 0)
+        vj[:, 1] += np.where(closing, tangent_impulse * ty, 0)
+        vel[members, i] = vi
+        vel[members, j] = vj
+
+    def _retire(self, rows):
+        """取出已经静止的房间，并用末尾的行填补空位"""
+        finished = []
+        for row in sorted(rows.tolist(), reverse=True):
+            first_hit = int(self.first_hit[row])
+            cue_moving = bool((self.vel[row, 0] != 0).any())
+            turn_data = {
+                "pocketedBallIds": list(self.pocketed_ids[row]),
+                "firstBallHit": first_hit if first_hit >= 0 else None,
+                "cueBallPocketed": 0 in self.pocketed_ids[row],
+                "noBallHit": first_hit < 0 and cue_moving,
+            }
+            table = TableState(
+                self.ids[row].copy(), self.pos[row].copy(), self.pocketed[row].copy()
+            )
+            finished.append((self.keys[row], table, turn_data))
+            del self.rows[self.keys[row]]
+
+            last = self.count - 1
+            if row != last:
+                for name in ("ids", "pos", "vel", "pocketed", "dirty", "first_hit", "frames"):
+                    array = getattr(self, name)
+                    array[row] = array[last]
+                self.pocketed_ids[row] = self.pocketed_ids[last]
+                self.keys[row] = self.keys[last]
+                self.rows[self.keys[row]] = row
+            self.pocketed_ids[last] = []
+            self.keys.pop()
+            self.count -= 1
+        return finished
@@ -0,0 +1,72 @@
+"""对比逐请求查询bar_info并逐位判断与目录缓存两种方式生成球杆列表的开销
+
+用法: python benchmarks/bench_bar_catalog.py [请求次数]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix="starball-bench-")
+os.environ["STARBALL_DB"] = os.path.join(WORK_DIR, "catalog.db")
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(WORK_DIR)
+
+import server  # noqa: E402
+
+
+def legacy_listing(mask):
+    """旧的实现：每次查询完整目录，逐个球杆判断位掩码后序列化"""
+    with server.db.connection() as conn:
+        bars = conn.execute("SELECT * FROM bar_info ORDER BY bar_id").fetchall()
+    possess, npossess = [], []
+    for bar_row in bars:
+        bar_row = dict(bar_row)
+        if (1 << (bar_row["bar_id"] - 1)) & mask:
+            possess.append(bar_row)
+        else:
+            npossess.append(bar_row)
+    return server.app.json.dumps(
+        {"message": "ok", "data": {"bar_possess": possess, "bar_npossess": npossess}, "error": ""}
+    )
+
+
+def timed(call, masks):
+    start = time.perf_counter()
+    for mask in masks:
+        call(mask)
+    return len(masks) / (time.perf_counter() - start)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    server.logger.disabled = True
+    server.initialize_table()
+    server.catalog.load()
+    masks = [random.randrange(1, 256) | 1 for _ in range(count)]
+    assert all(legacy_listing(m) == server.catalog.listing(m) for m in range(1, 256, 2))
+
+    before = timed(legacy_listing, masks)
+    after = timed(server.catalog.listing, masks)
+
+    client = server.app.test_client()
+    client.post("/api/auth/register", json={"user_name": "bench", "password": "pw"})
+    etag = client.get("/api/bar/list?user_id=1").headers["ETag"]
+    start = time.perf_counter()
+    for _ in range(count // 10):
+        client.get("/api/bar/list?user_id=1")
+    full = count // 10 / (time.perf_counter() - start)
+    start = time.perf_counter()
+    for _ in range(count // 10):
+        client.get("/api/bar/list?user_id=1", headers={"If-None-Match": etag})
+    conditional = count // 10 / (time.perf_counter() - start)
+
+    print(f"列表生成 旧实现 {before:.0f}/s  目录缓存 {after:.0f}/s")
+    print(f"GET /api/bar/list 完整响应 {full:.0f} req/s  304响应 {conditional:.0f} req/s")
+
+
+if __name__ == "__main__":
+    main()
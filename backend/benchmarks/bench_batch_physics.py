@@ -0,0 +1,52 @@
+"""测量批量物理模拟在不同并发房间数下的击球吞吐量，并与逐房间模拟对比；
+击球均为开球，碰撞最多，是最慢的情况
+
+用法: python benchmarks/bench_batch_physics.py [房间数 ...]
+"""
+
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from batch_physics import BatchSimulator  # noqa: E402
+from physics import TableState, shot_force, simulate_shot  # noqa: E402
+
+
+def shots(count):
+    rng = random.Random(0)
+    return [(rng.uniform(0, 360), rng.uniform(10, 100)) for _ in range(count)]
+
+
+def run_batch(table, batch):
+    sim = BatchSimulator()
+    for key, (angle, power) in enumerate(batch):
+        sim.submit(key, table, shot_force(angle, power))
+    start = time.perf_counter()
+    while sim.active:
+        sim.advance(60)
+    return len(batch) / (time.perf_counter() - start)
+
+
+def run_single(table, batch):
+    start = time.perf_counter()
+    for angle, power in batch:
+        simulate_shot(table.ids, table.pos, angle, power)
+    return len(batch) / (time.perf_counter() - start)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1, 10, 100, 1000]
+    table = TableState.rack()
+    print(f"{'rooms':>6}{'batch shots/s':>16}{'single shots/s':>17}")
+    for size in sizes:
+        batch = shots(size)
+        single = run_single(table, batch[:50])
+        print(f"{size:>6}{run_batch(table, batch):>16.0f}{single:>17.0f}")
+
+
+if __name__ == "__main__":
+    main()
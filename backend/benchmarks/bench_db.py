@@ -0,0 +1,85 @@
+"""对比逐请求建立连接与连接池两种数据库访问方式下接口的吞吐量
+
+用法: python benchmarks/bench_db.py [请求次数]
+"""
+
+import os
+import sys
+import tempfile
+import time
+import sqlite3 as sq
+from contextlib import contextmanager
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix="starball-bench-")
+os.environ["STARBALL_DB"] = os.path.join(WORK_DIR, "pooled.db")
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(WORK_DIR)
+
+import server  # noqa: E402
+
+
+class PerRequestConnect:
+    """旧的访问方式：每次请求新建连接，默认回滚日志模式"""
+
+    def __init__(self, path):
+        self.path = path
+
+    @contextmanager
+    def connection(self):
+        with sq.connect(self.path) as conn:
+            conn.row_factory = sq.Row
+            yield conn
+
+
+def prepare():
+    """建表并准备两名玩家"""
+    server.initialize_table()
+    client = server.app.test_client()
+    token = None
+    for name in ("bench_a", "bench_b"):
+        resp = client.post("/api/auth/register", json={"user_name": name, "password": "pw"})
+        token = token or resp.get_json()["data"]["token"]
+    client.environ_base["HTTP_AUTHORIZATION"] = f"Bearer {token}"
+    return client
+
+
+def run(client, count):
+    """依次压测各个接口，返回每个接口的请求/秒"""
+    cases = {
+        "GET /api/user": lambda: client.get("/api/user?user_id=1"),
+        "GET /api/bar/list": lambda: client.get("/api/bar/list?user_id=1"),
+        "POST /api/room/create": lambda: client.post(
+            "/api/room/create", json={"user_id": 1}
+        ),
+        "POST /api/auth/buy": lambda: client.post(
+            "/api/auth/buy", json={"user_id": 1, "bar_id": 1}
+        ),
+    }
+    result = {}
+    for name, call in cases.items():
+        start = time.perf_counter()
+        for _ in range(count):
+            call()
+        result[name] = count / (time.perf_counter() - start)
+    return result
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    server.logger.disabled = True
+    pooled = server.db
+
+    server.db = server.rooms.db = server.catalog.db = server.ledger.db = PerRequestConnect(os.path.join(WORK_DIR, "legacy.db"))
+    before = run(prepare(), count)
+
+    server.db = server.rooms.db = server.catalog.db = server.ledger.db = pooled
+    after = run(prepare(), count)
+
+    print(f"{'endpoint':<24}{'before req/s':>14}{'after req/s':>14}")
+    for name in before:
+        print(f"{name:<24}{before[name]:>14.0f}{after[name]:>14.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""对比每个响应的序列化耗时：Flask默认的jsonify与标准库socket包编码，与fast_json(orjson或标准库)及预先编码的固定响应
+
+用法: python benchmarks/bench_json.py [次数]
+"""
+
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engineio import json as stdlib_json  # noqa: E402
+from flask import Flask, jsonify  # noqa: E402
+from socketio.packet import EVENT, Packet  # noqa: E402
+
+import fast_json  # noqa: E402
+
+BARS = [
+    {
+        "bar_id": i,
+        "bar_name": f"球杆{i}",
+        "bar_picturea": f"/bars/a{i}.png",
+        "bar_pictureb": f"/bars/b{i}.png",
+        "price": 200 + i * 90,
+    }
+    for i in range(1, 9)
+]
+PAYLOADS = {
+    "用户信息": {
+        "message": "ok",
+        "data": {
+            "coins": 1280,
+            "head": "3f2a9c1d.png",
+            "total_games": 57,
+            "win_games": 31,
+            "bar_possess": BARS[:3],
+        },
+        "error": "",
+    },
+    "球杆列表": {
+        "message": "ok",
+        "data": {"bar_possess": BARS[:3], "bar_npossess": BARS[3:], "coins": 1280},
+        "error": "",
+    },
+}
+POSITIONS = {
+    "balls": [
+        {"ball_id": i, "ball_posx": 100.123456 + i * 37.5, "ball_posy": 200.654321 - i * 11.25}
+        for i in range(16)
+    ]
+}
+
+
+def per_call(func, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def http_cases(count):
+    """每种载荷分别用Flask默认实现与fast_json生成完整的Response对象"""
+    default_app = Flask("default")
+    fast_app = Flask("fast")
+    fast_app.json = fast_json.FastJSONProvider(fast_app)
+    rows = []
+    for name, payload in PAYLOADS.items():
+        timings = []
+        for app in (default_app, fast_app):
+            with app.app_context():
+                timings.append(per_call(lambda: jsonify(payload), count))
+        rows.append((name, *timings))
+
+    error = {"message": "fail", "data": {}, "error": "数据库服务异常"}
+    with default_app.app_context():
+        before = per_call(lambda: jsonify(error), count)
+    body = fast_json.envelope("fail", "数据库服务异常")
+    after = per_call(
+        lambda: fast_app.response_class(body, status=500, mimetype="application/json"), count
+    )
+    rows.append(("固定错误", before, after))
+    return rows
+
+
+def socket_case(count):
+    """opponent_pos事件包的编码：python-socketio默认的标准库json与fast_json"""
+    timings = []
+    for module in (stdlib_json, fast_json.SocketJSON):
+        Packet.json = module
+        timings.append(
+            per_call(lambda: Packet(EVENT, data=["opponent_pos", POSITIONS]).encode(), count)
+        )
+    Packet.json = stdlib_json
+    return ("位置(socket)", *timings)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    rows = http_cases(count) + [socket_case(count)]
+    print(f"JSON实现: {fast_json.BACKEND}")
+    print(f"{'载荷':<12}{'之前us':>10}{'之后us':>10}{'变化':>10}")
+    for name, before, after in rows:
+        print(f"{name:<12}{before:>10.2f}{after:>10.2f}{after / before - 1:>+10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""对比排行榜的两种实现：每次查询都在user_info上排序/计数，与内存中增量维护的名次
+
+用法: python benchmarks/bench_leaderboard.py [用户数] [次数]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database  # noqa: E402
+from leaderboard import Leaderboard  # noqa: E402
+
+ORDER = "ORDER BY win_games DESC, total_games ASC, user_id ASC"
+
+
+def prepare(path, users):
+    """随机生成用户战绩，胜场集中在少数活跃玩家"""
+    rng = random.Random(7)
+    db = Database(path)
+    rows = []
+    for i in range(users):
+        total = int(rng.expovariate(1 / 30))
+        rows.append((f"u{i}", total, rng.randint(0, total)))
+    with db.connection() as conn:
+        conn.execute(
+            """CREATE TABLE user_info (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_name TEXT NOT NULL UNIQUE,
+            total_games INTEGER NOT NULL DEFAULT 0,
+            win_games INTEGER NOT NULL DEFAULT 0)"""
+        )
+        conn.executemany(
+            "INSERT INTO user_info (user_name, total_games, win_games) VALUES (?, ?, ?)", rows
+        )
+    return db
+
+
+def per_call(func, count):
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    users = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    db = prepare(os.path.join(tempfile.mkdtemp(prefix="starball-rank-"), "rank.db"), users)
+    rng = random.Random(11)
+    picks = [rng.randint(1, users) for _ in range(count)]
+
+    def sql_top(i):
+        with db.connection() as conn:
+            conn.execute(
+                f"SELECT user_id, user_name, win_games, total_games FROM user_info {ORDER} LIMIT 20"
+            ).fetchall()
+
+    def sql_rank(i):
+        with db.connection() as conn:
+            wins, total = conn.execute(
+                "SELECT win_games, total_games FROM user_info WHERE user_id = ?", (picks[i],)
+            ).fetchone()
+            conn.execute(
+                "SELECT COUNT(*) FROM user_info WHERE win_games > ? "
+                "OR (win_games = ? AND (total_games < ? OR (total_games = ? AND user_id < ?)))",
+                (wins, wins, total, total, picks[i]),
+            ).fetchone()
+
+    board = Leaderboard(db)
+    start = time.perf_counter()
+    board.load()
+    build = time.perf_counter() - start
+
+    def board_update(i):
+        board.record_game(picks[i], picks[-i - 1])
+        # 每局结束后有人查看前20名，涉及前排的变化会使缓存失效
+        board.top_json(20)
+
+    slow = count // 20
+    print(f"用户数 {users}")
+    print(f"SQL 前20名:        {per_call(sql_top, slow):10.1f}us/次")
+    print(f"SQL 单个名次:      {per_call(sql_rank, slow):10.1f}us/次")
+    print(f"内存 构建:         {build * 1000:10.1f}ms")
+    print(f"内存 前20名(缓存): {per_call(lambda i: board.top_json(20), count):10.1f}us/次")
+    print(f"内存 单个名次:     {per_call(lambda i: board.rank(picks[i]), count):10.1f}us/次")
+    print(f"内存 前后各5名:    {per_call(lambda i: board.around(board.rank(picks[i]), 5), count):10.1f}us/次")
+    print(f"内存 结算+前20名:  {per_call(board_update, count):10.1f}us/局")
+
+
+if __name__ == "__main__":
+    main()
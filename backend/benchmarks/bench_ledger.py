@@ -0,0 +1,81 @@
+"""对比金币变动的两种写入方式：内存余额+批量写回，与每笔一条条件UPDATE的即时写入；
+一半操作是购买，另一半是对局奖励，奖励与服务器一样经由grant在各自的事务中立即写入
+
+用法: python benchmarks/bench_ledger.py [次数] [用户数]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database  # noqa: E402
+from ledger import CoinLedger  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+# 后台写回的间隔内到达的变动数，对应约每秒5000笔、间隔0.2秒
+BATCH = 1000
+
+
+def prepare(path, users):
+    db = Database(path)
+    with db.connection() as conn:
+        conn.execute(
+            """CREATE TABLE user_info (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_name TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL,
+            coins INTEGER NOT NULL DEFAULT 300,
+            total_games INTEGER NOT NULL DEFAULT 0,
+            win_games INTEGER NOT NULL DEFAULT 0,
+            bar_possess INTEGER NOT NULL DEFAULT 1,
+            head TEXT NOT NULL DEFAULT "")"""
+        )
+        conn.execute(
+            "CREATE TABLE room_info (room_id INTEGER PRIMARY KEY, player1_id, player2_id, state)"
+        )
+        conn.executemany(
+            "INSERT INTO user_info (user_name, password_hash, coins) VALUES (?, '', 1000000000)",
+            [(f"u{i}",) for i in range(users)],
+        )
+        migrate(conn)
+    return db
+
+
+def reward(ledger, user_id, ref_id):
+    """与服务器结算对局时相同：在一个事务中调用grant，提交后同步缓存"""
+    with ledger.db.connection() as conn:
+        committed = ledger.grant(conn, ((user_id, 50, "win"),), ref_id)
+    committed()
+
+
+def run(ledger, count, users):
+    start = time.perf_counter()
+    for i in range(count):
+        user_id = i % users + 1
+        if i % 2:
+            reward(ledger, user_id, i)
+        else:
+            # 每名用户每轮买一根新球杆，次数/用户数不超过60
+            ledger.buy(user_id, 2 + i // users, 1)
+        if ledger.cached and ledger.pending() >= BATCH:
+            ledger.flush()
+    ledger.flush()
+    return count / (time.perf_counter() - start)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    users = int(sys.argv[2]) if len(sys.argv) > 2 else 1000
+    work = tempfile.mkdtemp(prefix="starball-ledger-")
+    immediate = CoinLedger(prepare(os.path.join(work, "immediate.db"), users), cached=False)
+    batched = CoinLedger(prepare(os.path.join(work, "batched.db"), users))
+    immediate, batched = run(immediate, count, users), run(batched, count, users)
+    print(f"即时条件UPDATE: {immediate:8.0f} 笔/秒")
+    print(f"内存+批量写回:  {batched:8.0f} 笔/秒 (每{BATCH}笔写回一次)")
+
+
+if __name__ == "__main__":
+    main()
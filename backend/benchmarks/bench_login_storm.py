@@ -0,0 +1,101 @@
+"""登录风暴期间测量shoot转发延迟，对比bcrypt内联执行与线程池执行
+
+用法: python benchmarks/bench_login_storm.py [并发登录数]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix="starball-storm-")
+os.environ["STARBALL_DB"] = os.path.join(WORK_DIR, "storm.db")
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(WORK_DIR)
+
+import eventlet  # noqa: E402
+import server  # noqa: E402
+import passwords  # noqa: E402
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def prepare():
+    """注册两名玩家并让他们进入同一对局；击球用来探测事件循环的延迟，不限流"""
+    server.limiter.limits.pop("shoot", None)
+    server.initialize_table()
+    server.rooms.load()
+    client = server.app.test_client()
+    tokens = {}
+    for user_id, name in enumerate(("storm_a", "storm_b"), 1):
+        resp = client.post("/api/auth/register", json={"user_name": name, "password": "pw"})
+        tokens[user_id] = resp.get_json()["data"]["token"]
+    room_id = client.post(
+        "/api/room/create", json={"user_id": 1}, headers=bearer(tokens[1])
+    ).get_json()["data"]["room_id"]
+    client.post(
+        "/api/room/join", json={"user_id": 2, "room_id": room_id}, headers=bearer(tokens[2])
+    )
+    shooter = server.socketio.test_client(server.app, auth={"token": tokens[1]})
+    opponent = server.socketio.test_client(server.app, auth={"token": tokens[2]})
+    shooter.emit("join_room", {"user_id": 1, "room_id": room_id})
+    opponent.emit("join_room", {"user_id": 2, "room_id": room_id})
+    return client, shooter
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+def storm(client, shooter, logins):
+    """并发发起登录，同时以约200Hz的频率击球，返回击球延迟(毫秒)和登录状态码"""
+    codes = []
+    latencies = []
+
+    def login():
+        resp = client.post("/api/auth/login", json={"user_name": "storm_a", "password": "pw"})
+        codes.append(resp.status_code)
+
+    pool = eventlet.GreenPool(logins)
+    for _ in range(logins):
+        pool.spawn(login)
+    # 延迟从击球的预定时刻算起，事件循环被阻塞的时间也计入其中
+    due = time.perf_counter()
+    while True:
+        shooter.emit("shoot", {"user_id": 1, "angle": 90, "power": 50})
+        latencies.append((time.perf_counter() - due) * 1000)
+        if not pool.running():
+            break
+        due = time.perf_counter() + 0.005
+        eventlet.sleep(0.005)
+    pool.waitall()
+    return latencies, codes
+
+
+def report(name, latencies, codes):
+    print(
+        f"{name:<8} shoots={len(latencies):<5} p50={percentile(latencies, 0.5):7.2f}ms "
+        f"p99={percentile(latencies, 0.99):8.2f}ms max={max(latencies):8.2f}ms "
+        f"ok={codes.count(200)} busy={codes.count(503)}"
+    )
+
+
+def main():
+    logins = int(sys.argv[1]) if len(sys.argv) > 1 else 16
+    server.logger.disabled = True
+    client, shooter = prepare()
+
+    offload = passwords._offload
+    passwords._offload = lambda func, *args: func(*args)
+    report("inline", *storm(client, shooter, logins))
+
+    passwords._offload = offload
+    report("tpool", *storm(client, shooter, logins))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""匹配队列的模拟压测：按泊松过程到达的玩家，统计每次操作的耗时、等待时间与配对双方的胜率差
+
+用法: python benchmarks/bench_matchmaking.py [玩家数量] [每秒到达人数]
+"""
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from matchmaking import Matchmaker  # noqa: E402
+
+TICK_SECONDS = 0.5
+
+
+class SimClock:
+    """模拟时钟，由压测脚本推进"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def percentile(values, ratio):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * ratio), len(ordered) - 1)] if ordered else 0.0
+
+
+def simulate(players, rate, ranked):
+    """返回 (每次入队耗时us, 每次tick耗时us, 等待时间列表, 胜率差列表, 最大队列长度)"""
+    clock = SimClock()
+    queue = Matchmaker(ranked=ranked, clock=clock)
+    rng = random.Random(7)
+    arrivals = []
+    t = 0.0
+    for user_id in range(1, players + 1):
+        t += rng.expovariate(rate)
+        arrivals.append((t, user_id, rng.betavariate(4, 4)))
+    ratings = {user_id: r for _, user_id, r in arrivals}
+    joined = {}
+    waits, gaps = [], []
+    enqueue_cost = tick_cost = 0.0
+    ticks = 0
+    longest = 0
+
+    def record(pair):
+        for user_id in pair:
+            waits.append(clock.now - joined[user_id])
+        gaps.append(abs(ratings[pair[0]] - ratings[pair[1]]))
+
+    next_tick = TICK_SECONDS
+    for at, user_id, r in arrivals:
+        while next_tick <= at:
+            clock.now = next_tick
+            start = time.perf_counter()
+            pairs = queue.tick()
+            tick_cost += time.perf_counter() - start
+            ticks += 1
+            for pair in pairs:
+                record(pair)
+            next_tick += TICK_SECONDS
+        clock.now = at
+        joined[user_id] = at
+        start = time.perf_counter()
+        pair = queue.enqueue(user_id, r)
+        enqueue_cost += time.perf_counter() - start
+        if pair:
+            record(pair)
+        longest = max(longest, len(queue))
+    return (
+        enqueue_cost / players * 1e6,
+        tick_cost / max(ticks, 1) * 1e6,
+        waits,
+        gaps,
+        longest,
+    )
+
+
+def burst(players):
+    """同一时刻大量玩家入队(例如服务器重启后)时的总耗时"""
+    clock = SimClock()
+    queue = Matchmaker(clock=clock)
+    rng = random.Random(11)
+    start = time.perf_counter()
+    for user_id in range(players):
+        queue.enqueue(user_id, rng.random())
+    clock.now = 60.0
+    queue.tick()
+    return (time.perf_counter() - start) * 1e3, len(queue)
+
+
+def main():
+    players = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    rate = float(sys.argv[2]) if len(sys.argv) > 2 else 200.0
+    for ranked in (False, True):
+        enqueue_us, tick_us, waits, gaps, longest = simulate(players, rate, ranked)
+        print(
+            f"{'按胜率' if ranked else '先到先得'}: 入队 {enqueue_us:.1f}us/次  tick {tick_us:.1f}us/次  "
+            f"等待 p50 {percentile(waits, 0.5):.2f}s p99 {percentile(waits, 0.99):.2f}s  "
+            f"胜率差 平均 {sum(gaps) / len(gaps):.3f} p99 {percentile(gaps, 0.99):.3f}  最长队列 {longest}"
+        )
+    elapsed, left = burst(players)
+    print(f"{players}人同时入队并执行一次tick: {elapsed:.1f}ms, 剩余排队 {left}人")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,49 @@
+"""测量指标采集在热路径上的额外开销：socket事件包装、转发计数与SQLite语句计时
+
+用法: python benchmarks/bench_metrics.py [次数]
+"""
+
+import os
+import sqlite3 as sq
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+
+
+def per_call(func, count):
+    start = time.perf_counter()
+    for _ in range(count):
+        func()
+    return (time.perf_counter() - start) / count * 1e9
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+
+    def handler(sid=None, data=None):
+        return None
+
+    bare = per_call(lambda: handler("sid", {}), count)
+    wrapped_handler = metrics._timed_handler("send_pos", handler)
+    wrapped = per_call(lambda: wrapped_handler("sid", {}), count)
+    relay = per_call(lambda: metrics.relays.inc("opponent_pos", "local"), count)
+
+    plain = sq.connect(":memory:")
+    timed = sq.connect(":memory:", factory=metrics.TimedConnection)
+    for conn in (plain, timed):
+        conn.execute("CREATE TABLE user_info (user_id INTEGER PRIMARY KEY, coins INTEGER)")
+        conn.execute("INSERT INTO user_info VALUES (1, 300)")
+    sql = "SELECT coins FROM user_info WHERE user_id = ?"
+    query_plain = per_call(lambda: plain.execute(sql, (1,)).fetchone(), count // 4)
+    query_timed = per_call(lambda: timed.execute(sql, (1,)).fetchone(), count // 4)
+
+    print(f"socket事件包装: {wrapped - bare:.0f}ns/次")
+    print(f"转发计数:       {relay:.0f}ns/次")
+    print(f"SQLite语句计时: {query_timed - query_plain:.0f}ns/条 (未计时 {query_plain:.0f}ns/条)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""测量服务器端物理引擎每秒可模拟的完整击球次数
+
+用法: python benchmarks/bench_physics.py [击球次数]
+"""
+
+import os
+import random
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+from physics import initial_rack, simulate_shot  # noqa: E402
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    ids, positions = initial_rack()
+    rng = random.Random(0)
+    shots = [(rng.uniform(0, 360), rng.uniform(10, 100)) for _ in range(count)]
+
+    frames = 0
+    start = time.perf_counter()
+    for angle, power in shots:
+        world = simulate_shot(ids, positions, angle, power)
+        frames += world.frames
+    elapsed = time.perf_counter() - start
+    print(
+        f"{count} shots in {elapsed:.2f}s: {count / elapsed:.1f} shots/s, "
+        f"{frames / elapsed:.0f} frames/s, {frames / count:.0f} frames/shot"
+    )
+
+
+if __name__ == "__main__":
+    main()
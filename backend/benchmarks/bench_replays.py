@@ -0,0 +1,58 @@
+"""测量回放记录的热路径开销、批量写出速度与随机定位一杆的耗时
+
+用法: python benchmarks/bench_replays.py [房间数] [每局杆数]
+"""
+
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from physics import TableState  # noqa: E402
+from replays import RECORD_BYTES, ReplayReader, ReplayRecorder  # noqa: E402
+
+
+def main():
+    rooms = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    shots = int(sys.argv[2]) if len(sys.argv) > 2 else 40
+    directory = tempfile.mkdtemp(prefix="starball-replay-")
+    recorder = ReplayRecorder(directory)
+    table = TableState.rack()
+    table.pocketed[[3, 11]] = True
+    report = {"isFoul": False, "pocketedBallIds": [3], "nextPlayerId": 2}
+
+    start = time.perf_counter()
+    for shot in range(shots):
+        for room_id in range(1, rooms + 1):
+            recorder.shot(room_id, 1, 45.0, 60.0)
+            recorder.result(room_id, report, table)
+    record = (time.perf_counter() - start) / (rooms * shots)
+
+    for room_id in range(1, rooms + 1):
+        recorder.finish(room_id, 1, 2, 1)
+    start = time.perf_counter()
+    recorder.flush()
+    write = time.perf_counter() - start
+    size = os.path.getsize(recorder.data_path)
+
+    start = time.perf_counter()
+    reader = ReplayReader(directory)
+    load = time.perf_counter() - start
+    rng = random.Random(1)
+    lookups = 20000
+    start = time.perf_counter()
+    for _ in range(lookups):
+        reader.shot(rng.randint(1, rooms), rng.randrange(shots))
+    seek = (time.perf_counter() - start) / lookups
+
+    print(f"记录一杆:   {record * 1e6:.2f}us ({RECORD_BYTES}字节/杆)")
+    print(f"批量写出:   {rooms}局 {size / 1024 / 1024:.1f}MB 用时{write * 1000:.0f}ms")
+    print(f"读取索引:   {load * 1000:.1f}ms")
+    print(f"定位一杆:   {seek * 1e6:.1f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+"""测量规则状态的内存占用与每杆裁定的耗时
+
+用法: python benchmarks/bench_rules.py [房间数]
+"""
+
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rules import RuleState  # noqa: E402
+
+
+def random_turn(rng):
+    pocketed = rng.sample(range(1, 16), rng.choice((0, 0, 0, 1, 1, 2)))
+    return {
+        "pocketedBallIds": pocketed,
+        "firstBallHit": rng.choice((None, *range(1, 16))),
+        "cueBallPocketed": rng.random() < 0.05,
+        "noBallHit": rng.random() < 0.02,
+    }
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    rng = random.Random(1)
+
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    states = [RuleState(user_id) for user_id in range(1, count + 1)]
+    for state in states:
+        state.solid_player = state.shooter
+        state.pocketed = (1 << 15) | (1 << 3)
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    turns = [random_turn(rng) for _ in range(10000)]
+    start = time.perf_counter()
+    for index, turn in enumerate(turns):
+        state = states[index % count]
+        state.analyze(turn, -state.shooter)
+    elapsed = time.perf_counter() - start
+
+    print(f"规则状态: {used / count:.0f}字节/房间 ({count}个房间共{used / 1024:.0f}KB)")
+    print(f"裁定一杆: {elapsed / len(turns) * 1e6:.2f}us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+"""测量观战者对玩家之间转发的影响，以及向观战者广播一次的耗时
+
+玩家的send_pos/shoot只把更新记在房间上，观战广播由后台任务按固定频率合并发出，
+因此有无观战者时玩家一侧的处理耗时应当基本相同
+
+用法: python benchmarks/bench_spectators.py [次数] [观战人数]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix="starball-bench-")
+os.environ["STARBALL_DB"] = os.path.join(WORK_DIR, "spectators.db")
+os.environ.setdefault("STARBALL_LOG_LEVEL", "WARNING")
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(WORK_DIR)
+
+import server  # noqa: E402
+
+BALLS = [{"ball_id": i, "ball_posx": 100.0 + i, "ball_posy": 200.0 - i} for i in range(16)]
+
+
+def bearer(token):
+    return {"Authorization": f"Bearer {token}"}
+
+
+def prepare():
+    """注册两名玩家并进入同一个对局；测的是处理耗时，不对send_pos限流"""
+    server.limiter.limits.pop("send_pos", None)
+    server.initialize_table()
+    client = server.app.test_client()
+    tokens = {}
+    for user_id, name in enumerate(("bench_a", "bench_b"), 1):
+        resp = client.post("/api/auth/register", json={"user_name": name, "password": "pw"})
+        tokens[user_id] = resp.get_json()["data"]["token"]
+    room_id = client.post(
+        "/api/room/create", json={"user_id": 1}, headers=bearer(tokens[1])
+    ).get_json()["data"]["room_id"]
+    client.post(
+        "/api/room/join", json={"user_id": 2, "room_id": room_id}, headers=bearer(tokens[2])
+    )
+    players = []
+    for user_id in (1, 2):
+        player = server.socketio.test_client(server.app, auth={"token": tokens[user_id]})
+        player.emit("join_room", {"user_id": user_id, "room_id": room_id})
+        players.append(player)
+    for player in players:
+        player.get_received()
+    return room_id, players
+
+
+def send_pos(players, count):
+    """玩家1发送count帧位置，返回每帧的平均耗时(微秒)"""
+    shooter, opponent = players
+    start = time.perf_counter()
+    for _ in range(count):
+        shooter.emit("send_pos", {"user_id": 1, "balls": BALLS})
+    elapsed = time.perf_counter() - start
+    shooter.get_received()
+    opponent.get_received()
+    return elapsed / count * 1e6
+
+
+def broadcast(count):
+    """
+    每次先标记局面有更新再广播一次，返回每次广播的平均耗时(微秒)与送出的包数。
+    测试客户端会为每个接收者重新编解码一次，这里把发送替换为放入队列，只计服务器一侧的开销
+    """
+    room = next(iter(server.watched_rooms.values()))
+    sent = []
+    sio = server.socketio.server
+    send = sio._send_eio_packet
+    sio._send_eio_packet = lambda eio_sid, eio_pkt: sent.append((eio_sid, eio_pkt))
+    try:
+        start = time.perf_counter()
+        for _ in range(count):
+            room.audience.moved = True
+            server.broadcast_spectators()
+        elapsed = time.perf_counter() - start
+    finally:
+        sio._send_eio_packet = send
+    return elapsed / count * 1e6, len(sent) // count
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    audience = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    room_id, players = prepare()
+
+    alone = send_pos(players, count)
+    spectators = []
+    for _ in range(audience):
+        spectator = server.socketio.test_client(server.app)
+        spectator.emit("spectate", {"room_id": room_id})
+        spectator.get_received()
+        spectators.append(spectator)
+    watched = send_pos(players, count)
+    tick, packets = broadcast(max(count // 20, 1))
+
+    print(f"玩家send_pos(无观战):      {alone:.1f}us/帧")
+    print(f"玩家send_pos({audience}人观战):  {watched:.1f}us/帧 ({watched / alone - 1:+.1%})")
+    print(
+        f"观战广播:                  {tick:.1f}us/次({packets}个包), 每秒最多"
+        f"{1 / server.SPECTATOR_INTERVAL:.0f}次, 占用{tick / 1e6 / server.SPECTATOR_INTERVAL:.2%}的CPU"
+    )
+
+
+if __name__ == "__main__":
+    main()
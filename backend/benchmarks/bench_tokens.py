@@ -0,0 +1,60 @@
+"""对比两种确认用户身份的方式：每次在user_info中查询用户是否存在，与验证签名令牌
+
+用法: python benchmarks/bench_tokens.py [次数] [吊销记录数]
+"""
+
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database  # noqa: E402
+from tokens import Claims, TokenSigner  # noqa: E402
+
+USERS = 10000
+
+
+def prepare(path):
+    db = Database(path)
+    with db.connection() as conn:
+        conn.execute(
+            "CREATE TABLE user_info (user_id INTEGER PRIMARY KEY AUTOINCREMENT, user_name TEXT)"
+        )
+        conn.executemany(
+            "INSERT INTO user_info (user_name) VALUES (?)", ((f"u{i}",) for i in range(USERS))
+        )
+    return db
+
+
+def per_call(func, count):
+    start = time.perf_counter()
+    for i in range(count):
+        func(i)
+    return (time.perf_counter() - start) / count * 1e6
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    revoked = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    db = prepare(os.path.join(tempfile.mkdtemp(prefix="starball-tokens-"), "tokens.db"))
+    signer = TokenSigner(os.urandom(32))
+    expires_at = int(time.time()) + 3600
+    signer.load_revoked((f"{i:016x}", expires_at) for i in range(revoked))
+    tokens = [signer.issue(i % USERS + 1)[0] for i in range(count)]
+
+    def lookup(i):
+        with db.connection() as conn:
+            conn.execute("SELECT 1 FROM user_info WHERE user_id = ?", (i % USERS + 1,)).fetchone()
+
+    print(f"查询user_info:           {per_call(lookup, count):8.1f}us/次")
+    print(f"验证令牌({revoked}条吊销):  {per_call(lambda i: signer.verify(tokens[i]), count):8.1f}us/次")
+    start = time.perf_counter()
+    for i in range(count):
+        signer.revoke(Claims(0, expires_at, f"r{i}"))
+    print(f"吊销:                    {(time.perf_counter() - start) / count * 1e6:8.1f}us/次")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""检查金币账本在写回时的一致性，不一致时以非零状态退出：
+只读流量下缓存的账户数不超过上限；数据库余额被外部修改后按数据库余额重放未写回的条目，
+写回期间新增的条目叠加在重放后的余额上；对局奖励随调用方的事务一同提交或回滚。
+每一步之后核对：每个用户账本条目的delta之和等于user_info.coins与缓存的余额，
+按entry_id排列的balance逐条等于累计余额
+
+用法: python benchmarks/check_ledger.py
+"""
+
+import os
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db import Database  # noqa: E402
+from ledger import CoinLedger, PurchaseRejected  # noqa: E402
+from migrations import migrate  # noqa: E402
+
+USERS = 50
+MAX_ACCOUNTS = 10
+
+
+def prepare(path):
+    db = Database(path)
+    with db.connection() as conn:
+        conn.execute(
+            """CREATE TABLE user_info (
+            user_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_name TEXT NOT NULL UNIQUE,
+            password_hash TEXT NOT NULL,
+            coins INTEGER NOT NULL DEFAULT 300,
+            total_games INTEGER NOT NULL DEFAULT 0,
+            win_games INTEGER NOT NULL DEFAULT 0,
+            bar_possess INTEGER NOT NULL DEFAULT 1,
+            head TEXT NOT NULL DEFAULT "")"""
+        )
+        conn.execute(
+            "CREATE TABLE room_info (room_id INTEGER PRIMARY KEY, player1_id, player2_id, state)"
+        )
+        conn.executemany(
+            "INSERT INTO user_info (user_name, password_hash) VALUES (?, '')",
+            [(f"u{i}",) for i in range(USERS)],
+        )
+        migrate(conn)
+    return db
+
+
+def inconsistencies(db, ledger):
+    """返回账本、user_info与缓存之间不一致的描述"""
+    problems = []
+    with db.connection() as conn:
+        coins = dict(conn.execute("SELECT user_id, coins FROM user_info").fetchall())
+        rows = conn.execute(
+            "SELECT user_id, delta, balance, entry_id FROM coin_ledger ORDER BY entry_id"
+        ).fetchall()
+    running = {}
+    for user_id, delta, balance, entry_id in rows:
+        running[user_id] = running.get(user_id, 0) + delta
+        if balance != running[user_id]:
+            problems.append(f"条目{entry_id}: balance {balance} != 累计 {running[user_id]}")
+    for user_id, value in coins.items():
+        if running.get(user_id, 0) != value:
+            problems.append(f"用户{user_id}: 账本合计 {running.get(user_id, 0)} != coins {value}")
+        account = ledger._accounts.get(user_id)
+        if account is not None and account.coins != value:
+            problems.append(f"用户{user_id}: 缓存 {account.coins} != coins {value}")
+    return problems
+
+
+def external_update(db, user_id, delta):
+    """模拟绕过缓存的写入(其他进程或人工修改)，同样记入账本"""
+    with db.connection() as conn:
+        (balance,) = conn.execute(
+            "UPDATE user_info SET coins = coins + ? WHERE user_id = ? RETURNING coins",
+            (delta, user_id),
+        ).fetchone()
+        conn.execute(
+            "INSERT INTO coin_ledger (user_id, delta, balance, reason, created_at) "
+            "VALUES (?, ?, ?, 'admin', 0)",
+            (user_id, delta, balance),
+        )
+
+
+def check_eviction(db, ledger):
+    """只读流量(没有任何待写条目)之后写回，缓存的账户数回到上限以内"""
+    for user_id in range(1, USERS + 1):
+        ledger.account(user_id)
+    ledger.flush()
+    if len(ledger) > MAX_ACCOUNTS:
+        return [f"只读流量后缓存了{len(ledger)}个账户，上限{MAX_ACCOUNTS}"]
+    return []
+
+
+def check_conflict(db, ledger):
+    """
+    缓存余额300的用户买一根250的球杆；写回前数据库余额被扣到100，写回期间又买了一根30的球杆：
+    第一笔购买在重放时被撤销并交给调用方通知用户，第二笔叠加在重放后的余额上
+    """
+    user_id = 1
+    ledger.account(user_id)
+    ledger.buy(user_id, 2, 250)
+    external_update(db, user_id, -200)
+    batch = ledger.take()
+    ledger.buy(user_id, 3, 30)
+    conflicts = ledger.write(batch)
+    problems = []
+    if conflicts != [user_id]:
+        problems.append(f"应重放用户{user_id}，实际重放 {conflicts}")
+    account = ledger.account(user_id)
+    if account.coins != 100 - 30 or account.bar_possess & 2 or not account.bar_possess & 4:
+        problems.append(f"重放后的缓存不正确: coins {account.coins} bar {account.bar_possess}")
+    rejected = ledger.take_rejected()
+    if rejected != [(user_id, 2)]:
+        problems.append(f"应撤销用户{user_id}购买的球杆2，实际撤销 {rejected}")
+    ledger.flush()
+    try:
+        ledger.buy(user_id, 2, 250)
+        problems.append("余额不足时购买应被拒绝")
+    except PurchaseRejected:
+        pass
+    ledger.buy(user_id, 4, 50)
+    ledger.flush()
+    return problems
+
+
+def check_grant(db, ledger):
+    """奖励所在的事务回滚时余额与队列不变；提交后奖励与此前未写回的购买一并入账"""
+    winner, loser = 2, 3
+    ledger.buy(winner, 2, 100)
+    rewards = ((winner, 100, "win"), (loser, 10, "lose"))
+    before = (ledger.account(winner).coins, ledger.account(loser).coins, ledger.pending())
+    try:
+        with db.connection() as conn:
+            ledger.grant(conn, rewards, 1)
+            raise RuntimeError("rollback")
+    except RuntimeError:
+        pass
+    problems = []
+    after = (ledger.account(winner).coins, ledger.account(loser).coins, ledger.pending())
+    if after != before:
+        problems.append(f"回滚后缓存或队列发生变化: {before} -> {after}")
+    with db.connection() as conn:
+        committed = ledger.grant(conn, rewards, 2)
+    committed()
+    if ledger.pending():
+        problems.append(f"提交后仍有{ledger.pending()}条未写回的条目")
+    return problems
+
+
+def main():
+    db = prepare(os.path.join(tempfile.mkdtemp(prefix="starball-ledger-check-"), "ledger.db"))
+    ledger = CoinLedger(db, max_accounts=MAX_ACCOUNTS)
+    failed = False
+    for name, check in (("淘汰", check_eviction), ("重放", check_conflict), ("奖励", check_grant)):
+        problems = check(db, ledger) + inconsistencies(db, ledger)
+        for problem in problems:
+            print(f"{name}: {problem}")
+        failed = failed or bool(problems)
+    if failed:
+        sys.exit(1)
+    print("金币账本与数据库一致")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+"""检查高频查询的执行计划，出现全表扫描时以非零状态退出；
+同时核对登记的SQL与各模块源码中的SQL字面量，登记的语句已不在源码中或源码中的语句未登记时同样失败
+
+用法: python benchmarks/check_query_plans.py
+"""
+
+import ast
+import glob
+import os
+import re
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix="starball-plan-")
+os.environ["STARBALL_DB"] = os.path.join(WORK_DIR, "plan.db")
+sys.path.insert(0, BACKEND_DIR)
+os.chdir(WORK_DIR)
+
+import server  # noqa: E402
+from migrations import full_scans, normalize, registered_queries  # noqa: E402
+
+STATEMENT = re.compile(r"(SELECT|INSERT|UPDATE|DELETE|REPLACE)\s+\S", re.IGNORECASE)
+
+
+def source_queries():
+    """收集后端各模块中的SQL字面量(相邻字符串已由解析器拼接)，迁移脚本除外"""
+    queries = {}
+    for path in sorted(glob.glob(os.path.join(BACKEND_DIR, "*.py"))):
+        name = os.path.basename(path)
+        if name == "migrations.py":
+            continue
+        with open(path, encoding="utf-8") as source:
+            tree = ast.parse(source.read(), path)
+        for node in ast.walk(tree):
+            if isinstance(node, ast.JoinedStr) and any(
+                isinstance(part, ast.Constant) and STATEMENT.match(part.value.lstrip())
+                for part in node.values
+            ):
+                queries[f"<f-string {name}:{node.lineno}>"] = f"{name}:{node.lineno}"
+            elif (
+                isinstance(node, ast.Constant)
+                and isinstance(node.value, str)
+                and STATEMENT.match(node.value.lstrip())
+            ):
+                queries[normalize(node.value)] = f"{name}:{node.lineno}"
+    return queries
+
+
+def main():
+    server.logger.disabled = True
+    server.initialize_table()
+    with server.db.connection() as conn:
+        scans = full_scans(conn)
+    for sql, details in scans:
+        print(f"SCAN: {sql}\n    {details}")
+
+    found = source_queries()
+    registered = registered_queries()
+    stale = sorted(registered - set(found))
+    missing = sorted(set(found) - registered)
+    for sql in stale:
+        print(f"已不在源码中: {sql}")
+    for sql in missing:
+        print(f"未登记({found[sql]}): {sql}")
+    if scans or stale or missing:
+        sys.exit(1)
+    print(f"所有高频查询均使用索引，登记的{len(registered)}条语句与源码一致")
+
+
+if __name__ == "__main__":
+    main()
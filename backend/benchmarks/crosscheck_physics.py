@@ -0,0 +1,109 @@
+"""用固定随机种子对比Python物理引擎与前端TS引擎(dist编译产物)的模拟结果
+
+用法: python benchmarks/crosscheck_physics.py [种子数量]
+需要node，且已执行 npm run build 生成 dist/GameLogic
+"""
+
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIST_DIR = os.path.join(os.path.dirname(BACKEND_DIR), "dist", "GameLogic", "physics")
+sys.path.insert(0, BACKEND_DIR)
+
+from physics import MAX_FRAMES, initial_rack, shot_force, simulate_shot  # noqa: E402
+
+# 按前端 Game.update 的方式逐帧推进，直到所有球静止
+RUNNER = """
+import { readFileSync } from "fs";
+import { PhysicsWorld } from "./PhysicsWorld.js";
+import { Ball } from "./Ball.js";
+console.log = () => {};
+const shots = JSON.parse(readFileSync(0, "utf8"));
+const out = shots.map(({ ids, positions, force, maxFrames }) => {
+  const world = new PhysicsWorld();
+  ids.forEach((id, k) => world.addBall(new Ball(id, { x: positions[k][0], y: positions[k][1] })));
+  world.resetTurnData();
+  world.applyForce(0, { x: force[0], y: force[1] });
+  for (let f = 0; f < maxFrames; f++) {
+    world.step(1 / 60);
+    if (world.isAllBallsStationary()) break;
+  }
+  return { states: world.getBallStates(), turn: world.getTurnData() };
+});
+process.stdout.write(JSON.stringify(out));
+"""
+
+
+def run_ts(shots):
+    """在临时目录中以ES模块方式加载dist产物并执行模拟"""
+    work = tempfile.mkdtemp(prefix="starball-ts-")
+    for name in os.listdir(DIST_DIR):
+        if name.endswith(".js"):
+            # dist中Ball.js的文件名大小写与import不一致
+            target = "Ball.js" if name.lower() == "ball.js" else name
+            shutil.copy(os.path.join(DIST_DIR, name), os.path.join(work, target))
+    with open(os.path.join(work, "package.json"), "w", encoding="utf-8") as f:
+        f.write('{"type": "module"}')
+    with open(os.path.join(work, "runner.js"), "w", encoding="utf-8") as f:
+        f.write(RUNNER)
+    proc = subprocess.run(
+        ["node", "runner.js"],
+        input=json.dumps(shots),
+        capture_output=True,
+        text=True,
+        cwd=work,
+        check=True,
+    )
+    return json.loads(proc.stdout)
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    ids, positions = initial_rack()
+    shots = []
+    for seed in range(count):
+        rng = random.Random(seed)
+        angle = rng.uniform(0, 360)
+        power = rng.uniform(10, 100)
+        shots.append(
+            {
+                "ids": ids,
+                "positions": positions,
+                "force": shot_force(angle, power),
+                "maxFrames": MAX_FRAMES,
+                "angle": angle,
+                "power": power,
+            }
+        )
+
+    expected = run_ts(shots)
+    worst = 0.0
+    mismatches = 0
+    for seed, (shot, ts) in enumerate(zip(shots, expected)):
+        world = simulate_shot(ids, positions, shot["angle"], shot["power"])
+        turn = world.turn_data()
+        error = max(
+            max(abs(s["position"]["x"] - x), abs(s["position"]["y"] - y))
+            for s, (x, y) in zip(ts["states"], world.pos)
+        )
+        worst = max(worst, error)
+        same_turn = (
+            sorted(turn["pocketedBallIds"]) == sorted(ts["turn"]["pocketedBallIds"])
+            and turn["firstBallHit"] == ts["turn"]["firstBallHit"]
+            and turn["cueBallPocketed"] == ts["turn"]["cueBallPocketed"]
+        )
+        if error > 1e-6 or not same_turn:
+            mismatches += 1
+            print(f"seed={seed} 最大位置误差={error:.3g} 回合数据一致={same_turn}")
+    print(f"{count}个种子, {mismatches}个不一致, 最大位置误差={worst:.3g}")
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,547 @@
+"""本地压测：在临时数据库上启动服务器，模拟N名玩家注册、登录、购买、建房/加入后持续击球与发送位置
+
+统计每类请求的吞吐量与p50/p95/p99延迟，以及消息转发到对手的延迟；结果与提交的基线比较，
+p95退化超过阈值、出现错误或转发丢失时返回非零，可作为性能改动的回归门禁。
+
+用法:
+    python benchmarks/loadgen.py                     # 按基线中的场景运行并比较
+    python benchmarks/loadgen.py --save              # 运行并覆盖基线
+    python benchmarks/loadgen.py --users 40 --duration 20 --no-check
+    python benchmarks/loadgen.py --flood 1           # 另加1个房间不受限地洪泛，正常房间仍与基线比较
+"""
+
+import argparse
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+import socketio
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "loadgen_baseline.json")
+
+# 默认场景：4个房间，双方约20Hz发送位置，每2秒击球一次；压测端与服务器共用本机CPU，
+# 负载过高时测到的主要是压测端自身的排队
+DEFAULTS = {"users": 8, "duration": 10.0, "pos_hz": 20.0, "shoot_every": 2.0}
+
+# 洪泛房间中一方每秒发送的位置帧与击球次数，远超服务器的限流
+FLOOD_POS_HZ = 500
+FLOOD_SHOOT_HZ = 20
+
+# 比较基线时允许的p95相对退化与绝对余量(毫秒)，本地运行的抖动较大
+TOLERANCE = 0.5
+SLACK_MS = 2.0
+
+# 转发事件：发送方事件 -> (发送方收到的确认事件, 对手收到的转发事件)
+STREAMS = {
+    "shoot": ("shoot_success", "opponent_hit"),
+    "send_pos": ("send_success", "opponent_pos"),
+}
+
+
+def serve(port):
+    """在子进程中运行服务器，工作目录与数据库由父进程准备"""
+    sys.path.insert(0, BACKEND_DIR)
+    import server
+
+    server.initialize_table()
+    server.catalog.load()
+    server.rooms.load()
+    server.leaderboard.load()
+    server.socketio.start_background_task(server.run_reaper)
+    server.socketio.start_background_task(server.run_replay_writer)
+    server.socketio.start_background_task(server.run_ledger_writer)
+    server.socketio.run(server.app, host="127.0.0.1", port=port, log_output=False)
+
+
+def server_timings(base_url):
+    """从/metrics读取服务器端每个socket事件与HTTP接口的处理次数和平均耗时(毫秒)"""
+    sums, counts = {}, {}
+    text = requests.get(base_url + "/metrics", timeout=5).text
+    for line in text.splitlines():
+        for family, label in (
+            ("starball_socket_event_seconds", "event"),
+            ("starball_http_request_seconds", "endpoint"),
+        ):
+            if not line.startswith((family + "_sum{", family + "_count{")):
+                continue
+            series, value = line.rsplit(" ", 1)
+            name = "server." + series.split(f'{label}="', 1)[1].split('"', 1)[0]
+            target = sums if "_sum{" in series else counts
+            target[name] = float(value)
+    return {
+        name: {"count": int(counts[name]), "mean": round(sums[name] / counts[name] * 1000, 3)}
+        for name in sorted(sums)
+        if counts.get(name) and name != "server.show_metrics"
+    }
+
+
+def percentile(samples, p):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * p))]
+
+
+class Recorder:
+    """线程安全地收集各指标的耗时(毫秒)与错误计数"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.errors = {}
+
+    def record(self, name, elapsed_ms):
+        with self.lock:
+            self.samples.setdefault(name, []).append(elapsed_ms)
+
+    def error(self, name):
+        with self.lock:
+            self.errors[name] = self.errors.get(name, 0) + 1
+
+
+def position_marker(data):
+    """位置消息中0号球的横坐标，用来对应发送与转发；其他消息返回None"""
+    if isinstance(data, dict) and data.get("balls"):
+        return data["balls"][0]["ball_posx"]
+    return None
+
+
+class Player:
+    """一名模拟玩家：HTTP会话 + socket.io连接"""
+
+    def __init__(self, base_url, name, recorder, seed):
+        self.base_url = base_url
+        self.name = name
+        self.recorder = recorder
+        # 每名玩家使用固定种子，服务器端的物理与规则也是确定的，多次运行的对局过程基本一致
+        self.random = random.Random(seed)
+        self.http = requests.Session()
+        self.user_id = None
+        self.token = None
+        self.opponent = None
+        # 服务器裁定的击球权；等待回合结果的击球时刻；对局结算后停止发送
+        self.my_turn = False
+        self.shot_at = None
+        self.finished = False
+        self.sio = socketio.Client(reconnection=False)
+        # 已发送、尚未收到确认的时刻；对手发来、尚未收到转发的时刻
+        self.unacked = {event: deque() for event in STREAMS}
+        self.inbound = {relayed: deque() for _, relayed in STREAMS.values()}
+        for event, (ack, relayed) in STREAMS.items():
+            self.sio.on(ack, self._receiver(f"ack.{event}", self.unacked[event]))
+            self.sio.on(relayed, self._receiver(f"relay.{relayed}", self.inbound[relayed]))
+        self.sio.on("turn_result", self._turn_result)
+        self.sio.on("game_settled", self._settled)
+        self.sio.on("fail", self._fail)
+
+    def _receiver(self, name, pending):
+        def receive(data=None):
+            now = time.perf_counter()
+            if self.finished:
+                return
+            marker = position_marker(data)
+            try:
+                sent, expected = pending.popleft()
+                # 接收方积压时服务器只转发最新局面，之前的位置帧被合并，不算丢失
+                while marker is not None and abs(expected - marker) > 0.01:
+                    self.recorder.error(f"{name}.coalesced")
+                    sent, expected = pending.popleft()
+            except IndexError:
+                self.recorder.error(f"{name}.unexpected")
+                return
+            self.recorder.record(name, (now - sent) * 1000)
+
+        return receive
+
+    def _turn_result(self, data):
+        if self.shot_at is not None:
+            self.recorder.record("turn.shoot", (time.perf_counter() - self.shot_at) * 1000)
+            self.shot_at = None
+        self.my_turn = data["nextPlayerId"] == self.user_id
+
+    def _settled(self, data=None):
+        """打进8号球后对局结束，丢弃尚未确认的消息"""
+        self.finished = True
+        self.recorder.error("game_settled")
+        for pending in (*self.unacked.values(), *self.inbound.values()):
+            pending.clear()
+
+    def _fail(self, data=None):
+        if not self.finished:
+            self.recorder.error("socket.fail")
+
+    def post(self, name, path, payload, retries=20):
+        """发送HTTP请求并记录耗时，服务繁忙(503)时退避重试"""
+        for attempt in range(retries):
+            start = time.perf_counter()
+            resp = self.http.post(self.base_url + path, json=payload)
+            self.recorder.record(f"http.{name}", (time.perf_counter() - start) * 1000)
+            if resp.status_code != 503:
+                break
+            self.recorder.error(f"http.{name}.503")
+            time.sleep(0.05 * (attempt + 1))
+        if not 200 <= resp.status_code < 300:
+            self.recorder.error(f"http.{name}.{resp.status_code}")
+            raise RuntimeError(f"{path} 返回 {resp.status_code}: {resp.text}")
+        return resp.json()["data"]
+
+    def sign_up(self):
+        self.post("register", "/api/auth/register", {"user_name": self.name, "password": "pw"})
+        data = self.post("login", "/api/auth/login", {"user_name": self.name, "password": "pw"})
+        self.user_id, self.token = data["user_id"], data["token"]
+        self.http.headers["Authorization"] = f"Bearer {self.token}"
+        self.post("buy", "/api/auth/buy", {"user_id": self.user_id, "bar_id": 6})
+
+    def enter(self, room_id):
+        """建立socket连接并进入房间，使用ack等待服务器完成绑定"""
+        self.sio.connect(self.base_url, transports=["websocket"], auth={"token": self.token})
+        start = time.perf_counter()
+        self.sio.call("join_room", {"user_id": self.user_id, "room_id": room_id}, timeout=10)
+        self.recorder.record("socket.join_room", (time.perf_counter() - start) * 1000)
+
+    def emit(self, event, data):
+        now = time.perf_counter()
+        self.unacked[event].append((now, None))
+        self.opponent.inbound[STREAMS[event][1]].append((now, position_marker(data)))
+        self.sio.emit(event, data)
+
+    def stream(self, deadline, pos_hz, shoot_every):
+        """按设定频率发送位置，轮到自己时每隔shoot_every秒击球一次，起始时刻随机错开"""
+        pos_interval = 1.0 / pos_hz
+        now = time.perf_counter()
+        next_pos = now + self.random.uniform(0, pos_interval)
+        next_shoot = now + self.random.uniform(0, shoot_every)
+        while not self.finished:
+            due = min(next_pos, next_shoot)
+            if due >= deadline:
+                return
+            delay = due - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            if due == next_shoot:
+                if self.my_turn:
+                    self.my_turn = False
+                    self.shot_at = time.perf_counter()
+                    angle = self.random.uniform(0, 360)
+                    self.emit("shoot", {"user_id": self.user_id, "angle": angle, "power": 50})
+                next_shoot += shoot_every
+            else:
+                balls = [
+                    {
+                        "ball_id": ball_id,
+                        "ball_posx": self.random.uniform(0, 800),
+                        "ball_posy": self.random.uniform(0, 400),
+                    }
+                    for ball_id in range(16)
+                ]
+                self.emit("send_pos", {"user_id": self.user_id, "balls": balls})
+                next_pos += pos_interval
+
+    def flood(self, deadline, pos_hz, shoot_hz):
+        """不等待确认、不看回合，按固定高频发送位置与击球"""
+        balls = [{"ball_id": ball_id, "ball_posx": 400, "ball_posy": 200} for ball_id in range(16)]
+        shoot_every = max(int(pos_hz / shoot_hz), 1)
+        interval = 1.0 / pos_hz
+        sent = 0
+        next_at = time.perf_counter()
+        while next_at < deadline:
+            delay = next_at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.sio.emit("send_pos", {"user_id": self.user_id, "balls": balls})
+            if sent % shoot_every == 0:
+                self.sio.emit("shoot", {"user_id": self.user_id, "angle": 90, "power": 50})
+            sent += 1
+            next_at += interval
+        return sent
+
+    def pending(self):
+        if self.finished:
+            return 0
+        return sum(len(q) for q in self.unacked.values()) + sum(
+            len(q) for q in self.inbound.values()
+        )
+
+
+def set_up_pair(base_url, prefix, index, recorder):
+    """注册两名玩家，由第一名玩家建房，第二名玩家加入，双方进入房间"""
+    host = Player(base_url, f"{prefix}_{index}a", recorder, index * 2)
+    guest = Player(base_url, f"{prefix}_{index}b", recorder, index * 2 + 1)
+    host.opponent, guest.opponent = guest, host
+    # 第一杆由房间创建者击球
+    host.my_turn = True
+    host.sign_up()
+    guest.sign_up()
+    room_id = host.post("room_create", "/api/room/create", {"user_id": host.user_id})["room_id"]
+    guest.post("room_join", "/api/room/join", {"user_id": guest.user_id, "room_id": room_id})
+    host.enter(room_id)
+    guest.enter(room_id)
+    return host, guest
+
+
+def flood_child(base_url, prefix, index):
+    """
+    洪泛房间的子进程：以最低优先级运行，相当于压测端之外的客户端，
+    只有服务器处理洪泛的开销与正常玩家争用CPU。就绪后从stdin读取持续时间，结束时输出发送的位置帧数
+    """
+    os.nice(19)
+    flooder, victim = set_up_pair(base_url, prefix, index, Recorder())
+    print("ready", flush=True)
+    duration = float(sys.stdin.readline())
+    sent = flooder.flood(time.perf_counter() + duration, FLOOD_POS_HZ, FLOOD_SHOOT_HZ)
+    print(sent, flush=True)
+    flooder.sio.disconnect()
+    victim.sio.disconnect()
+
+
+def start_flooder(base_url, prefix, index):
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--flood-child", base_url, prefix, str(index)],
+        stdin=subprocess.PIPE,
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    if process.stdout.readline().strip() != "ready":
+        process.kill()
+        raise RuntimeError("洪泛客户端启动失败")
+    return process
+
+
+def rejected_events(base_url):
+    """从/metrics读取被限流丢弃的事件数与积压时合并的转发数"""
+    counts = {}
+    text = requests.get(base_url + "/metrics", timeout=5).text
+    for line in text.splitlines():
+        for family in ("starball_rate_limited_total", "starball_coalesced_messages_total"):
+            if line.startswith(family + "{"):
+                series, value = line.rsplit(" ", 1)
+                name = series.split('event="', 1)[1].split('"', 1)[0]
+                kind = "rejected" if family == "starball_rate_limited_total" else "coalesced"
+                counts[f"{kind}.{name}"] = int(float(value))
+    return counts
+
+
+def start_server(work_dir, port):
+    env = dict(
+        os.environ,
+        STARBALL_DB=os.path.join(work_dir, "load.db"),
+        STARBALL_HEAD_DIR=os.path.join(work_dir, "head"),
+        STARBALL_WORKERS="1",
+        STARBALL_LOG_LEVEL=os.environ.get("STARBALL_LOG_LEVEL", "WARNING"),
+    )
+    log = open(os.path.join(work_dir, "server.out"), "wb")
+    process = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", str(port)],
+        cwd=work_dir,
+        env=env,
+        stdout=log,
+        stderr=subprocess.STDOUT,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服务器启动失败，见 {log.name}")
+        try:
+            requests.get(base_url + "/metrics", timeout=1)
+            return process, base_url
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("等待服务器启动超时")
+
+
+def run(config, port):
+    """执行一次完整场景，返回结果字典"""
+    work_dir = tempfile.mkdtemp(prefix="starball-load-")
+    process, base_url = start_server(work_dir, port)
+    recorder = Recorder()
+    players = []
+    flooders = []
+    try:
+        pairs = config["users"] // 2
+        prefix = f"load{os.getpid()}"
+        setup_start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=pairs) as pool:
+            for host, guest in pool.map(
+                lambda i: set_up_pair(base_url, prefix, i, recorder), range(pairs)
+            ):
+                players += [host, guest]
+        setup_seconds = time.perf_counter() - setup_start
+        flooders = [
+            start_flooder(base_url, f"{prefix}f", pairs + index)
+            for index in range(config.get("flood", 0))
+        ]
+
+        stream_start = time.perf_counter()
+        deadline = stream_start + config["duration"]
+        threads = [
+            threading.Thread(
+                target=player.stream,
+                args=(deadline, config["pos_hz"], config["shoot_every"]),
+            )
+            for player in players
+        ]
+        for flooder in flooders:
+            flooder.stdin.write(f"{config['duration']}\n")
+            flooder.stdin.flush()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        # 等待在途消息送达
+        drain_deadline = time.perf_counter() + 5
+        while time.perf_counter() < drain_deadline and any(p.pending() for p in players):
+            time.sleep(0.05)
+        stream_seconds = time.perf_counter() - stream_start
+        lost = sum(player.pending() for player in players)
+        server = server_timings(base_url)
+        rejected = rejected_events(base_url)
+        for flooder in flooders:
+            rejected["flood.sent"] = rejected.get("flood.sent", 0) + int(flooder.stdout.readline())
+    finally:
+        for flooder in flooders:
+            flooder.kill()
+        for player in players:
+            player.sio.disconnect()
+        process.terminate()
+        process.wait(10)
+
+    results = {}
+    for name, samples in sorted(recorder.samples.items()):
+        seconds = stream_seconds if name.startswith(("ack.", "relay.", "turn.")) else setup_seconds
+        results[name] = {
+            "count": len(samples),
+            "throughput": round(len(samples) / seconds, 1),
+            "p50": round(percentile(samples, 0.5), 2),
+            "p95": round(percentile(samples, 0.95), 2),
+            "p99": round(percentile(samples, 0.99), 2),
+        }
+    return {
+        "config": config,
+        "metrics": results,
+        "server": server,
+        "errors": dict(sorted(recorder.errors.items())),
+        "lost": lost,
+        "rejected": rejected,
+    }
+
+
+def report(result):
+    print(f"场景: {json.dumps(result['config'], ensure_ascii=False)}")
+    print(f"{'指标':<24}{'次数':>8}{'次/秒':>10}{'p50':>10}{'p95':>10}{'p99':>10}")
+    for name, row in result["metrics"].items():
+        print(
+            f"{name:<26}{row['count']:>8}{row['throughput']:>10}"
+            f"{row['p50']:>10.2f}{row['p95']:>10.2f}{row['p99']:>10.2f}"
+        )
+    print(f"{'服务器端处理':<20}{'次数':>8}{'平均ms':>10}")
+    for name, row in result["server"].items():
+        print(f"{name:<26}{row['count']:>8}{row['mean']:>10.3f}")
+    print(f"错误与结算: {result['errors'] or '无'}  未送达: {result['lost']}")
+    print(f"限流与合并: {result.get('rejected') or '无'}")
+
+
+def check(result, baseline, tolerance, slack):
+    """与基线比较，返回退化项的说明列表"""
+    problems = []
+    for name, base in baseline["metrics"].items():
+        row = result["metrics"].get(name)
+        if row is None:
+            problems.append(f"{name}: 缺少样本")
+            continue
+        limit = base["p95"] * (1 + tolerance) + slack
+        if row["p95"] > limit:
+            problems.append(f"{name}: p95 {row['p95']:.2f}ms > {limit:.2f}ms (基线 {base['p95']:.2f}ms)")
+        if name.startswith(("ack.", "relay.")) and row["count"] < base["count"] * (1 - tolerance):
+            problems.append(f"{name}: 送达 {row['count']} 条，基线 {base['count']} 条")
+    for name, base in baseline.get("server", {}).items():
+        row = result["server"].get(name)
+        # 服务器端耗时不含网络与压测端排队，余量按平均值的量级取十分之一
+        limit = base["mean"] * (1 + tolerance) + slack / 10
+        if row is not None and row["mean"] > limit:
+            problems.append(f"{name}: 平均 {row['mean']:.3f}ms > {limit:.3f}ms (基线 {base['mean']:.3f}ms)")
+    # 服务繁忙时的重试、积压时合并的位置帧与对局正常结束不算错误，其余错误与丢失的转发都视为失败
+    errors = {
+        name: count
+        for name, count in result["errors"].items()
+        if not name.endswith((".503", ".coalesced")) and name != "game_settled"
+    }
+    if errors:
+        problems.append(f"出现错误: {errors}")
+    if result["lost"]:
+        problems.append(f"{result['lost']} 条消息未收到确认或转发")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--flood-child", nargs=3, help=argparse.SUPPRESS)
+    parser.add_argument("--users", type=int)
+    parser.add_argument("--duration", type=float)
+    parser.add_argument("--pos-hz", type=float)
+    parser.add_argument("--shoot-every", type=float)
+    parser.add_argument("--flood", type=int, default=0, help="额外洪泛的房间数，不计入结果")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--save", action="store_true", help="把本次结果写为基线")
+    parser.add_argument("--no-check", action="store_true", help="不与基线比较")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--slack", type=float, default=SLACK_MS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve)
+        return
+    if args.flood_child:
+        base_url, prefix, index = args.flood_child
+        flood_child(base_url, prefix, int(index))
+        return
+
+    baseline = None
+    if os.path.exists(BASELINE):
+        with open(BASELINE, encoding="utf-8") as handle:
+            baseline = json.load(handle)
+    # 未指定的参数沿用基线的场景，保证比较的是同一负载
+    config = dict(baseline["config"] if baseline else DEFAULTS)
+    for key in DEFAULTS:
+        value = getattr(args, key)
+        if value is not None:
+            config[key] = value
+    if config["users"] < 2 or config["users"] % 2:
+        parser.error("--users 必须是不小于2的偶数")
+    if args.flood:
+        if args.save:
+            parser.error("--flood 的结果不能作为基线")
+        config["flood"] = args.flood
+
+    result = run(config, args.port)
+    report(result)
+
+    if args.save:
+        with open(BASELINE, "w", encoding="utf-8") as handle:
+            json.dump(result, handle, ensure_ascii=False, indent=2)
+            handle.write("\n")
+        print(f"基线已写入 {BASELINE}")
+        return
+    if args.no_check or baseline is None:
+        return
+    if baseline["config"] != {key: config[key] for key in baseline["config"]}:
+        print("场景与基线不同，跳过比较")
+        return
+    problems = check(result, baseline, args.tolerance, args.slack)
+    for problem in problems:
+        print(f"退化: {problem}")
+    if problems:
+        sys.exit(1)
+    print("与基线相比未发现退化")
+
+
+if __name__ == "__main__":
+    main()
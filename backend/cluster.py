@@ -0,0 +1,147 @@
+"""多进程部署：跨进程消息队列、共享的sid目录与房间亲和性
+
+STARBALL_WORKERS       工作进程数量，默认1(单进程，不启用消息队列)
+STARBALL_MQ            消息队列地址：redis://、amqp:// 等交给 Flask-SocketIO 处理，
+                       unix:///目录 为基于Unix数据报套接字的本机实现，供测试与单机部署使用
+STARBALL_WORKER_PORT   工作进程专属端口的起始值，第i个进程额外监听 该值+i，用于房间亲和
+"""
+
+import os
+import socket
+import subprocess
+import sys
+import uuid
+import socketio
+import fast_json
+
+WORKERS = int(os.environ.get("STARBALL_WORKERS", "1"))
+MQ_URL = os.environ.get("STARBALL_MQ") or (
+    "unix:///tmp/starball-mq" if WORKERS > 1 else None
+)
+WORKER_PORT = int(os.environ.get("STARBALL_WORKER_PORT", "5100"))
+
+# 当前进程的编号，由 supervise 启动工作进程时通过环境变量传入；None 表示主进程
+_index = os.environ.get("STARBALL_WORKER_INDEX")
+worker_index = int(_index) if _index is not None else None
+
+
+class UnixSocketManager(socketio.PubSubManager):
+    """
+    本机消息队列：每个进程在同一目录下绑定一个Unix数据报套接字，
+    发布消息时发送给目录中的所有套接字
+    """
+
+    name = "unix"
+
+    def __init__(self, url, channel="socketio", write_only=False, logger=None):
+        super().__init__(channel=channel, write_only=write_only, logger=logger)
+        self.directory = url[len("unix://"):]
+        os.makedirs(self.directory, exist_ok=True)
+        self.path = os.path.join(self.directory, f"{uuid.uuid4().hex}.sock")
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        if not write_only:
+            self.sock.bind(self.path)
+
+    def _peers(self):
+        return [
+            os.path.join(self.directory, name)
+            for name in os.listdir(self.directory)
+            if name.endswith(".sock")
+        ]
+
+    def _publish(self, data):
+        packed = fast_json.dumps_bytes({"channel": self.channel, "data": data})
+        for peer in self._peers():
+            if peer == self.path:
+                continue
+            try:
+                self.sock.sendto(packed, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # 对应的进程已经退出，清理残留的套接字文件
+                try:
+                    os.unlink(peer)
+                except OSError:
+                    pass
+
+    def _listen(self):
+        while True:
+            packed = self.sock.recv(1 << 20)
+            message = fast_json.loads(packed)
+            if message.get("channel") == self.channel:
+                yield message["data"]
+
+
+def socketio_options():
+    """根据配置返回创建SocketIO时需要的消息队列参数"""
+    if not MQ_URL:
+        return {}
+    if MQ_URL.startswith("unix://"):
+        return {"client_manager": UnixSocketManager(MQ_URL)}
+    return {"message_queue": MQ_URL}
+
+
+def affinity_port(room_id):
+    """房间所属工作进程的专属端口；两名玩家连接同一端口即可在同一进程内对局"""
+    if WORKERS <= 1:
+        return None
+    return WORKER_PORT + room_id % WORKERS
+
+
+class SidDirectory:
+    """所有工作进程共享的 用户 -> sid 目录，保存在数据库的user_session表中"""
+
+    def __init__(self, db):
+        self.db = db
+
+    def bind(self, user_id, sid):
+        """记录用户当前连接所在的sid"""
+        with self.db.connection() as conn:
+            conn.execute(
+                "INSERT INTO user_session (user_id, sid, worker) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET sid = excluded.sid, worker = excluded.worker",
+                (user_id, sid, worker_index or 0),
+            )
+
+    def lookup(self, user_id):
+        """查找用户的sid，未连接时返回None"""
+        with self.db.connection() as conn:
+            row = conn.execute(
+                "SELECT sid FROM user_session WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def unbind(self, user_id, sid):
+        """用户断开连接时移除记录，sid已被新连接覆盖时保留"""
+        with self.db.connection() as conn:
+            conn.execute(
+                "DELETE FROM user_session WHERE user_id = ? AND sid = ?", (user_id, sid)
+            )
+
+
+def supervise():
+    """启动WORKERS个工作进程并等待其退出，任一进程退出时结束全部进程"""
+    children = []
+    for index in range(WORKERS):
+        env = dict(os.environ, STARBALL_WORKER_INDEX=str(index))
+        children.append(subprocess.Popen([sys.executable, *sys.argv], env=env))
+    try:
+        os.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for child in children:
+            if child.poll() is None:
+                child.terminate()
+        for child in children:
+            child.wait()
+
+
+def serve(app, host, port):
+    """工作进程：与其他进程共同监听port(SO_REUSEPORT)，并监听自己的专属端口"""
+    import eventlet
+    import eventlet.wsgi
+
+    shared = eventlet.listen((host, port), reuse_port=True)
+    dedicated = eventlet.listen((host, WORKER_PORT + worker_index))
+    eventlet.spawn(eventlet.wsgi.server, dedicated, app)
+    eventlet.wsgi.server(shared, app)
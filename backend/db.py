@@ -0,0 +1,91 @@
+"""数据库访问层：有界连接池、WAL日志模式与统一的连接参数"""
+
+import os
+import queue
+import sqlite3 as sq
+from contextlib import contextmanager
+
+# 数据库路径与连接池大小均可通过环境变量配置
+DB_PATH = os.environ.get("STARBALL_DB", "starball.db")
+POOL_SIZE = int(os.environ.get("STARBALL_DB_POOL", "8"))
+
+# 每个连接建立时执行的调优参数
+PRAGMAS = (
+    "PRAGMA foreign_keys = ON",
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 268435456",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA busy_timeout = 5000",
+)
+
+# 每个连接缓存的预编译语句数量
+STATEMENT_CACHE = 256
+
+
+class Database:
+    """SQLite连接池；连接在绿色线程间复用，池满时借用方阻塞等待"""
+
+    def __init__(self, path=DB_PATH, size=POOL_SIZE, factory=sq.Connection):
+        self.path = path
+        self.size = size
+        self.factory = factory
+        self._idle = queue.LifoQueue(maxsize=size)
+        self._created = 0
+        with sq.connect(path) as conn:
+            conn.execute("PRAGMA journal_mode = WAL")
+
+    def _connect(self):
+        """建立一个新连接并应用调优参数"""
+        conn = sq.connect(
+            self.path,
+            check_same_thread=False,
+            cached_statements=STATEMENT_CACHE,
+            factory=self.factory,
+        )
+        conn.row_factory = sq.Row
+        for pragma in PRAGMAS:
+            conn.execute(pragma)
+        return conn
+
+    def _acquire(self):
+        """从池中取出连接，池未满时按需新建"""
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        if self._created < self.size:
+            self._created += 1
+            try:
+                return self._connect()
+            except sq.Error:
+                self._created -= 1
+                raise
+        return self._idle.get()
+
+    def in_use(self):
+        """当前被借出的连接数"""
+        return self._created - self._idle.qsize()
+
+    @contextmanager
+    def connection(self):
+        """借用一个连接：正常退出时提交，出现异常时回滚，最后归还连接池"""
+        conn = self._acquire()
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            self._idle.put(conn)
+
+    def close(self):
+        """关闭池中所有空闲连接"""
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            self._created -= 1
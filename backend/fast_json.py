@@ -0,0 +1,84 @@
+"""JSON编解码：安装了orjson时使用orjson，否则使用标准库；HTTP响应、socket包与进程间消息共用同一实现
+
+两种实现的输出格式一致：紧凑、不排序键、非ASCII字符直接以UTF-8输出。
+
+STARBALL_JSON  强制使用的实现(orjson/stdlib)，默认自动选择；用于对比两种实现或排查兼容问题
+"""
+
+import json
+import os
+from functools import lru_cache
+
+from flask.json.provider import DefaultJSONProvider, _default
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+if os.environ.get("STARBALL_JSON", "orjson" if orjson else "stdlib") == "orjson" and orjson:
+    BACKEND = "orjson"
+    _OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps_bytes(obj):
+        """编码为UTF-8字节串"""
+        return orjson.dumps(obj, default=_default, option=_OPTIONS)
+
+    def dumps(obj):
+        """编码为字符串"""
+        return orjson.dumps(obj, default=_default, option=_OPTIONS).decode("utf-8")
+
+    loads = orjson.loads
+else:
+    BACKEND = "stdlib"
+    _encoder = json.JSONEncoder(ensure_ascii=False, separators=(",", ":"), default=_default)
+
+    def dumps_bytes(obj):
+        """编码为UTF-8字节串"""
+        return _encoder.encode(obj).encode("utf-8")
+
+    def dumps(obj):
+        """编码为字符串"""
+        return _encoder.encode(obj)
+
+    loads = json.loads
+
+
+@lru_cache(maxsize=256)
+def envelope(message, error=""):
+    """data为空的固定响应体 {"message","data","error"}，同一组参数只编码一次；参数应为常量"""
+    return dumps_bytes({"message": message, "data": {}, "error": error})
+
+
+class FastJSONProvider(DefaultJSONProvider):
+    """Flask的JSON实现：jsonify、request.get_json与app.json.dumps都经过这里"""
+
+    def dumps(self, obj, **kwargs):
+        # 显式传入格式参数时按标准库的语义处理
+        if kwargs:
+            return super().dumps(obj, **kwargs)
+        return dumps(obj)
+
+    def loads(self, s, **kwargs):
+        if kwargs:
+            return super().loads(s, **kwargs)
+        return loads(s)
+
+    def response(self, *args, **kwargs):
+        # 调试模式下保留Flask默认的缩进输出
+        if self.compact is False or (self.compact is None and self._app.debug):
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(dumps_bytes(obj), mimetype=self.mimetype)
+
+
+class SocketJSON:
+    """作为SocketIO的json参数：接口与标准库json模块相同，忽略格式参数"""
+
+    @staticmethod
+    def dumps(obj, *args, **kwargs):
+        return dumps(obj)
+
+    @staticmethod
+    def loads(s, *args, **kwargs):
+        return loads(s)
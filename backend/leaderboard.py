@@ -0,0 +1,200 @@
+"""排行榜：启动时从user_info构建，之后随注册与对局结算增量更新
+
+排名顺序为胜场多者在前，胜场相同时对局数少者在前，再按user_id。内存中按胜场分桶，
+每个桶是按 (对局数, user_id) 排序的列表，桶的人数记在以胜场为下标的树状数组中，
+查询名次与按名次定位都只需要一次树状数组操作加一次桶内二分。
+前N名的响应按N缓存序列化结果，只有前MAX_TOP名发生变化时才失效
+"""
+
+import json
+from bisect import bisect_left, insort
+
+# 可查询的前N名上限，也是缓存失效的判断范围
+MAX_TOP = 100
+# 树状数组的最小容量(可容纳的最大胜场+1)，不够时按2倍扩容
+MIN_CAPACITY = 64
+
+
+class Leaderboard:
+    """所有用户的名次；单进程部署时由事件循环独占修改，多进程部署时定期重新构建"""
+
+    def __init__(self, db, dumps=json.dumps):
+        self.db = db
+        self.dumps = dumps
+        self.loaded = False
+        self._stats = {}
+        self._names = {}
+        self._buckets = {}
+        self._scores = []
+        self._tree = [0] * (MIN_CAPACITY + 1)
+        self._top = {}
+
+    def __len__(self):
+        return len(self._stats)
+
+    def load(self):
+        """从数据库重新构建全部名次"""
+        with self.db.connection() as conn:
+            rows = conn.execute(
+                "SELECT user_id, user_name, win_games, total_games FROM user_info"
+            ).fetchall()
+        self.build(rows)
+
+    def build(self, rows):
+        """用 (user_id, user_name, win_games, total_games) 构建，构建完成后一次性替换"""
+        stats, names, buckets = {}, {}, {}
+        for user_id, user_name, win_games, total_games in rows:
+            stats[user_id] = (win_games, total_games)
+            names[user_id] = user_name
+            buckets.setdefault(win_games, []).append((total_games, user_id))
+        for bucket in buckets.values():
+            bucket.sort()
+        self._stats, self._names, self._buckets = stats, names, buckets
+        self._scores = sorted(buckets)
+        self._tree = self._counts(max(buckets, default=0))
+        self._top = {}
+        self.loaded = True
+
+    def _counts(self, max_wins):
+        """按各桶人数线性构建树状数组，容量为不小于max_wins+1的2的幂"""
+        capacity = MIN_CAPACITY
+        while capacity < max_wins + 1:
+            capacity *= 2
+        tree = [0] * (capacity + 1)
+        for wins, bucket in self._buckets.items():
+            tree[wins + 1] += len(bucket)
+        for index in range(1, capacity + 1):
+            parent = index + (index & -index)
+            if parent <= capacity:
+                tree[parent] += tree[index]
+        return tree
+
+    def _add(self, wins, delta):
+        tree = self._tree
+        index = wins + 1
+        while index < len(tree):
+            tree[index] += delta
+            index += index & -index
+
+    def _at_most(self, wins):
+        """胜场不超过wins的人数"""
+        tree = self._tree
+        index = min(wins + 1, len(tree) - 1)
+        count = 0
+        while index:
+            count += tree[index]
+            index -= index & -index
+        return count
+
+    def _search(self, below):
+        """胜场不超过该值的人数大于below的最小胜场"""
+        tree = self._tree
+        position = 0
+        step = len(tree) - 1
+        while step:
+            if position + step < len(tree) and tree[position + step] <= below:
+                position += step
+                below -= tree[position]
+            step //= 2
+        return position
+
+    def _insert(self, user_id, wins, total):
+        self._stats[user_id] = (wins, total)
+        bucket = self._buckets.get(wins)
+        if bucket is None:
+            bucket = self._buckets[wins] = []
+            insort(self._scores, wins)
+        insort(bucket, (total, user_id))
+        if wins + 1 < len(self._tree):
+            self._add(wins, 1)
+        else:
+            self._tree = self._counts(wins)
+
+    def _remove(self, user_id):
+        wins, total = self._stats.pop(user_id)
+        bucket = self._buckets[wins]
+        del bucket[bisect_left(bucket, (total, user_id))]
+        if not bucket:
+            del self._buckets[wins]
+            del self._scores[bisect_left(self._scores, wins)]
+        self._add(wins, -1)
+
+    def add_user(self, user_id, user_name, win_games=0, total_games=0):
+        """新注册的用户"""
+        self._names[user_id] = user_name
+        self.update(user_id, win_games, total_games)
+
+    def update(self, user_id, win_games, total_games):
+        """用户的战绩变化后调整名次；变化涉及前MAX_TOP名时清空前N名的缓存"""
+        old_rank = MAX_TOP + 1
+        if user_id in self._stats:
+            old_rank = self.rank(user_id)
+            self._remove(user_id)
+        self._insert(user_id, win_games, total_games)
+        if min(old_rank, self.rank(user_id)) <= MAX_TOP:
+            self._top = {}
+
+    def record_game(self, winner_id, loser_id):
+        """一局结束：胜者胜场与对局数加一，负者对局数加一"""
+        for user_id, won in ((winner_id, 1), (loser_id, 0)):
+            stats = self._stats.get(user_id)
+            if stats is not None:
+                self.update(user_id, stats[0] + won, stats[1] + 1)
+
+    def rank(self, user_id):
+        """用户的名次(从1开始)，用户不存在时返回None"""
+        stats = self._stats.get(user_id)
+        if stats is None:
+            return None
+        wins, total = stats
+        higher = len(self._stats) - self._at_most(wins)
+        return higher + bisect_left(self._buckets[wins], (total, user_id)) + 1
+
+    def _entries(self, start, count):
+        """从第start名开始的最多count名"""
+        entries = []
+        if count <= 0 or not 1 <= start <= len(self._stats):
+            return entries
+        wins = self._search(len(self._stats) - start)
+        offset = start - 1 - (len(self._stats) - self._at_most(wins))
+        position = bisect_left(self._scores, wins)
+        rank = start
+        while position >= 0 and len(entries) < count:
+            wins = self._scores[position]
+            for total, user_id in self._buckets[wins][offset : offset + count - len(entries)]:
+                entries.append(
+                    {
+                        "rank": rank,
+                        "user_id": user_id,
+                        "user_name": self._names.get(user_id),
+                        "win_games": wins,
+                        "total_games": total,
+                    }
+                )
+                rank += 1
+            offset = 0
+            position -= 1
+        return entries
+
+    def top(self, count):
+        """前count名"""
+        return self._entries(1, min(count, MAX_TOP))
+
+    def top_json(self, count):
+        """/api/leaderboard 成功响应的序列化结果"""
+        count = min(count, MAX_TOP)
+        cached = self._top.get(count)
+        if cached is None:
+            cached = self._top[count] = self.dumps(
+                {
+                    "message": "ok",
+                    "data": {"ranks": self.top(count)},
+                    "error": "",
+                }
+            )
+        return cached
+
+    def around(self, rank, radius):
+        """第rank名前后各radius名(含第rank名)，超出榜单的部分截去"""
+        start = max(rank - radius, 1)
+        return self._entries(start, rank + radius - start + 1)
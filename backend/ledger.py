@@ -0,0 +1,316 @@
+"""金币账本：每一笔金币变动追加写入coin_ledger，余额与拥有的球杆缓存在内存中
+
+单进程部署时事件循环是余额的唯一写入方：扣款在内存中检查并立即生效，账本条目与按用户合并后的
+余额变动由后台任务定期在一个事务中写回，写回时仍以 coins + 变动 >= 0 为条件；条件不满足时
+逐条以条件UPDATE重放该用户的条目，无法入账的购买被撤销并由调用方通知用户。
+对局奖励不经过队列，与对局结算在同一事务中写入。
+多进程部署时各进程的缓存无法保持一致，每笔变动直接以单条条件UPDATE写入数据库。
+"""
+
+import time
+
+# 新用户的初始金币，与user_info.coins的默认值一致
+INITIAL_COINS = 300
+
+# 缓存的账户数量上限，超过时在写回后淘汰没有未写入变动的账户
+MAX_ACCOUNTS = 100000
+
+INSERT_ENTRY = (
+    "INSERT INTO coin_ledger (user_id, delta, balance, reason, ref_id, created_at) "
+    "VALUES (?, ?, ?, ?, ?, ?)"
+)
+
+
+class PurchaseRejected(Exception):
+    """已拥有该球杆或余额不足"""
+
+
+class Account:
+    """一个用户的金币余额与拥有球杆的位掩码"""
+
+    __slots__ = ("coins", "bar_possess")
+
+    def __init__(self, coins, bar_possess):
+        self.coins = coins
+        self.bar_possess = bar_possess
+
+
+class CoinLedger:
+    """金币的唯一入口：购买、奖励与余额查询都经过这里"""
+
+    def __init__(self, db, cached=True, max_accounts=MAX_ACCOUNTS):
+        self.db = db
+        self.cached = cached
+        self.max_accounts = max_accounts
+        self._accounts = {}
+        # 尚未写回的账本条目(末尾附带新增的球杆位)，以及按用户合并的 [金币变动, 新增球杆位]
+        self._entries = []
+        self._changes = {}
+        # 写回时因余额不足或已拥有球杆而被撤销的购买条目，由调用方通知用户
+        self._rejected = []
+
+    def __len__(self):
+        return len(self._accounts)
+
+    def pending(self):
+        """尚未写回的账本条目数"""
+        return len(self._entries)
+
+    def take_rejected(self):
+        """取出写回时被撤销的购买 [(用户, 球杆)]，调用方应通知这些用户"""
+        rejected, self._rejected = self._rejected, []
+        return [(entry[0], entry[4]) for entry in rejected]
+
+    def open_account(self, conn, user_id):
+        """注册时在同一事务中写入初始金币的账本条目"""
+        conn.execute(
+            INSERT_ENTRY,
+            (user_id, INITIAL_COINS, INITIAL_COINS, "register", None, int(time.time())),
+        )
+
+    def _read(self, conn, user_id):
+        row = conn.execute(
+            "SELECT coins, bar_possess FROM user_info WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def _load(self, user_id, conn=None):
+        if conn is None:
+            with self.db.connection() as conn:
+                row = self._read(conn, user_id)
+        else:
+            row = self._read(conn, user_id)
+        return Account(*row) if row else None
+
+    def account(self, user_id, conn=None):
+        """用户当前的账户，用户不存在时返回None；传入conn时未缓存的账户在该连接上读取"""
+        account = self._accounts.get(user_id)
+        if account is None:
+            account = self._load(user_id, conn)
+            if account is not None and self.cached:
+                self._accounts[user_id] = account
+        return account
+
+    def overlay(self, user_id, coins, bar_possess):
+        """从数据库读出的余额与球杆，已缓存的用户以缓存为准(包含尚未写回的变动)"""
+        account = self._accounts.get(user_id)
+        if account is None:
+            return coins, bar_possess
+        return account.coins, account.bar_possess
+
+    def buy(self, user_id, bar_id, price):
+        """扣除金币并获得球杆，返回购买后的账户；用户不存在时返回None"""
+        bit = 1 << (bar_id - 1)
+        if not self.cached:
+            return self._buy_now(user_id, bit, bar_id, price)
+        account = self.account(user_id)
+        if account is None:
+            return None
+        if account.bar_possess & bit or account.coins < price:
+            raise PurchaseRejected("已拥有当前球杆或余额不足")
+        account.coins -= price
+        account.bar_possess |= bit
+        self._append(user_id, -price, account.coins, "buy_bar", bar_id, bit)
+        return account
+
+    def _buy_now(self, user_id, bit, bar_id, price):
+        with self.db.connection() as conn:
+            rows = conn.execute(
+                "UPDATE user_info SET coins = coins - ?, bar_possess = bar_possess | ? "
+                "WHERE user_id = ? AND coins >= ? AND bar_possess & ? = 0 "
+                "RETURNING coins, bar_possess",
+                (price, bit, user_id, price, bit),
+            ).fetchall()
+            if not rows:
+                exists = conn.execute(
+                    "SELECT 1 FROM user_info WHERE user_id = ?", (user_id,)
+                ).fetchone()
+                if exists:
+                    raise PurchaseRejected("已拥有当前球杆或余额不足")
+                return None
+            coins, bar_possess = rows[0]
+            conn.execute(
+                INSERT_ENTRY, (user_id, -price, coins, "buy_bar", bar_id, int(time.time()))
+            )
+        return Account(coins, bar_possess)
+
+    def grant(self, conn, rewards, ref_id):
+        """
+        在调用方的事务中发放一组金币 [(用户, 金额, 原因)]，与调用方的其他写入一同提交或回滚。
+        缓存模式下同时写回这些用户尚未写回的变动，使每个用户的条目按发生顺序入账；
+        返回应在事务提交后调用的函数，由它把结果同步到缓存，回滚时不调用即可
+        """
+        now = int(time.time())
+        if not self.cached:
+            for user_id, amount, reason in rewards:
+                rows = conn.execute(
+                    "UPDATE user_info SET coins = coins + ? WHERE user_id = ? RETURNING coins",
+                    (amount, user_id),
+                ).fetchall()
+                if rows:
+                    conn.execute(INSERT_ENTRY, (user_id, amount, rows[0][0], reason, ref_id, now))
+            return lambda: None
+        granted = [
+            (user_id, amount, reason, self.account(user_id, conn))
+            for user_id, amount, reason in rewards
+        ]
+        users = {user_id for user_id, _, _, account in granted if account is not None}
+        # 只有这些用户有尚未写回的变动时才需要扫描队列
+        queued = not users.isdisjoint(self._changes)
+        entries = [entry for entry in self._entries if entry[0] in users] if queued else []
+        changes = {user_id: list(self._changes.get(user_id, (0, 0))) for user_id in users}
+        balances = {}
+        for user_id, amount, reason, account in granted:
+            if account is None:
+                continue
+            balance = balances[user_id] = balances.get(user_id, account.coins) + amount
+            changes[user_id][0] += amount
+            entries.append((user_id, amount, balance, reason, ref_id, now, 0))
+        replayed = self._apply(conn, entries, changes)
+
+        def committed():
+            # 提交前没有让出事件循环，这些用户的队列与读取时相同
+            if queued:
+                self._entries = [entry for entry in self._entries if entry[0] not in users]
+            for user_id in users:
+                self._changes.pop(user_id, None)
+            for user_id, amount, _, account in granted:
+                if account is not None:
+                    account.coins += amount
+            self._rebase(replayed)
+
+        return committed
+
+    def _append(self, user_id, delta, balance, reason, ref_id, bits):
+        self._entries.append((user_id, delta, balance, reason, ref_id, int(time.time()), bits))
+        change = self._changes.get(user_id)
+        if change is None:
+            self._changes[user_id] = [delta, bits]
+        else:
+            change[0] += delta
+            change[1] |= bits
+
+    def take(self):
+        """取出尚未写回的条目与合并后的变动"""
+        batch = (self._entries, self._changes)
+        self._entries, self._changes = [], {}
+        return batch
+
+    def restore(self, batch):
+        """写回失败时把批次放回队首，下次一并写回"""
+        entries, changes = batch
+        self._entries[:0] = entries
+        for user_id, (delta, bits) in changes.items():
+            change = self._changes.setdefault(user_id, [0, 0])
+            change[0] += delta
+            change[1] |= bits
+
+    def _apply(self, conn, entries, changes):
+        """
+        在conn的事务中写入一批变动：每个用户一条条件UPDATE，再批量插入账本条目。
+        条件不满足(数据库余额与缓存不一致)的用户按数据库中的余额重放，返回 {用户: 重放结果}
+        """
+        replayed = {}
+        for user_id, (delta, bits) in changes.items():
+            cur = conn.execute(
+                "UPDATE user_info SET coins = coins + ?, bar_possess = bar_possess | ? "
+                "WHERE user_id = ? AND coins + ? >= 0",
+                (delta, bits, user_id, delta),
+            )
+            if cur.rowcount != 1:
+                replayed[user_id] = self._replay(
+                    conn, user_id, [entry for entry in entries if entry[0] == user_id]
+                )
+        if replayed:
+            entries = [entry for entry in entries if entry[0] not in replayed]
+            for result in replayed.values():
+                if result is not None:
+                    entries += result[2]
+        conn.executemany(INSERT_ENTRY, [entry[:6] for entry in entries])
+        return replayed
+
+    def _replay(self, conn, user_id, entries):
+        """
+        按顺序逐条重放一个用户的条目，每条仍是条件UPDATE，不覆盖其他进程同时写入的变动：
+        余额不足或已拥有球杆的购买被撤销，其余条目按数据库返回的余额入账；
+        返回 (余额, 球杆, 入账的条目, 撤销的条目)，用户不存在时返回None
+        """
+        row = self._read(conn, user_id)
+        if row is None:
+            return None
+        coins, bar_possess = row
+        kept = []
+        rejected = []
+        for entry in entries:
+            delta, bits = entry[1], entry[6]
+            applied = conn.execute(
+                "UPDATE user_info SET coins = coins + ?, bar_possess = bar_possess | ? "
+                "WHERE user_id = ? AND coins + ? >= 0 AND bar_possess & ? = 0 "
+                "RETURNING coins, bar_possess",
+                (delta, bits, user_id, delta, bits),
+            ).fetchall()
+            if not applied:
+                rejected.append(entry)
+                continue
+            coins, bar_possess = applied[0]
+            kept.append((user_id, delta, coins, *entry[3:]))
+        return coins, bar_possess, kept, rejected
+
+    def _rebase(self, replayed):
+        """
+        把重放的结果同步到缓存；写回期间新增、仍在队列中的变动叠加在重放后的余额上，
+        其条目的余额随之修正，新的余额仍不足时下一次写回会再次重放
+        """
+        for user_id, result in replayed.items():
+            if result is None:
+                # 用户已不存在，丢弃其全部变动
+                self._accounts.pop(user_id, None)
+                self._entries = [entry for entry in self._entries if entry[0] != user_id]
+                self._changes.pop(user_id, None)
+                continue
+            coins, bar_possess, _, rejected = result
+            self._rejected += rejected
+            account = self._accounts.get(user_id)
+            if account is None:
+                continue
+            delta, bits = self._changes.get(user_id, (0, 0))
+            correction = coins + delta - account.coins
+            account.coins = coins + delta
+            account.bar_possess = bar_possess | bits
+            if correction and delta:
+                self._entries = [
+                    (*entry[:2], entry[2] + correction, *entry[3:]) if entry[0] == user_id else entry
+                    for entry in self._entries
+                ]
+
+    def write(self, batch):
+        """
+        在一个事务中写回一批变动，之后按需淘汰缓存的账户；
+        返回数据库余额与缓存不一致、按数据库余额重放了条目的用户
+        """
+        entries, changes = batch
+        replayed = {}
+        if entries:
+            with self.db.connection() as conn:
+                replayed = self._apply(conn, entries, changes)
+            self._rebase(replayed)
+        self._evict()
+        return list(replayed)
+
+    def flush(self):
+        """同步写回全部变动，失败时保留批次并抛出异常"""
+        batch = self.take()
+        try:
+            return self.write(batch)
+        except BaseException:
+            self.restore(batch)
+            raise
+
+    def _evict(self):
+        """账户数超过上限时淘汰最早缓存、且没有未写回变动的账户"""
+        excess = len(self._accounts) - self.max_accounts
+        if excess <= 0:
+            return
+        clean = [user_id for user_id in self._accounts if user_id not in self._changes]
+        for user_id in clean[: excess + self.max_accounts // 10]:
+            del self._accounts[user_id]
@@ -0,0 +1,187 @@
+"""异步日志：业务代码只把记录放入队列，由原生线程写入UTF-8 JSON行文件与控制台
+
+STARBALL_LOG_LEVEL    日志等级，默认INFO；运行中向进程发送SIGUSR1可在该等级与DEBUG之间切换
+STARBALL_LOG_SAMPLE   高频事件的采样率，例如 "shoot=10,send_pos=50" 表示每10/50条保留1条，
+                      WARNING及以上的记录不采样
+"""
+
+import atexit
+import itertools
+import json
+import logging
+import os
+import signal
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from eventlet import patcher
+
+# eventlet的monkey_patch会把threading与queue替换为协程实现，写日志需要真正的线程
+_threading = patcher.original("threading")
+_queue = patcher.original("queue")
+
+LOG_LEVEL = os.environ.get("STARBALL_LOG_LEVEL", "INFO").upper()
+DEFAULT_SAMPLE = "shoot=10,send_pos=50"
+
+# 记录中可以通过extra携带的上下文字段
+CONTEXT_FIELDS = ("event", "room_id", "user_id")
+
+
+def parse_sample(spec):
+    """把 "shoot=10,send_pos=50" 解析为 {事件: 采样间隔}"""
+    rates = {}
+    for item in spec.split(","):
+        name, _, every = item.partition("=")
+        if name.strip() and every.strip().isdigit() and int(every) > 1:
+            rates[name.strip()] = int(every)
+    return rates
+
+
+class JsonFormatter(logging.Formatter):
+    """一条记录输出为一行JSON，中文原样写出"""
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage(),
+            "file": record.filename,
+            "line": record.lineno,
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class SampleFilter(logging.Filter):
+    """按事件名采样，每every条保留第一条；WARNING及以上全部保留"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+        self.counters = {name: itertools.count() for name in rates}
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        event = getattr(record, "event", None)
+        every = self.rates.get(event)
+        if every is None:
+            return True
+        return next(self.counters[event]) % every == 0
+
+
+class _QueueHandler(QueueHandler):
+    """入队前只完成消息的格式化，不复制记录、不在调用方执行格式化器"""
+
+    def prepare(self, record):
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class _Pipeline:
+    """保存一个logger对应的队列与后台线程"""
+
+    def __init__(self, logger, listener, level):
+        self.logger = logger
+        self.listener = listener
+        self.level = level
+
+
+_pipelines = {}
+
+
+def _native_lock(handler):
+    """处理器只在原生线程中使用，替换掉被monkey_patch的协程锁"""
+    handler.lock = _threading.RLock()
+    return handler
+
+
+def setup(name, log_file, level=LOG_LEVEL, sample=None, console=True):
+    """配置异步日志并返回logger；重复调用时返回已配置的logger"""
+    if name in _pipelines:
+        return _pipelines[name].logger
+    os.makedirs(os.path.dirname(log_file) or ".", exist_ok=True)
+
+    file_handler = RotatingFileHandler(
+        log_file, maxBytes=5 * 1024 * 1024, backupCount=5, encoding="utf-8"
+    )
+    file_handler.setFormatter(JsonFormatter())
+    handlers = [_native_lock(file_handler)]
+    if console:
+        console_handler = logging.StreamHandler(sys.stderr)
+        console_handler.setFormatter(
+            logging.Formatter(
+                "%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s"
+            )
+        )
+        handlers.append(_native_lock(console_handler))
+
+    records = _queue.SimpleQueue()
+    listener = QueueListener(records, *handlers, respect_handler_level=True)
+    # QueueListener.start会创建被替换的协程线程，这里直接使用原生线程
+    thread = _threading.Thread(target=listener._monitor, name=f"log-{name}", daemon=True)
+    listener._thread = thread
+    thread.start()
+
+    # 记录中不使用线程与进程信息；monkey_patch后获取当前线程需要遍历协程，开销远大于记录本身
+    logging.logThreads = False
+    logging.logProcesses = False
+    logging.logMultiprocessing = False
+
+    logger = logging.getLogger(name)
+    logger.handlers.clear()
+    logger.setLevel(level)
+    logger.propagate = False
+    queue_handler = _QueueHandler(records)
+    if sample is None:
+        sample = os.environ.get("STARBALL_LOG_SAMPLE", DEFAULT_SAMPLE)
+    queue_handler.addFilter(SampleFilter(parse_sample(sample)))
+    logger.addHandler(queue_handler)
+
+    _pipelines[name] = _Pipeline(logger, listener, logging.getLevelName(level))
+    atexit.register(stop, name)
+    return logger
+
+
+def set_level(name, level):
+    """运行中修改日志等级"""
+    logging.getLogger(name).setLevel(level)
+
+
+def toggle_debug(name):
+    """在配置的等级与DEBUG之间切换，返回切换后的等级"""
+    pipeline = _pipelines[name]
+    logger = pipeline.logger
+    level = pipeline.level if logger.level == logging.DEBUG else logging.DEBUG
+    logger.setLevel(level)
+    return logging.getLevelName(logger.level)
+
+
+def install_signal(name):
+    """SIGUSR1切换DEBUG等级(仅限支持该信号的平台)"""
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, lambda *_: toggle_debug(name))
+
+
+def stop(name, timeout=5):
+    """写完队列中剩余的记录并停止后台线程，最多等待timeout秒"""
+    pipeline = _pipelines.pop(name, None)
+    if pipeline is None:
+        return
+    listener = pipeline.listener
+    listener.enqueue_sentinel()
+    deadline = time.monotonic() + timeout
+    while listener._thread.is_alive() and time.monotonic() < deadline:
+        listener._thread.join(0.1)
+    for handler in listener.handlers:
+        handler.close()
@@ -0,0 +1,165 @@
+"""匹配队列：按等待时间排序的小顶堆 + 按胜率分桶的先进先出队列，随等待时间逐步放宽胜率差"""
+
+import heapq
+import itertools
+import time
+
+# 胜率分桶数量，同一桶内的玩家总是可以直接匹配
+BUCKETS = 20
+# 每等待WIDEN_SECONDS秒，可匹配的胜率范围向两侧各扩大一个桶
+WIDEN_SECONDS = 3.0
+# 对局数少于该值的玩家胜率不可靠，按50%处理
+MIN_RATED_GAMES = 5
+
+
+def win_rate(total_games, win_games):
+    """用于匹配的胜率"""
+    if total_games < MIN_RATED_GAMES:
+        return 0.5
+    return win_games / total_games
+
+
+class Ticket:
+    """一名排队中的玩家"""
+
+    __slots__ = ("user_id", "bucket", "enqueued_at", "seq", "in_heap")
+
+    def __init__(self, user_id, bucket, enqueued_at, seq):
+        self.user_id = user_id
+        self.bucket = bucket
+        self.enqueued_at = enqueued_at
+        self.seq = seq
+        # 堆中是否还有该玩家的条目(包括配对后尚未弹出的过期条目)，每个玩家在堆中最多一条
+        self.in_heap = False
+
+
+class Matchmaker:
+    """
+    入队时立即尝试与可匹配范围内等待最久的玩家配对；未配对的玩家由tick按等待时间从长到短重试。
+    同一桶内的玩家入队时即被配对，因此等待中的玩家每个桶最多一人，每次配对的开销与队列长度无关
+    """
+
+    def __init__(self, ranked=True, clock=time.monotonic):
+        self.ranked = ranked
+        self.clock = clock
+        self._tickets = {}
+        self._buckets = [{} for _ in range(BUCKETS if ranked else 1)]
+        self._heap = []
+        self._seq = itertools.count()
+        # 已配对、尚未确认开局的玩家；开局失败时可以按原来的等待时间放回队列
+        self._paired = {}
+
+    def __len__(self):
+        return len(self._tickets)
+
+    def __contains__(self, user_id):
+        return user_id in self._tickets
+
+    def _bucket_of(self, rate):
+        if not self.ranked:
+            return 0
+        return min(int(rate * BUCKETS), BUCKETS - 1)
+
+    def _window(self, ticket, now):
+        """当前允许的桶距离"""
+        if not self.ranked:
+            return 0
+        return min(int((now - ticket.enqueued_at) / WIDEN_SECONDS), BUCKETS - 1)
+
+    def _partner(self, ticket, window):
+        """在桶距离window内寻找对手：优先桶距离最小，其次等待最久"""
+        best = None
+        for distance in range(window + 1):
+            for bucket in {ticket.bucket - distance, ticket.bucket + distance}:
+                if not 0 <= bucket < len(self._buckets):
+                    continue
+                for other in self._buckets[bucket].values():
+                    if other is ticket:
+                        continue
+                    if best is None or other.seq < best.seq:
+                        best = other
+                    break
+            if best is not None:
+                return best
+        return None
+
+    def _remove(self, ticket):
+        del self._tickets[ticket.user_id]
+        del self._buckets[ticket.bucket][ticket.user_id]
+
+    def _push(self, ticket):
+        """登记等待中的玩家；堆中仍有其条目时复用该条目"""
+        self._tickets[ticket.user_id] = ticket
+        self._buckets[ticket.bucket][ticket.user_id] = ticket
+        if not ticket.in_heap:
+            ticket.in_heap = True
+            heapq.heappush(self._heap, (ticket.enqueued_at, ticket.seq, ticket))
+
+    def enqueue(self, user_id, rate=0.5):
+        """玩家入队，立即配对成功时返回 (先入队的玩家, 后入队的玩家)，否则返回None"""
+        if user_id in self._tickets:
+            return None
+        ticket = Ticket(user_id, self._bucket_of(rate), self.clock(), next(self._seq))
+        partner = self._partner(ticket, 0)
+        if partner is not None:
+            self._remove(partner)
+            self._paired[partner.user_id] = partner
+            self._paired[user_id] = ticket
+            return partner.user_id, user_id
+        self._push(ticket)
+        return None
+
+    def cancel(self, user_id):
+        """玩家退出队列，不在队列中时返回False；堆中的条目在弹出时惰性丢弃"""
+        # 已配对正在开局的玩家退出后，开局失败时不再放回队列
+        self._paired.pop(user_id, None)
+        ticket = self._tickets.get(user_id)
+        if ticket is None:
+            return False
+        self._remove(ticket)
+        return True
+
+    def tick(self):
+        """按等待时间从长到短为等待中的玩家放宽范围重新配对，返回本次配对的列表"""
+        now = self.clock()
+        matches = []
+        waiting = []
+        while self._heap:
+            entry = heapq.heappop(self._heap)
+            ticket = entry[2]
+            ticket.in_heap = False
+            if self._tickets.get(ticket.user_id) is not ticket:
+                continue
+            partner = self._partner(ticket, self._window(ticket, now))
+            if partner is None:
+                waiting.append(entry)
+                continue
+            self._remove(ticket)
+            self._remove(partner)
+            self._paired[ticket.user_id] = ticket
+            self._paired[partner.user_id] = partner
+            matches.append((ticket.user_id, partner.user_id))
+        for entry in waiting:
+            entry[2].in_heap = True
+            heapq.heappush(self._heap, entry)
+        return matches
+
+    def confirm(self, user_id):
+        """配对的玩家已开局，不再保留其排队信息"""
+        self._paired.pop(user_id, None)
+
+    def requeue(self, user_id):
+        """
+        配对的玩家未能开局时放回队列，保留原来的入队时间与顺序；
+        不是已配对的玩家或已重新入队时返回False
+        """
+        ticket = self._paired.pop(user_id, None)
+        if ticket is None or user_id in self._tickets:
+            return False
+        self._push(ticket)
+        return True
+
+    def waited(self, user_id):
+        """玩家已等待的秒数，不在队列中时返回None"""
+        ticket = self._tickets.get(user_id)
+        return None if ticket is None else self.clock() - ticket.enqueued_at
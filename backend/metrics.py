@@ -0,0 +1,260 @@
+"""Prometheus文本格式的运行指标：接口与socket事件的次数、错误数、延迟直方图，以及SQLite语句耗时
+
+服务器运行在单个事件循环线程上，计数器只是普通的整数加法，热路径上的开销只有一次字典查找
+"""
+
+import re
+import sqlite3 as sq
+import time
+from bisect import bisect_left
+
+# 延迟直方图的桶上限(秒)
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+QUERY_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.05, 0.25)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values):
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class Counter:
+    """按标签值累加的计数器"""
+
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield self.name, _labels(self.labelnames, labels), value
+
+
+class Gauge:
+    """读取时调用函数求值的瞬时值"""
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, function):
+        self.name = name
+        self.help = help_text
+        self.function = function
+
+    def samples(self):
+        yield self.name, "", self.function()
+
+
+class Histogram:
+    """累积直方图，每个标签组合保存各桶计数、总和与次数"""
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = labelnames
+        self.buckets = buckets
+        self.values = {}
+
+    def observe(self, value, *labels):
+        state = self.values.get(labels)
+        if state is None:
+            state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        state[0][bisect_left(self.buckets, value)] += 1
+        state[1] += value
+
+    def samples(self):
+        names = self.labelnames + ("le",)
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield f"{self.name}_bucket", _labels(names, labels + (bound,)), cumulative
+            cumulative += counts[-1]
+            yield f"{self.name}_bucket", _labels(names, labels + ("+Inf",)), cumulative
+            yield f"{self.name}_sum", _labels(self.labelnames, labels), total
+            yield f"{self.name}_count", _labels(self.labelnames, labels), cumulative
+
+
+class Registry:
+    """所有指标的集合，render输出Prometheus文本格式"""
+
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def counter(self, name, help_text, labelnames=()):
+        return self.register(Counter(name, help_text, labelnames))
+
+    def gauge(self, name, help_text, function):
+        return self.register(Gauge(name, help_text, function))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, help_text, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {value}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter(
+    "starball_http_requests_total", "HTTP请求次数", ("endpoint", "status")
+)
+http_errors = registry.counter(
+    "starball_http_errors_total", "状态码>=500或抛出异常的HTTP请求次数", ("endpoint",)
+)
+http_latency = registry.histogram(
+    "starball_http_request_seconds", "HTTP请求处理耗时", ("endpoint",)
+)
+socket_events = registry.counter(
+    "starball_socket_events_total", "socket事件次数", ("event",)
+)
+socket_errors = registry.counter(
+    "starball_socket_errors_total", "处理时抛出异常的socket事件次数", ("event",)
+)
+socket_latency = registry.histogram(
+    "starball_socket_event_seconds", "socket事件处理耗时", ("event",)
+)
+relays = registry.counter(
+    "starball_relay_messages_total", "转发给对手的消息数，path为local或queue", ("event", "path")
+)
+rate_limited = registry.counter(
+    "starball_rate_limited_total", "超出按连接限流而被丢弃的socket事件数", ("event",)
+)
+coalesced = registry.counter(
+    "starball_coalesced_messages_total", "接收方积压时被更新的局面取代、未单独发送的转发消息数", ("event",)
+)
+db_queries = registry.histogram(
+    "starball_db_query_seconds", "SQLite语句执行耗时", ("statement",), QUERY_BUCKETS
+)
+
+
+def instrument_app(app):
+    """通过请求钩子记录每个Flask路由的次数、错误与耗时"""
+    from flask import g, request
+
+    @app.before_request
+    def _start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def _record(response):
+        start = g.pop("metrics_start", None)
+        if start is not None:
+            endpoint = request.endpoint or "unmatched"
+            http_latency.observe(time.perf_counter() - start, endpoint)
+            http_requests.inc(endpoint, response.status_code)
+            if response.status_code >= 500:
+                http_errors.inc(endpoint)
+        return response
+
+    @app.teardown_request
+    def _record_exception(error):
+        # 未被处理的异常不会经过after_request
+        start = g.pop("metrics_start", None)
+        if error is not None and start is not None:
+            endpoint = request.endpoint or "unmatched"
+            http_latency.observe(time.perf_counter() - start, endpoint)
+            http_requests.inc(endpoint, 500)
+            http_errors.inc(endpoint)
+
+
+def instrument_socketio(sio, namespace="/"):
+    """包装已注册的全部socket事件处理函数，在所有@socketio.on定义之后调用"""
+    handlers = sio.server.handlers.get(namespace, {})
+    for event, handler in list(handlers.items()):
+        handlers[event] = _timed_handler(event, handler)
+
+
+def _timed_handler(event, handler):
+    def timed(*args):
+        start = time.perf_counter()
+        try:
+            return handler(*args)
+        except Exception:
+            socket_errors.inc(event)
+            raise
+        finally:
+            socket_latency.observe(time.perf_counter() - start, event)
+            socket_events.inc(event)
+
+    return timed
+
+
+# SQL语句 -> 标签(动作 + 表名)的缓存
+_statement_labels = {}
+_STATEMENT = re.compile(
+    r"^\s*(\w+)(?:.*?\b(?:FROM|INTO|UPDATE|TABLE|ON)\s+(?:IF\s+NOT\s+EXISTS\s+)?(\w+))?",
+    re.IGNORECASE | re.DOTALL,
+)
+
+
+def statement_label(sql):
+    """把SQL语句归类为 "SELECT user_info" 这样的低基数标签"""
+    label = _statement_labels.get(sql)
+    if label is None:
+        match = _STATEMENT.match(sql)
+        if not match:
+            label = "other"
+        elif match.group(1).upper() == "UPDATE":
+            label = f"UPDATE {sql.split()[1]}"
+        else:
+            label = " ".join(part for part in (match.group(1).upper(), match.group(2)) if part)
+        _statement_labels[sql] = label
+    return label
+
+
+class TimedCursor(sq.Cursor):
+    """记录每条语句耗时的游标"""
+
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            db_queries.observe(time.perf_counter() - start, statement_label(sql))
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            db_queries.observe(time.perf_counter() - start, statement_label(sql))
+
+
+class TimedConnection(sq.Connection):
+    """作为sqlite3.connect的factory使用，连接上的所有语句都经过TimedCursor"""
+
+    def cursor(self, factory=TimedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
@@ -0,0 +1,270 @@
+"""数据库结构的版本化迁移，当前版本记录在 PRAGMA user_version 中"""
+
+# 按版本号递增排列，每个版本包含若干条SQL语句；已发布的版本不得修改，只能追加
+MIGRATIONS = [
+    (
+        1,
+        (
+            # 按玩家查询未结束房间：(player1_id = ? OR player2_id = ?) AND state ...
+            "CREATE INDEX IF NOT EXISTS idx_room_player1_state ON room_info (player1_id, state)",
+            "CREATE INDEX IF NOT EXISTS idx_room_player2_state ON room_info (player2_id, state)",
+            # 启动时按状态加载房间，索引覆盖全部需要的列
+            "CREATE INDEX IF NOT EXISTS idx_room_state ON room_info (state, player1_id, player2_id)",
+        ),
+    ),
+    (
+        2,
+        (
+            # 多进程部署时共享的 用户 -> sid 目录
+            """CREATE TABLE IF NOT EXISTS user_session (
+            user_id INTEGER PRIMARY KEY,
+            sid TEXT NOT NULL,
+            worker INTEGER NOT NULL DEFAULT 0)""",
+        ),
+    ),
+    (
+        3,
+        (
+            # 对局结算结果，以及从热表中归档的已结束房间
+            "ALTER TABLE room_info ADD COLUMN winner_id INTEGER",
+            "ALTER TABLE room_info ADD COLUMN finished_at INTEGER",
+            "CREATE INDEX IF NOT EXISTS idx_room_finished ON room_info (state, finished_at)",
+            """CREATE TABLE IF NOT EXISTS room_archive (
+            room_id INTEGER PRIMARY KEY,
+            player1_id INTEGER NOT NULL,
+            player2_id INTEGER,
+            winner_id INTEGER,
+            finished_at INTEGER)""",
+        ),
+    ),
+    (
+        4,
+        (
+            # 只追加的金币账本，balance为该条目生效后的余额
+            """CREATE TABLE IF NOT EXISTS coin_ledger (
+            entry_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            balance INTEGER NOT NULL,
+            reason TEXT NOT NULL,
+            ref_id INTEGER,
+            created_at INTEGER NOT NULL)""",
+            "CREATE INDEX IF NOT EXISTS idx_ledger_user ON coin_ledger (user_id, entry_id)",
+            """CREATE TRIGGER IF NOT EXISTS coin_ledger_no_update BEFORE UPDATE ON coin_ledger
+            BEGIN SELECT RAISE(ABORT, 'coin_ledger is append-only'); END""",
+            """CREATE TRIGGER IF NOT EXISTS coin_ledger_no_delete BEFORE DELETE ON coin_ledger
+            BEGIN SELECT RAISE(ABORT, 'coin_ledger is append-only'); END""",
+            # 已有用户以当前余额作为期初条目，此后账本中每个用户的delta之和等于coins
+            "INSERT INTO coin_ledger (user_id, delta, balance, reason, created_at) "
+            "SELECT user_id, coins, coins, 'opening', CAST(strftime('%s', 'now') AS INTEGER) "
+            "FROM user_info",
+        ),
+    ),
+    (
+        5,
+        (
+            # 已吊销、尚未过期的会话令牌，多进程部署时各工作进程定期同步
+            """CREATE TABLE IF NOT EXISTS revoked_token (
+            token_id TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            expires_at INTEGER NOT NULL)""",
+            "CREATE INDEX IF NOT EXISTS idx_revoked_expires ON revoked_token (expires_at, token_id)",
+        ),
+    ),
+    (
+        6,
+        (
+            # 对局中房间的规则状态与静止后的局面，重启或其他进程加载房间时据此恢复；
+            # shooter为NULL表示尚未击球，由player1开球
+            "ALTER TABLE room_info ADD COLUMN shooter INTEGER",
+            "ALTER TABLE room_info ADD COLUMN solid_player INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE room_info ADD COLUMN pocketed INTEGER NOT NULL DEFAULT 0",
+            "ALTER TABLE room_info ADD COLUMN table_state BLOB",
+        ),
+    ),
+]
+
+# 运行期间执行的全部SQL语句及示例参数，执行计划中不允许出现全表扫描。
+# benchmarks/check_query_plans.py 会核对这里与各模块源码中的SQL是否一致，新增或修改语句时须同步更新
+HOT_QUERIES = (
+    # 注册、登录与用户信息
+    ("SELECT 1 FROM user_info WHERE user_name = ?", ("name",)),
+    ("INSERT INTO user_info (user_name, password_hash) VALUES (?, ?)", ("name", "hash")),
+    (
+        "SELECT user_id, password_hash, coins FROM user_info WHERE user_name = ?",
+        ("name",),
+    ),
+    ("UPDATE user_info SET password_hash = ? WHERE user_id = ?", ("hash", 1)),
+    (
+        "SELECT bar_possess, coins, total_games, win_games, head FROM user_info WHERE user_id = ?",
+        (1,),
+    ),
+    ("SELECT total_games, win_games FROM user_info WHERE user_id = ?", (1,)),
+    ("SELECT head FROM user_info WHERE user_id = ?", (1,)),
+    ("UPDATE user_info SET head = ? WHERE user_id = ?", ("head", 1)),
+    # 会话令牌的吊销记录
+    (
+        "INSERT OR IGNORE INTO revoked_token (token_id, user_id, expires_at) VALUES (?, ?, ?)",
+        ("id", 1, 0),
+    ),
+    ("DELETE FROM revoked_token WHERE expires_at <= ?", (0,)),
+    ("SELECT token_id, expires_at FROM revoked_token WHERE expires_at > ?", (0,)),
+    # 金币账本
+    ("SELECT coins, bar_possess FROM user_info WHERE user_id = ?", (1,)),
+    ("SELECT 1 FROM user_info WHERE user_id = ?", (1,)),
+    (
+        "UPDATE user_info SET coins = coins - ?, bar_possess = bar_possess | ? "
+        "WHERE user_id = ? AND coins >= ? AND bar_possess & ? = 0 RETURNING coins, bar_possess",
+        (1, 1, 1, 1, 1),
+    ),
+    ("UPDATE user_info SET coins = coins + ? WHERE user_id = ? RETURNING coins", (1, 1)),
+    (
+        "UPDATE user_info SET coins = coins + ?, bar_possess = bar_possess | ? "
+        "WHERE user_id = ? AND coins + ? >= 0 AND bar_possess & ? = 0 RETURNING coins, bar_possess",
+        (1, 1, 1, 1, 1),
+    ),
+    (
+        "UPDATE user_info SET coins = coins + ?, bar_possess = bar_possess | ? "
+        "WHERE user_id = ? AND coins + ? >= 0",
+        (1, 1, 1, 1),
+    ),
+    (
+        "INSERT INTO coin_ledger (user_id, delta, balance, reason, ref_id, created_at) "
+        "VALUES (?, ?, ?, ?, ?, ?)",
+        (1, 1, 1, "win", 1, 0),
+    ),
+    ("UPDATE bar_info SET price = ? WHERE bar_id = ?", (1, 1)),
+    # 多进程部署时共享的 用户 -> sid 目录
+    (
+        "INSERT INTO user_session (user_id, sid, worker) VALUES (?, ?, ?) "
+        "ON CONFLICT(user_id) DO UPDATE SET sid = excluded.sid, worker = excluded.worker",
+        (1, "sid", 0),
+    ),
+    ("SELECT sid FROM user_session WHERE user_id = ?", (1,)),
+    ("DELETE FROM user_session WHERE user_id = ? AND sid = ?", (1, "sid")),
+    # 房间
+    (
+        "SELECT room_id, player1_id, player2_id, state, shooter, solid_player, pocketed, "
+        "table_state FROM room_info WHERE state IN (?, ?)",
+        (0, 1),
+    ),
+    (
+        "SELECT room_id, player1_id, player2_id, state, shooter, solid_player, pocketed, "
+        "table_state FROM room_info WHERE room_id = ? AND state IN (?, ?)",
+        (1, 0, 1),
+    ),
+    (
+        "SELECT room_id, player1_id, player2_id, state, shooter, solid_player, pocketed, "
+        "table_state FROM room_info WHERE (player1_id = ? OR player2_id = ?) AND state IN (?, ?)",
+        (1, 1, 0, 1),
+    ),
+    ("INSERT INTO room_info (player1_id) VALUES (?)", (1,)),
+    # 匹配成功时检查两名玩家均没有未结束的房间并建房
+    (
+        "INSERT INTO room_info (player1_id, player2_id, state) "
+        "SELECT ?, ?, ? WHERE NOT EXISTS ("
+        "SELECT 1 FROM room_info WHERE (player1_id IN (?, ?) OR player2_id IN (?, ?)) "
+        "AND state IN (?, ?))",
+        (1, 2, 1, 1, 2, 1, 2, 0, 1),
+    ),
+    (
+        "UPDATE room_info SET player2_id = ?, state = ? "
+        "WHERE room_id = ? AND player2_id IS NULL AND state = ?",
+        (2, 1, 1, 0),
+    ),
+    (
+        "UPDATE room_info SET shooter = ?, solid_player = ?, pocketed = ?, table_state = ? "
+        "WHERE room_id = ? AND state = ?",
+        (1, 0, 0, b"", 1, 1),
+    ),
+    (
+        "UPDATE room_info SET state = ?, finished_at = ? WHERE room_id = ? AND state <> ?",
+        (2, 0, 1, 2),
+    ),
+    (
+        "UPDATE room_info SET state = ?, winner_id = ?, finished_at = ? "
+        "WHERE room_id = ? AND state = ?",
+        (2, 1, 0, 1, 1),
+    ),
+    (
+        "UPDATE user_info SET total_games = total_games + 1, win_games = win_games + (user_id = ?) "
+        "WHERE user_id IN (?, ?)",
+        (1, 1, 2),
+    ),
+    # 归档已结束的房间
+    (
+        "INSERT OR REPLACE INTO room_archive "
+        "(room_id, player1_id, player2_id, winner_id, finished_at) "
+        "SELECT room_id, player1_id, player2_id, winner_id, finished_at FROM room_info "
+        "WHERE state = ? AND (finished_at IS NULL OR finished_at < ?)",
+        (2, 0),
+    ),
+    (
+        "DELETE FROM room_info WHERE state = ? AND (finished_at IS NULL OR finished_at < ?)",
+        (2, 0),
+    ),
+)
+
+# 启动或后台重建时按设计读取整张表的语句，只核对是否与源码一致，不检查执行计划
+BULK_QUERIES = (
+    "SELECT COUNT(*) FROM bar_info",
+    "INSERT INTO bar_info (bar_name, price, bar_picturea, bar_pictureb) VALUES (?, ?, ?, ?)",
+    "SELECT * FROM bar_info ORDER BY bar_id",
+    "SELECT user_id, user_name, win_games, total_games FROM user_info",
+)
+
+
+def current_version(conn):
+    """读取数据库当前的结构版本"""
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """
+    依次执行尚未应用的迁移，返回迁移后的版本号。
+    每个版本的语句与 user_version 的更新在同一个显式事务中执行，中途失败时整体回滚，下次启动可以重新执行
+    """
+    # sqlite3默认的隐式事务不包含DDL，这里改为手动管理事务
+    conn.commit()
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        version = current_version(conn)
+        for target, statements in MIGRATIONS:
+            if target <= version:
+                continue
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for statement in statements:
+                    conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {int(target)}")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            version = target
+    finally:
+        conn.isolation_level = isolation_level
+    return version
+
+
+def full_scans(conn):
+    """返回执行计划中出现全表扫描的高频查询及对应计划"""
+    result = []
+    for sql, params in HOT_QUERIES:
+        plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        details = [row[3] for row in plan]
+        # "SCAN CONSTANT ROW" 是 INSERT ... SELECT ?, ? 的常量行，不是表扫描
+        if any(d.startswith("SCAN ") and d != "SCAN CONSTANT ROW" for d in details):
+            result.append((sql, details))
+    return result
+
+
+def normalize(sql):
+    """合并空白，用于比较源码中的SQL与登记的SQL"""
+    return " ".join(sql.split())
+
+
+def registered_queries():
+    """HOT_QUERIES与BULK_QUERIES中登记的全部语句(已规范化)"""
+    return {normalize(sql) for sql, _ in HOT_QUERIES} | {normalize(sql) for sql in BULK_QUERIES}
@@ -0,0 +1,56 @@
+"""密码哈希与校验：bcrypt计算转移到原生线程池执行，避免阻塞eventlet事件循环"""
+
+import os
+import bcrypt
+from eventlet import tpool
+
+# bcrypt代价因子与允许同时排队的哈希任务数量均可通过环境变量配置
+BCRYPT_ROUNDS = int(os.environ.get("STARBALL_BCRYPT_ROUNDS", "12"))
+MAX_PENDING = int(os.environ.get("STARBALL_BCRYPT_MAX_PENDING", "32"))
+
+_pending = 0
+
+
+class HashPoolBusy(Exception):
+    """哈希任务排队已满，调用方应返回503让客户端稍后重试"""
+
+
+def _offload(func, *args):
+    """在线程池中执行func，排队任务超过上限时立即拒绝"""
+    global _pending
+    if _pending >= MAX_PENDING:
+        raise HashPoolBusy("密码服务繁忙")
+    _pending += 1
+    try:
+        return tpool.execute(func, *args)
+    finally:
+        _pending -= 1
+
+
+def pending():
+    """当前排队及执行中的哈希任务数量"""
+    return _pending
+
+
+def _hash(raw, rounds):
+    return bcrypt.hashpw(raw, bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def hash_password(password):
+    """计算密码哈希"""
+    return _offload(_hash, password.encode("utf-8"), BCRYPT_ROUNDS)
+
+
+def verify_password(password, password_hash):
+    """校验密码是否与哈希匹配"""
+    return _offload(
+        bcrypt.checkpw, password.encode("utf-8"), password_hash.encode("utf-8")
+    )
+
+
+def needs_rehash(password_hash):
+    """哈希的代价因子与当前配置不一致时需要重新计算"""
+    try:
+        return int(password_hash.split("$")[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
@@ -0,0 +1,374 @@
+"""
+服务器端物理引擎：移植自 frontend/GameLogic/physics，球的状态保存在NumPy数组中
+
+单张球桌每帧只有16颗球，耗时主要是NumPy调用的固定开销，单核实测开球约为每秒200-250杆；
+需要同时模拟大量房间时使用 batch_physics，由所有房间分摊每帧的开销
+"""
+
+import heapq
+import math
+import numpy as np
+
+# 球桌与球的参数，与前端 Table.ts / Ball.ts 保持一致
+TABLE_WIDTH = 800
+TABLE_HEIGHT = 400
+BALL_RADIUS = 15
+POCKET_RADIUS = 50
+TABLE_SIZE = np.array((TABLE_WIDTH, TABLE_HEIGHT), dtype=np.float64)
+POCKETS = np.array(
+    [
+        (0, 0),
+        (TABLE_WIDTH / 2, 0),
+        (TABLE_WIDTH, 0),
+        (0, TABLE_HEIGHT),
+        (TABLE_WIDTH / 2, TABLE_HEIGHT),
+        (TABLE_WIDTH, TABLE_HEIGHT),
+    ],
+    dtype=np.float64,
+)
+
+# 运动参数，与前端 PhysicsWorld.ts 保持一致
+FRAME_TIME = 1 / 60
+FRICTION = 0.98
+MIN_SPEED = 5
+RESTITUTION = 0.92
+TANGENT_FRICTION = 0.1
+WALL_RESTITUTION = 0.8
+MAX_COLLISION_ITERATIONS = 3
+
+# shoot事件中的力度范围为0-100，前端力度滑块范围为0-3000
+POWER_SCALE = 30
+
+# 开球与犯规后母球的摆放位置
+CUE_SPOT = (200.0, 200.0)
+
+# 单次击球最多模拟的帧数，防止异常数据导致死循环
+MAX_FRAMES = 60 * 60
+
+# 向量化接触检测的容差，保证不漏掉边界上的球对，最终以逐对精确判定为准；粗筛用平方距离比较
+CONTACT_EPSILON = 1e-6
+CONTACT_REACH_SQ = (2 * BALL_RADIUS + CONTACT_EPSILON) ** 2
+
+# 每帧的粗筛边界(浮点数，与NumPy数组比较时比整数快)，均留有容差，最终以前端的表达式精确判定：
+# 球心越过WALL_LOW/WALL_HIGH才可能碰边；球袋都在上下边上，球心与中线的距离超过POCKET_BAND才可能进袋
+WALL_LOW = BALL_RADIUS + CONTACT_EPSILON
+WALL_HIGH = TABLE_SIZE - BALL_RADIUS - CONTACT_EPSILON
+POCKET_BAND = TABLE_HEIGHT / 2 - POCKET_RADIUS - BALL_RADIUS - 1.0
+
+
+def initial_rack():
+    """生成开局球局（三角形摆放），与前端 generateInitialBalls 相同，返回 (ids, positions)"""
+    ids = [0]
+    positions = [CUE_SPOT]
+    spacing = BALL_RADIUS * 2 + 2
+    ball_id = 1
+    for row in range(5):
+        for col in range(row + 1):
+            positions.append(
+                (
+                    580 + row * spacing * math.sqrt(3) / 2,
+                    200 + (col - row / 2) * spacing,
+                )
+            )
+            ids.append(ball_id)
+            ball_id += 1
+    return ids, positions
+
+
+class TableState:
+    """一张球桌在两次击球之间的局面，球按编号排列，母球位于首位"""
+
+    __slots__ = ("ids", "pos", "pocketed")
+
+    def __init__(self, ids, pos, pocketed=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.pos = np.array(pos, dtype=np.float64).reshape(-1, 2)
+        if pocketed is None:
+            self.pocketed = np.zeros(len(self.ids), dtype=bool)
+        else:
+            self.pocketed = np.array(pocketed, dtype=bool)
+
+    @classmethod
+    def rack(cls):
+        """开局球局"""
+        return cls(*initial_rack())
+
+    def to_bytes(self):
+        """按球号保存的坐标(float64，已进袋的球为NaN)，用于持久化房间的局面"""
+        pos = np.full((int(self.ids.max()) + 1, 2), np.nan)
+        live = ~self.pocketed
+        pos[self.ids[live]] = self.pos[live]
+        return pos.tobytes()
+
+    @classmethod
+    def from_bytes(cls, raw):
+        """从to_bytes的结果恢复局面"""
+        pos = np.frombuffer(raw, dtype=np.float64).reshape(-1, 2)
+        pocketed = np.isnan(pos[:, 0])
+        return cls(np.arange(len(pos)), np.nan_to_num(pos), pocketed)
+
+    def reset_cue(self, position=CUE_SPOT):
+        """犯规后把母球放回开球点(对应 PhysicsWorld.resetCueBall)"""
+        self.pos[0] = position
+        self.pocketed[0] = False
+
+    def ball_states(self):
+        """未进袋球的位置，格式与send_pos中的balls一致"""
+        return [
+            {"ball_id": int(ball_id), "ball_posx": float(x), "ball_posy": float(y)}
+            for ball_id, (x, y), pocketed in zip(self.ids, self.pos, self.pocketed)
+            if not pocketed
+        ]
+
+
+def shot_force(angle, power):
+    """把shoot事件中的角度(度)与力度换算成作用在母球上的力"""
+    rad = math.radians(angle)
+    magnitude = power * POWER_SCALE
+    return math.cos(rad) * magnitude, math.sin(rad) * magnitude
+
+
+class PhysicsWorld:
+    """单张球桌的物理世界，球按加入顺序排列，行为与前端 PhysicsWorld 一致"""
+
+    def __init__(self, ids, positions, pocketed=None):
+        self.ids = np.asarray(ids, dtype=np.int64)
+        self.pos = np.array(positions, dtype=np.float64).reshape(-1, 2)
+        self.vel = np.zeros_like(self.pos)
+        if pocketed is None:
+            self.pocketed = np.zeros(len(self.ids), dtype=bool)
+        else:
+            self.pocketed = np.array(pocketed, dtype=bool)
+        self._cue = int(np.flatnonzero(self.ids == 0)[0]) if (self.ids == 0).any() else -1
+        self._index_pairs()
+        self.frames = 0
+        self.reset_turn_data()
+
+    def _index_pairs(self):
+        """预先计算球对的遍历顺序，以及每个球所参与球对的序号"""
+        n = len(self.ids)
+        self._pairs = np.triu_indices(n, k=1)
+        keys = np.full((n, n), -1, dtype=np.int64)
+        keys[self._pairs] = np.arange(len(self._pairs[0]))
+        keys = np.maximum(keys, keys.T)
+        self._partners = [np.delete(np.arange(n), b) for b in range(n)]
+        self._pair_keys = [keys[b, self._partners[b]] for b in range(n)]
+        self._refresh_live_pairs()
+
+    def _refresh_live_pairs(self):
+        """更新两球均未进袋的球对掩码"""
+        i_idx, j_idx = self._pairs
+        self._live_pairs = ~self.pocketed[i_idx] & ~self.pocketed[j_idx]
+
+    def reset_turn_data(self):
+        """重置回合数据"""
+        self.pocketed_ids = []
+        self.first_ball_hit = None
+        self.cue_ball_pocketed = False
+        self.no_ball_hit = False
+
+    def apply_force(self, ball_id, force):
+        """对指定的球施加力（质量为1）"""
+        idx = np.flatnonzero(self.ids == ball_id)
+        if len(idx) and not self.pocketed[idx[0]]:
+            self.vel[idx[0]] += force
+
+    def step(self, delta_time=FRAME_TIME):
+        """物理步进：按不超过1/60秒的子步长更新，最后检测进球"""
+        steps = math.ceil(delta_time / FRAME_TIME)
+        dt = delta_time / steps
+        for _ in range(steps):
+            self._update(dt)
+            for _ in range(MAX_COLLISION_ITERATIONS):
+                if not self._handle_collisions():
+                    break
+            self._handle_walls()
+        self._check_pockets()
+
+    def _update(self, dt):
+        """更新位置、衰减速度，速度过小时停止（对应 Ball.update）"""
+        # 进袋的球速度恒为0，不需要单独屏蔽；速度不低于下限的球就是仍在运动的球
+        vel = self.vel
+        next_pos = self.pos + vel * dt
+        vel *= FRICTION ** (dt * 60)
+        square = vel * vel
+        slow = (np.sqrt(square[:, 0] + square[:, 1]) < float(MIN_SPEED))[:, None]
+        np.copyto(vel, 0.0, where=slow)
+        np.copyto(self.pos, next_pos, where=~slow)
+
+    def _handle_collisions(self):
+        """
+        处理球与球之间的碰撞，返回是否发生了碰撞
+        用向量化检测找出接触的球对，再按前端的遍历顺序(i<j, 行优先)逐对精确判定与响应；
+        某个球被分离移动后，只对排在后面且涉及该球的球对重新检测
+        """
+        i_idx, j_idx = self._pairs
+        pos = self.pos
+        # 按行取值时take比花式索引快得多，16颗球的球桌上每帧的耗时主要是NumPy调用的固定开销
+        delta = pos.take(j_idx, axis=0)
+        delta -= pos.take(i_idx, axis=0)
+        delta *= delta
+        contact = delta[:, 0] + delta[:, 1] < CONTACT_REACH_SQ
+        contact &= self._live_pairs
+        pending = contact.nonzero()[0]
+        if not len(pending):
+            return False
+        pending = pending.tolist()
+
+        queued = set(pending)
+        has_collision = False
+        while pending:
+            k = heapq.heappop(pending)
+            queued.discard(k)
+            i, j = int(i_idx[k]), int(j_idx[k])
+            dx = pos[j, 0] - pos[i, 0]
+            dy = pos[j, 1] - pos[i, 1]
+            if math.sqrt(dx * dx + dy * dy) >= 2 * BALL_RADIUS:
+                continue
+            if self.first_ball_hit is None and i == self._cue:
+                self.first_ball_hit = int(self.ids[j])
+            self._resolve(i, j)
+            has_collision = True
+            for moved in (i, j):
+                for later in self._recheck(moved, k):
+                    if later not in queued:
+                        queued.add(later)
+                        heapq.heappush(pending, later)
+        return has_collision
+
+    def _recheck(self, ball, after):
+        """返回排在球对after之后、涉及ball且当前接触的球对序号"""
+        others = self._partners[ball]
+        delta = self.pos[others] - self.pos[ball]
+        delta *= delta
+        keys = self._pair_keys[ball]
+        hit = (delta[:, 0] + delta[:, 1] < CONTACT_REACH_SQ) & (keys > after) & ~self.pocketed[others]
+        return keys[hit].tolist()
+
+    def _resolve(self, i, j):
+        """解决两球碰撞（对应 PhysicsWorld.resolveCollision）"""
+        pos, vel = self.pos, self.vel
+        dx = pos[j, 0] - pos[i, 0]
+        dy = pos[j, 1] - pos[i, 1]
+        distance = math.sqrt(dx * dx + dy * dy)
+        if distance == 0:
+            return
+        nx = dx / distance
+        ny = dy / distance
+
+        # 分离重叠的球，静止的球不移动
+        overlap = 2 * BALL_RADIUS - distance + 0.5
+        sep_x = nx * overlap / 2
+        sep_y = ny * overlap / 2
+        still_i = vel[i, 0] == 0 and vel[i, 1] == 0
+        still_j = vel[j, 0] == 0 and vel[j, 1] == 0
+        if still_i and not still_j:
+            pos[j, 0] += sep_x * 2
+            pos[j, 1] += sep_y * 2
+        elif not still_i and still_j:
+            pos[i, 0] -= sep_x * 2
+            pos[i, 1] -= sep_y * 2
+        else:
+            pos[i, 0] -= sep_x
+            pos[i, 1] -= sep_y
+            pos[j, 0] += sep_x
+            pos[j, 1] += sep_y
+
+        # 正在分离的球不处理
+        dvx = vel[j, 0] - vel[i, 0]
+        dvy = vel[j, 1] - vel[i, 1]
+        dvn = dvx * nx + dvy * ny
+        if dvn > 0:
+            return
+
+        # 法向冲量与切向摩擦
+        impulse = -(1 + RESTITUTION) * dvn / 2
+        tx, ty = -ny, nx
+        tangent_impulse = -(dvx * tx + dvy * ty) * TANGENT_FRICTION
+        vel[i, 0] -= impulse * nx
+        vel[i, 1] -= impulse * ny
+        vel[j, 0] += impulse * nx
+        vel[j, 1] += impulse * ny
+        vel[i, 0] -= tangent_impulse * tx
+        vel[i, 1] -= tangent_impulse * ty
+        vel[j, 0] += tangent_impulse * tx
+        vel[j, 1] += tangent_impulse * ty
+
+    def _handle_walls(self):
+        """处理球与边界的碰撞（对应 Table.handleWallCollision）"""
+        if not np.count_nonzero(self.pos < WALL_LOW) and not np.count_nonzero(self.pos > WALL_HIGH):
+            return
+        low = self.pos - BALL_RADIUS < 0
+        high = (self.pos + BALL_RADIUS > TABLE_SIZE) & ~low
+        bounced = low | high
+        if not bounced.any():
+            return
+        self.pos[low] = BALL_RADIUS
+        np.copyto(self.pos, TABLE_SIZE - BALL_RADIUS, where=high)
+        self.vel[bounced] *= -WALL_RESTITUTION
+
+    def _check_pockets(self):
+        """检测进球（对应 Table.checkPocket）"""
+        # 只有靠近上下边的未进袋球才需要逐个球袋计算距离
+        near = np.abs(self.pos[:, 1] - TABLE_HEIGHT / 2) > POCKET_BAND
+        near &= ~self.pocketed
+        candidates = near.nonzero()[0]
+        if not len(candidates):
+            return
+        diff = self.pos[candidates, None, :] - POCKETS[None, :, :]
+        distance = np.sqrt(np.einsum("ijk,ijk->ij", diff, diff))
+        entered = candidates[(distance < POCKET_RADIUS + BALL_RADIUS).any(axis=1)]
+        if not len(entered):
+            return
+        for idx in entered:
+            self.pocketed[idx] = True
+            self.vel[idx] = 0
+            ball_id = int(self.ids[idx])
+            self.pocketed_ids.append(ball_id)
+            if ball_id == 0:
+                self.cue_ball_pocketed = True
+        self._refresh_live_pairs()
+
+    def is_stationary(self):
+        """检查所有未进袋的球是否静止"""
+        # 进袋的球速度恒为0
+        return not np.count_nonzero(self.vel)
+
+    def turn_data(self):
+        """获取回合数据，字段与前端 TurnData 对应"""
+        no_ball_hit = self.no_ball_hit
+        if self.first_ball_hit is None and self._cue >= 0:
+            no_ball_hit = no_ball_hit or bool((self.vel[self._cue] != 0).any())
+        return {
+            "pocketedBallIds": list(self.pocketed_ids),
+            "firstBallHit": self.first_ball_hit,
+            "cueBallPocketed": self.cue_ball_pocketed,
+            "noBallHit": no_ball_hit,
+        }
+
+    def ball_states(self):
+        """获取所有球的状态，格式与send_pos中的balls一致"""
+        return [
+            {"ball_id": int(ball_id), "ball_posx": float(x), "ball_posy": float(y)}
+            for ball_id, (x, y) in zip(self.ids, self.pos)
+        ]
+
+    def simulate(self, force, max_frames=MAX_FRAMES):
+        """施加击球力并按60帧/秒推进直到所有球静止，返回模拟的帧数"""
+        self.reset_turn_data()
+        if self._cue >= 0 and not self.pocketed[self._cue]:
+            self.vel[self._cue] += force
+        self.frames = 0
+        while self.frames < max_frames:
+            self.step(FRAME_TIME)
+            self.frames += 1
+            if self.is_stationary():
+                break
+        return self.frames
+
+
+def simulate_shot(ids, positions, angle, power, pocketed=None):
+    """从给定局面模拟一次完整的击球，返回物理世界的最终状态"""
+    world = PhysicsWorld(ids, positions, pocketed)
+    world.simulate(shot_force(angle, power))
+    return world
@@ -0,0 +1,107 @@
+"""socket事件的按连接限流：每个连接、每类事件一个令牌桶，超出的事件在进入处理函数前丢弃
+
+STARBALL_RATE_LIMITS  各事件的速率与突发上限，例如 "send_pos=60/120,shoot=2/5" 表示
+                      send_pos每秒补充60个令牌、最多积攒120个；未列出的事件不限流
+"""
+
+import os
+import time
+
+DEFAULT_LIMITS = "send_pos=60/120,shoot=2/5,pos_resync=5/10,spectate=2/5"
+
+# 被拒绝时回复fail的事件；高频事件直接丢弃，避免回复本身形成洪泛
+NOTIFY_EVENTS = ("shoot", "spectate")
+
+
+def parse_limits(spec):
+    """把 "send_pos=60/120,shoot=2/5" 解析为 {事件: (每秒令牌数, 突发上限)}"""
+    limits = {}
+    for item in spec.split(","):
+        name, _, value = item.partition("=")
+        rate, _, burst = value.partition("/")
+        try:
+            rate = float(rate)
+            burst = float(burst) if burst.strip() else rate
+        except ValueError:
+            continue
+        if name.strip() and rate > 0 and burst >= 1:
+            limits[name.strip()] = (rate, burst)
+    return limits
+
+
+class TokenBucket:
+    """令牌桶：tokens为剩余令牌，stamp为上次补充的时刻；notified表示本轮拒绝是否已回复过"""
+
+    __slots__ = ("tokens", "stamp", "notified")
+
+    def __init__(self, burst, now):
+        self.tokens = burst
+        self.stamp = now
+        self.notified = False
+
+
+class RateLimiter:
+    """按 (连接, 事件) 记录令牌桶；连接断开时调用forget释放"""
+
+    def __init__(self, limits=None, clock=time.monotonic):
+        if limits is None:
+            limits = parse_limits(os.environ.get("STARBALL_RATE_LIMITS", DEFAULT_LIMITS))
+        self.limits = limits
+        self.clock = clock
+        self._buckets = {}
+
+    def __len__(self):
+        return len(self._buckets)
+
+    def allow(self, sid, event):
+        """消耗一个令牌，令牌不足时返回False；未配置限流的事件总是允许"""
+        limit = self.limits.get(event)
+        if limit is None:
+            return True
+        rate, burst = limit
+        now = self.clock()
+        buckets = self._buckets.get(sid)
+        if buckets is None:
+            buckets = self._buckets[sid] = {}
+        bucket = buckets.get(event)
+        if bucket is None:
+            bucket = buckets[event] = TokenBucket(burst, now)
+        else:
+            bucket.tokens = min(burst, bucket.tokens + (now - bucket.stamp) * rate)
+            bucket.stamp = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            bucket.notified = False
+            return True
+        return False
+
+    def should_notify(self, sid, event):
+        """连续被拒绝的事件只回复第一次"""
+        bucket = self._buckets[sid][event]
+        if bucket.notified:
+            return False
+        bucket.notified = True
+        return event in NOTIFY_EVENTS
+
+    def forget(self, sid):
+        self._buckets.pop(sid, None)
+
+
+def limit_socketio(sio, limiter, on_reject, namespace="/"):
+    """
+    包装已注册的socket事件处理函数，超出限流的事件不调用处理函数而是调用on_reject(sid, event)；
+    在所有@socketio.on定义之后、metrics.instrument_socketio之前调用，被拒绝的事件同样计入事件次数
+    """
+    handlers = sio.server.handlers.get(namespace, {})
+    for event, handler in list(handlers.items()):
+        if event in limiter.limits:
+            handlers[event] = _limited_handler(limiter, event, handler, on_reject)
+
+
+def _limited_handler(limiter, event, handler, on_reject):
+    def limited(sid, *args):
+        if not limiter.allow(sid, event):
+            return on_reject(sid, event)
+        return handler(sid, *args)
+
+    return limited
@@ -0,0 +1,283 @@
+"""对局回放：按房间缓冲每一杆的输入与结果，对局结束后批量追加写入定长记录文件
+
+文件格式(小端)：
+    <name>.bin  文件头 + 连续的定长击球记录，同一房间的记录连续存放
+    <name>.idx  文件头 + 定长的房间索引(房间、双方、胜者、结束时间、记录数、首条记录的偏移)
+数据文件先于索引写入，索引中出现的房间其记录一定完整。读取时映射数据文件，
+按偏移直接定位任意一杆，不需要读入整个文件。
+
+用法:
+    python replays.py [目录] list
+    python replays.py [目录] show <房间id> [--shot N]
+"""
+
+import argparse
+import glob
+import json
+import mmap
+import os
+import struct
+import time
+
+import numpy as np
+
+REPLAY_DIR = os.environ.get("STARBALL_REPLAY_DIR", "replays")
+BALLS = 16
+VERSION = 1
+
+# 文件头：魔数、版本、球数、记录长度
+HEADER = struct.Struct("<4sHHI")
+DATA_MAGIC = b"SBRP"
+INDEX_MAGIC = b"SBRI"
+
+# 击球记录：击球方、序号、是否犯规、角度、力度、本杆进袋的球、击球后仍在台面的球、
+# 下一位击球方，之后是按球号排列的坐标(float32，已进袋的球为NaN)
+SHOT = struct.Struct("<IHBxffHHI")
+POSITIONS = struct.Struct(f"<{BALLS * 2}f")
+RECORD_BYTES = SHOT.size + POSITIONS.size
+
+# 房间索引：房间、玩家1、玩家2、胜者(0表示未决出)、结束时间、记录数、首条记录的偏移
+ENTRY = struct.Struct("<IIIIIIQ")
+
+
+def _mask(ball_ids):
+    mask = 0
+    for ball_id in ball_ids:
+        mask |= 1 << int(ball_id)
+    return mask
+
+
+def _balls(mask):
+    return [ball_id for ball_id in range(BALLS) if mask >> ball_id & 1]
+
+
+class _Buffer:
+    """一个房间尚未写出的记录；上一杆的输入在结果出来前暂存"""
+
+    __slots__ = ("records", "count", "shot")
+
+    def __init__(self):
+        self.records = bytearray()
+        self.count = 0
+        self.shot = None
+
+
+class ReplayRecorder:
+    """在内存中按房间缓冲记录，flush时把已结束的房间批量追加到文件"""
+
+    def __init__(self, directory=REPLAY_DIR, name="replays"):
+        self.directory = directory
+        self.data_path = os.path.join(directory, f"{name}.bin")
+        self.index_path = os.path.join(directory, f"{name}.idx")
+        self._rooms = {}
+        self._finished = []
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def pending(self):
+        """等待写出的已结束房间数"""
+        return len(self._finished)
+
+    def shot(self, room_id, shooter, angle, power):
+        """记录一杆的输入，结果由result补全"""
+        buffer = self._rooms.get(room_id)
+        if buffer is None:
+            buffer = self._rooms[room_id] = _Buffer()
+        buffer.shot = (shooter, angle, power)
+
+    def result(self, room_id, report, table):
+        """记录一杆的裁定结果与静止后的局面"""
+        buffer = self._rooms.get(room_id)
+        if buffer is None or buffer.shot is None:
+            return
+        shooter, angle, power = buffer.shot
+        buffer.shot = None
+        positions = np.full((BALLS, 2), np.nan, dtype=np.float32)
+        on_table = table.ids[~table.pocketed]
+        positions[on_table] = table.pos[~table.pocketed]
+        buffer.records += SHOT.pack(
+            shooter,
+            buffer.count,
+            report["isFoul"],
+            angle,
+            power,
+            _mask(report["pocketedBallIds"]),
+            int(np.bitwise_or.reduce(np.left_shift(1, on_table))),
+            report["nextPlayerId"],
+        )
+        buffer.records += positions.tobytes()
+        buffer.count += 1
+
+    def finish(self, room_id, player1_id, player2_id, winner_id=None):
+        """房间结束，记录移入待写队列；没有任何击球的房间直接丢弃"""
+        buffer = self._rooms.pop(room_id, None)
+        if buffer is None or not buffer.count:
+            return
+        entry = (room_id, player1_id, player2_id or 0, winner_id or 0, int(time.time()))
+        self._finished.append((entry, buffer))
+
+    def take(self):
+        """取出待写的房间，在事件循环中调用，写入可以交给线程池"""
+        batch, self._finished = self._finished, []
+        return batch
+
+    def write(self, batch):
+        """把一批房间追加到数据文件，再追加索引，返回写入的房间数"""
+        if not batch:
+            return 0
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.data_path, "ab") as data:
+            if data.tell() == 0:
+                data.write(HEADER.pack(DATA_MAGIC, VERSION, BALLS, RECORD_BYTES))
+            offset = data.tell()
+            entries = bytearray()
+            for entry, buffer in batch:
+                data.write(buffer.records)
+                entries += ENTRY.pack(*entry, buffer.count, offset)
+                offset += len(buffer.records)
+            data.flush()
+            os.fsync(data.fileno())
+        with open(self.index_path, "ab") as index:
+            if index.tell() == 0:
+                index.write(HEADER.pack(INDEX_MAGIC, VERSION, BALLS, ENTRY.size))
+            index.write(entries)
+        return len(batch)
+
+    def flush(self):
+        """同步写出全部已结束的房间"""
+        return self.write(self.take())
+
+
+class ReplayFormatError(ValueError):
+    """回放文件格式不正确"""
+
+
+def _check_header(handle, magic, size):
+    header = handle.read(HEADER.size)
+    if len(header) < HEADER.size:
+        raise ReplayFormatError(f"{handle.name} 文件头不完整")
+    found, version, balls, record = HEADER.unpack(header)
+    if found != magic or version != VERSION or balls != BALLS or record != size:
+        raise ReplayFormatError(f"{handle.name} 不是版本{VERSION}的回放文件")
+
+
+class ReplayReader:
+    """读取目录下所有进程写出的回放；只载入索引，击球记录通过内存映射按需读取"""
+
+    def __init__(self, directory=REPLAY_DIR):
+        self.directory = directory
+        self._entries = {}
+        self._maps = {}
+        self.reload()
+
+    def reload(self):
+        """重新读取索引，新结束的房间在此之后可见"""
+        self.close()
+        self._entries = {}
+        for index_path in sorted(glob.glob(os.path.join(self.directory, "*.idx"))):
+            data_path = index_path[: -len(".idx")] + ".bin"
+            with open(index_path, "rb") as handle:
+                _check_header(handle, INDEX_MAGIC, ENTRY.size)
+                raw = handle.read()
+            # 末尾不完整的条目是正在写入的索引，忽略
+            for start in range(0, len(raw) - ENTRY.size + 1, ENTRY.size):
+                room_id, *fields = ENTRY.unpack_from(raw, start)
+                self._entries[room_id] = (data_path, *fields)
+
+    def close(self):
+        for mapped in self._maps.values():
+            mapped.close()
+        self._maps = {}
+
+    def _map(self, data_path):
+        mapped = self._maps.get(data_path)
+        if mapped is None:
+            with open(data_path, "rb") as handle:
+                _check_header(handle, DATA_MAGIC, RECORD_BYTES)
+                mapped = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+            self._maps[data_path] = mapped
+        return mapped
+
+    def rooms(self):
+        """已记录的全部房间id"""
+        return sorted(self._entries)
+
+    def info(self, room_id):
+        """房间的概要，不存在时返回None"""
+        entry = self._entries.get(room_id)
+        if entry is None:
+            return None
+        _, player1_id, player2_id, winner_id, finished_at, count, _ = entry
+        return {
+            "room_id": room_id,
+            "player1_id": player1_id,
+            "player2_id": player2_id,
+            "winner_id": winner_id or None,
+            "finished_at": finished_at,
+            "shots": count,
+        }
+
+    def shot(self, room_id, number):
+        """读取第number杆(从0开始)，房间或击球不存在时抛出KeyError/IndexError"""
+        data_path, _, _, _, _, count, offset = self._entries[room_id]
+        if not 0 <= number < count:
+            raise IndexError(f"房间{room_id}只有{count}杆")
+        mapped = self._map(data_path)
+        start = offset + number * RECORD_BYTES
+        shooter, seq, foul, angle, power, potted, on_table, next_id = SHOT.unpack_from(
+            mapped, start
+        )
+        positions = POSITIONS.unpack_from(mapped, start + SHOT.size)
+        return {
+            "shot": seq,
+            "shooter_id": shooter,
+            "angle": round(angle, 4),
+            "power": round(power, 4),
+            "isFoul": bool(foul),
+            "pocketedBallIds": _balls(potted),
+            "nextPlayerId": next_id,
+            "balls": [
+                {
+                    "ball_id": ball_id,
+                    "ball_posx": positions[ball_id * 2],
+                    "ball_posy": positions[ball_id * 2 + 1],
+                }
+                for ball_id in _balls(on_table)
+            ],
+        }
+
+    def shots(self, room_id):
+        """按顺序逐杆读取"""
+        for number in range(self._entries[room_id][5]):
+            yield self.shot(room_id, number)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查看对局回放")
+    parser.add_argument("directory", nargs="?", default=REPLAY_DIR)
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="列出已记录的房间")
+    show = commands.add_parser("show", help="逐杆输出一个房间，或只输出其中一杆")
+    show.add_argument("room_id", type=int)
+    show.add_argument("--shot", type=int)
+    args = parser.parse_args()
+
+    reader = ReplayReader(args.directory)
+    if args.command == "list":
+        for room_id in reader.rooms():
+            print(json.dumps(reader.info(room_id), ensure_ascii=False))
+        return
+    info = reader.info(args.room_id)
+    if info is None:
+        parser.error(f"房间{args.room_id}没有回放")
+    print(json.dumps(info, ensure_ascii=False))
+    shots = [reader.shot(args.room_id, args.shot)] if args.shot is not None else reader.shots(
+        args.room_id
+    )
+    for shot in shots:
+        print(json.dumps(shot, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
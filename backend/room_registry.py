@@ -0,0 +1,344 @@
+"""维护进程内的房间注册表，实时事件通过它直接定位对手，无需访问数据库"""
+
+import time
+from physics import TableState
+from rules import RuleState
+
+# 房间状态：等待对手、对局中、已结束
+ROOM_WAITING = 0
+ROOM_PLAYING = 1
+ROOM_FINISHED = 2
+
+# 多进程部署时按房间或按玩家从数据库加载未结束的房间
+FETCH_BY_ROOM = (
+    "SELECT room_id, player1_id, player2_id, state, shooter, solid_player, pocketed, "
+    "table_state FROM room_info WHERE room_id = ? AND state IN (?, ?)"
+)
+FETCH_BY_USER = (
+    "SELECT room_id, player1_id, player2_id, state, shooter, solid_player, pocketed, "
+    "table_state FROM room_info WHERE (player1_id = ? OR player2_id = ?) AND state IN (?, ?)"
+)
+
+
+class Room:
+    """单个房间的内存状态"""
+
+    __slots__ = (
+        "room_id",
+        "player1_id",
+        "player2_id",
+        "state",
+        "table",
+        "positions",
+        "last_active",
+        "rules",
+        "offline",
+        "audience",
+    )
+
+    def __init__(self, room_id, player1_id, player2_id=None, state=ROOM_WAITING):
+        self.room_id = room_id
+        self.player1_id = player1_id
+        self.player2_id = player2_id
+        self.state = state
+        self.table = None
+        self.positions = None
+        self.last_active = time.monotonic()
+        self.rules = RuleState(player1_id)
+        self.offline = {}
+        self.audience = None
+
+    def restore(self, shooter, solid_player, pocketed, table_state):
+        """恢复数据库中保存的规则状态与局面，尚未击球的房间保持开局状态"""
+        if shooter:
+            self.rules = RuleState(shooter, solid_player, pocketed)
+        if table_state:
+            self.table = TableState.from_bytes(table_state)
+
+    def touch(self):
+        """记录房间内的最近一次活动，长时间无活动的房间会被回收"""
+        self.last_active = time.monotonic()
+
+    def opponent(self, user_id):
+        """返回房间内另一名玩家的id"""
+        return self.player2_id if user_id == self.player1_id else self.player1_id
+
+
+class Audience:
+    """房间的观战者，以及等待下一次广播的击球与位置更新"""
+
+    __slots__ = ("sids", "hits", "moved")
+
+    def __init__(self):
+        self.sids = set()
+        self.hits = []
+        self.moved = False
+
+
+class RoomRegistry:
+    """
+    用户 -> 房间 -> 对手 -> sid 的权威映射，仅在房间状态变化时写回room_info
+    多进程部署时传入共享的sid目录：本进程未缓存或缓存已过期的房间从数据库重新加载，
+    不在本进程连接的对手从sid目录中查找
+    """
+
+    def __init__(self, db, directory=None):
+        self.db = db
+        self.directory = directory
+        self._rooms = {}
+        self._user_rooms = {}
+        self._sids = {}
+        self._sid_users = {}
+
+    def __len__(self):
+        return len(self._rooms)
+
+    def load(self):
+        """服务启动时从数据库恢复尚未结束的房间"""
+        self._rooms.clear()
+        self._user_rooms.clear()
+        with self.db.connection() as conn:
+            rows = conn.execute(
+                "SELECT room_id, player1_id, player2_id, state, shooter, solid_player, pocketed, "
+                "table_state FROM room_info WHERE state IN (?, ?)",
+                (ROOM_WAITING, ROOM_PLAYING),
+            ).fetchall()
+        for row in rows:
+            room = Room(*row[:4])
+            room.restore(*row[4:])
+            self._index(room)
+
+    def _index(self, room):
+        """把房间写入内存索引"""
+        self._rooms[room.room_id] = room
+        self._user_rooms[room.player1_id] = room
+        if room.player2_id:
+            self._user_rooms[room.player2_id] = room
+
+    def _fetch(self, sql, params):
+        """多进程部署时从数据库加载一个未结束的房间并更新缓存"""
+        if not self.directory:
+            return None
+        with self.db.connection() as conn:
+            row = conn.execute(sql, (*params, ROOM_WAITING, ROOM_PLAYING)).fetchone()
+        if not row:
+            return None
+        room = self._rooms.get(row[0])
+        if room:
+            room.player2_id, room.state = row[2], row[3]
+        else:
+            room = Room(*row[:4])
+            room.restore(*row[4:])
+        self._index(room)
+        return room
+
+    def get(self, room_id):
+        """按房间id查找未结束的房间"""
+        return self._rooms.get(room_id) or self._fetch(FETCH_BY_ROOM, (room_id,))
+
+    def room_of(self, user_id):
+        """查找用户所在的未结束房间"""
+        return self._user_rooms.get(user_id) or self._fetch(FETCH_BY_USER, (user_id, user_id))
+
+    def refresh(self, room):
+        """其他进程可能已修改房间状态，重新加载；单进程部署时直接返回缓存"""
+        return self._fetch(FETCH_BY_ROOM, (room.room_id,)) or room
+
+    def open_room(self, user_id):
+        """创建房间：写入数据库并登记到内存，返回新房间"""
+        with self.db.connection() as conn:
+            cur = conn.execute("INSERT INTO room_info (player1_id) VALUES (?)", (user_id,))
+            room = Room(cur.lastrowid, user_id)
+        self._index(room)
+        return room
+
+    def create_match(self, player1_id, player2_id):
+        """
+        为匹配成功的两名玩家直接创建对局中的房间；
+        检查与插入在同一条语句中完成，任一玩家已有未结束的房间时返回None
+        """
+        with self.db.connection() as conn:
+            cur = conn.execute(
+                "INSERT INTO room_info (player1_id, player2_id, state) "
+                "SELECT ?, ?, ? WHERE NOT EXISTS ("
+                "SELECT 1 FROM room_info WHERE (player1_id IN (?, ?) OR player2_id IN (?, ?)) "
+                "AND state IN (?, ?))",
+                (
+                    player1_id,
+                    player2_id,
+                    ROOM_PLAYING,
+                    player1_id,
+                    player2_id,
+                    player1_id,
+                    player2_id,
+                    ROOM_WAITING,
+                    ROOM_PLAYING,
+                ),
+            )
+        if cur.rowcount != 1:
+            return None
+        room = Room(cur.lastrowid, player1_id, player2_id, ROOM_PLAYING)
+        self._index(room)
+        return room
+
+    def fill_room(self, room_id, user_id):
+        """第二名玩家进入房间，房间进入对局状态；房间不可加入或用户已在其他房间时返回None"""
+        room = self.get(room_id)
+        if not room or room.player2_id or room.state != ROOM_WAITING:
+            return None
+        if self.room_of(user_id):
+            return None
+        # 条件更新保证多个进程同时加入同一房间时只有一个成功
+        with self.db.connection() as conn:
+            cur = conn.execute(
+                "UPDATE room_info SET player2_id = ?, state = ? "
+                "WHERE room_id = ? AND player2_id IS NULL AND state = ?",
+                (user_id, ROOM_PLAYING, room_id, ROOM_WAITING),
+            )
+        if cur.rowcount != 1:
+            self.refresh(room)
+            return None
+        room.player2_id = user_id
+        room.state = ROOM_PLAYING
+        self._user_rooms[user_id] = room
+        return room
+
+    def save_turn(self, room):
+        """一杆裁定后保存房间的规则状态与局面，服务重启或其他进程加载房间时据此恢复"""
+        rules = room.rules
+        with self.db.connection() as conn:
+            conn.execute(
+                "UPDATE room_info SET shooter = ?, solid_player = ?, pocketed = ?, table_state = ? "
+                "WHERE room_id = ? AND state = ?",
+                (
+                    rules.shooter,
+                    rules.solid_player,
+                    rules.pocketed,
+                    room.table.to_bytes(),
+                    room.room_id,
+                    ROOM_PLAYING,
+                ),
+            )
+
+    def _forget(self, room):
+        """把已结束的房间及其玩家的连接移出内存索引"""
+        self._rooms.pop(room.room_id, None)
+        room.state = ROOM_FINISHED
+        for user_id in (room.player1_id, room.player2_id):
+            if self._user_rooms.get(user_id) is room:
+                del self._user_rooms[user_id]
+            sid = self._sids.pop(user_id, None)
+            if sid is not None:
+                self._sid_users.pop(sid, None)
+                if self.directory:
+                    self.directory.unbind(user_id, sid)
+
+    def close_room(self, room_id):
+        """结束房间但不结算：写回数据库并移出内存索引"""
+        room = self._rooms.get(room_id)
+        if not room:
+            return None
+        with self.db.connection() as conn:
+            conn.execute(
+                "UPDATE room_info SET state = ?, finished_at = ? WHERE room_id = ? AND state <> ?",
+                (ROOM_FINISHED, int(time.time()), room_id, ROOM_FINISHED),
+            )
+        self._forget(room)
+        return room
+
+    def settle(self, room_id, winner_id, rewards=None):
+        """
+        对局结束：在同一个事务中结束房间、更新双方的对局数与胜场，并调用rewards(conn)发放金币奖励；
+        rewards返回事务提交后调用的函数(见CoinLedger.grant)。
+        房间不在对局中(例如已被结算或回收)或胜者不是房间内的玩家时返回None
+        """
+        room = self.get(room_id)
+        if not room or winner_id not in (room.player1_id, room.player2_id):
+            return None
+        with self.db.connection() as conn:
+            cur = conn.execute(
+                "UPDATE room_info SET state = ?, winner_id = ?, finished_at = ? "
+                "WHERE room_id = ? AND state = ?",
+                (ROOM_FINISHED, winner_id, int(time.time()), room_id, ROOM_PLAYING),
+            )
+            if cur.rowcount != 1:
+                return None
+            conn.execute(
+                "UPDATE user_info SET total_games = total_games + 1, "
+                "win_games = win_games + (user_id = ?) "
+                "WHERE user_id IN (?, ?)",
+                (winner_id, room.player1_id, room.player2_id),
+            )
+            committed = rewards(conn) if rewards else None
+        if committed:
+            committed()
+        self._forget(room)
+        return room
+
+    def expire(self, waiting_ttl, playing_ttl):
+        """回收长时间无活动的房间(不结算)，返回被回收的房间"""
+        now = time.monotonic()
+        idle = [
+            room
+            for room in self._rooms.values()
+            if now - room.last_active
+            > (waiting_ttl if room.state == ROOM_WAITING else playing_ttl)
+        ]
+        return [room for room in idle if self.close_room(room.room_id)]
+
+    def archive(self, older_than):
+        """把结束超过older_than秒的房间移入room_archive，返回移动的行数"""
+        cutoff = int(time.time()) - older_than
+        with self.db.connection() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO room_archive "
+                "(room_id, player1_id, player2_id, winner_id, finished_at) "
+                "SELECT room_id, player1_id, player2_id, winner_id, finished_at FROM room_info "
+                "WHERE state = ? AND (finished_at IS NULL OR finished_at < ?)",
+                (ROOM_FINISHED, cutoff),
+            )
+            cur = conn.execute(
+                "DELETE FROM room_info WHERE state = ? AND (finished_at IS NULL OR finished_at < ?)",
+                (ROOM_FINISHED, cutoff),
+            )
+        return cur.rowcount
+
+    def bind_sid(self, user_id, sid):
+        """记录用户当前的socket连接，重连时新的sid替换旧的sid"""
+        old = self._sids.get(user_id)
+        if old is not None and old != sid:
+            self._sid_users.pop(old, None)
+        self._sids[user_id] = sid
+        self._sid_users[sid] = user_id
+        if self.directory:
+            self.directory.bind(user_id, sid)
+
+    def unbind_sid(self, sid):
+        """连接断开时移除映射，返回该连接对应的用户；连接已被重连替换时返回None"""
+        user_id = self._sid_users.pop(sid, None)
+        if user_id is None or self._sids.get(user_id) != sid:
+            return None
+        del self._sids[user_id]
+        if self.directory:
+            self.directory.unbind(user_id, sid)
+        return user_id
+
+    def sid_of(self, user_id):
+        """查找用户当前的socket连接"""
+        sid = self._sids.get(user_id)
+        if sid is None and self.directory:
+            sid = self.directory.lookup(user_id)
+        return sid
+
+    def user_of_sid(self, sid):
+        """查找连接对应的用户，未绑定时返回None"""
+        return self._sid_users.get(sid)
+
+    def opponent_sid(self, user_id):
+        """查找对局中对手的sid，用户不在对局中或对手未连接时返回None"""
+        room = self.room_of(user_id)
+        if room and room.state != ROOM_PLAYING:
+            room = self.refresh(room)
+        if not room or room.state != ROOM_PLAYING:
+            return None
+        return self.sid_of(room.opponent(user_id))
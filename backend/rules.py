@@ -0,0 +1,87 @@
+"""8球规则的服务器端实现：判定犯规、胜负与下一位击球方，并分配球组
+
+判定与前端 RuleEngine.analyzeTurn 一致；前端没有分配球组，这里在第一次合法进球时
+把进袋球所在的组分给击球方。每个房间只保存三个整数：当前击球方、全色球一方与已进袋球的位掩码，
+每杆裁定后随局面写回room_info，服务重启后据此恢复
+"""
+
+CUE_BALL = 0
+EIGHT_BALL = 8
+
+# 球组的位掩码：全色球1-7，花色球9-15
+SOLIDS = sum(1 << ball_id for ball_id in range(1, 8))
+STRIPES = sum(1 << ball_id for ball_id in range(9, 16))
+
+
+def group_of_ball(ball_id):
+    """球所在组的位掩码，母球与8号球返回0"""
+    bit = 1 << ball_id
+    if bit & SOLIDS:
+        return SOLIDS
+    if bit & STRIPES:
+        return STRIPES
+    return 0
+
+
+class RuleState:
+    """单个房间的规则状态，由击球方所在的进程维护"""
+
+    __slots__ = ("shooter", "solid_player", "pocketed")
+
+    def __init__(self, shooter, solid_player=0, pocketed=0):
+        self.shooter = shooter
+        # 分到全色球的玩家，0表示尚未分组
+        self.solid_player = solid_player
+        self.pocketed = pocketed
+
+    def group_of(self, user_id):
+        """玩家的球组位掩码，尚未分组时返回0"""
+        if not self.solid_player:
+            return 0
+        return SOLIDS if user_id == self.solid_player else STRIPES
+
+    def is_foul(self, turn_data, group):
+        """母球进袋、未击中任何球，或已分组时首先击中对方的球"""
+        if turn_data["cueBallPocketed"] or turn_data["noBallHit"]:
+            return True
+        if group:
+            first_hit = turn_data["firstBallHit"]
+            if first_hit is None:
+                return True
+            if group_of_ball(first_hit) not in (0, group):
+                return True
+        return False
+
+    def analyze(self, turn_data, opponent):
+        """
+        根据一杆的回合数据更新状态，返回与前端TurnReport字段一致的报告(不含finalBallStates)
+        打进8号球时决出胜负：合法打进者获胜，犯规打进则对手获胜
+        """
+        shooter = self.shooter
+        pocketed_ids = turn_data["pocketedBallIds"]
+        foul = self.is_foul(turn_data, self.group_of(shooter))
+
+        winner = None
+        if EIGHT_BALL in pocketed_ids:
+            winner = opponent if foul else shooter
+
+        for ball_id in pocketed_ids:
+            if ball_id != CUE_BALL:
+                self.pocketed |= 1 << ball_id
+        if not foul and not self.solid_player:
+            for ball_id in pocketed_ids:
+                group = group_of_ball(ball_id)
+                if group:
+                    self.solid_player = shooter if group == SOLIDS else opponent
+                    break
+
+        # 合法且有球进袋时继续击球，否则换人
+        if foul or not pocketed_ids:
+            self.shooter = opponent
+        return {
+            "pocketedBallIds": pocketed_ids,
+            "isFoul": foul,
+            "turnWinnerId": winner,
+            "nextPlayerId": self.shooter,
+            "solidPlayerId": self.solid_player or None,
+        }
@@ -3,51 +3,145 @@
 # 导入所需模块
 import eventlet
 eventlet.monkey_patch()
+import atexit
 import sqlite3 as sq
 import os
-import logging
-from logging.handlers import RotatingFileHandler
-import bcrypt
-from flask import Flask, request, jsonify, send_from_directory
-from flask_socketio import SocketIO, emit, join_room
+import time
+import avatars
+import cluster
+import fast_json
+import log_pipeline
+import metrics
+import passwords
+import ratelimit
+from flask import Flask, request, jsonify
+from flask_socketio import ConnectionRefusedError, SocketIO, emit, join_room, leave_room
 from flask_cors import CORS
+from eventlet import tpool
+from werkzeug.exceptions import RequestEntityTooLarge
+from bar_catalog import BarCatalog
+from ball_codec import PositionState, StaleFrame, decode, from_json
+from batch_physics import BatchSimulator
+from cluster import SidDirectory
+from db import Database
+from leaderboard import MAX_TOP, Leaderboard
+from ledger import INITIAL_COINS, CoinLedger, PurchaseRejected
+from matchmaking import Matchmaker, win_rate
+from migrations import migrate
+from passwords import HashPoolBusy, hash_password, needs_rehash, verify_password
+from physics import TableState, shot_force
+from replays import REPLAY_DIR, ReplayReader, ReplayRecorder
+from room_registry import ROOM_PLAYING, Audience, RoomRegistry
+from static_assets import StaticAssets
+from tokens import InvalidToken, TokenSigner, load_secret
 
-# 创建Web实体，支持跨域访问，开启实时通信，记录通信对象
+# 创建Web实体，支持跨域访问，开启实时通信，连接数据库，记录房间与通信对象
 app = Flask(__name__)
+app.json = fast_json.FastJSONProvider(app)
 CORS(app)
-socketio = SocketIO(app, cors_allowed_origins="*")
-user_sockets = {}
+socketio = SocketIO(
+    app, cors_allowed_origins="*", json=fast_json.SocketJSON, **cluster.socketio_options()
+)
+db = Database(factory=metrics.TimedConnection)
+catalog = BarCatalog(db, app.json.dumps)
+rooms = RoomRegistry(db, SidDirectory(db) if cluster.WORKERS > 1 else None)
 
-# 创建日志文件夹，定义日志文件路径
-LOG_DIR = "logs"
-if not os.path.exists(LOG_DIR):
-    os.makedirs(LOG_DIR)
-LOG_FILE = os.path.join(LOG_DIR, "starball.log")
-
-# 创建Logger对象，并设置日志等级过滤，设置日志格式
-logger = logging.getLogger("my_app")
-logger.setLevel(logging.DEBUG)
-formatter = logging.Formatter(
-    "%(asctime)s - %(name)s - %(levelname)s - %(filename)s:%(lineno)d - %(message)s"
+# 会话令牌：登录/注册时签发，HTTP请求通过 Authorization: Bearer 携带，socket在建立连接时认证一次；
+# 已认证连接的身份记在socket_sessions(sid -> Claims)中。多进程部署时吊销记录每隔REVOCATION_SYNC秒从数据库同步
+signer = TokenSigner(load_secret())
+socket_sessions = {}
+REVOCATION_SYNC = 5
+
+# 金币账本：单进程部署时余额缓存在内存中，变动每隔LEDGER_FLUSH_INTERVAL秒批量写回
+ledger = CoinLedger(db, cached=cluster.WORKERS <= 1)
+LEDGER_FLUSH_INTERVAL = 0.2
+
+# 排行榜：单进程部署时随注册与结算增量更新，多进程部署时每个工作进程每隔LEADERBOARD_REFRESH秒重新构建
+leaderboard = Leaderboard(db, app.json.dumps)
+LEADERBOARD_REFRESH = 30
+LEADERBOARD_DEFAULT_TOP = 20
+MAX_LEADERBOARD_RADIUS = 50
+
+# 服务器端批量模拟所有房间进行中的击球，每次让出事件循环前推进的帧数
+simulator = BatchSimulator()
+PHYSICS_FRAMES_PER_TICK = 30
+physics_task = None
+
+# 匹配队列，后台任务每隔MATCH_INTERVAL秒为等待中的玩家放宽范围重新配对
+matchmaker = Matchmaker()
+MATCH_INTERVAL = 0.5
+match_task = None
+
+# 对局结算的金币奖励，以及房间回收与归档的时间(秒)
+WIN_COINS = 50
+LOSE_COINS = 10
+WAITING_ROOM_TTL = 10 * 60
+PLAYING_ROOM_TTL = 5 * 60
+ARCHIVE_AFTER = 24 * 60 * 60
+REAP_INTERVAL = 60
+
+# 断线后保留房间的时间(秒)，超时未重连的玩家判负
+RECONNECT_GRACE = 30
+
+# 对局回放：每一杆在内存中缓冲，已结束的房间每隔REPLAY_FLUSH_INTERVAL秒批量写出，
+# 多进程部署时每个工作进程写各自的文件
+replays = ReplayRecorder(
+    REPLAY_DIR,
+    "replays" if cluster.worker_index is None else f"replays-{cluster.worker_index}",
 )
+replay_reader = None
+REPLAY_FLUSH_INTERVAL = 5
+atexit.register(replays.flush)
+atexit.register(ledger.flush)
 
-# 设置输出到控制台的日志：级别过滤、格式
-console_handler = logging.StreamHandler()
-console_handler.setLevel(logging.DEBUG)
-console_handler.setFormatter(formatter)
-logger.addHandler(console_handler)
+# 球杆图片与用户头像，头像目录可通过环境变量配置
+bar_assets = StaticAssets(os.path.join(app.root_path, "bars"))
+head_assets = StaticAssets(
+    os.environ.get("STARBALL_HEAD_DIR") or os.path.join(app.root_path, "head")
+)
+head_sizes = {
+    size: head_assets
+    if size == avatars.DEFAULT_SIZE
+    else StaticAssets(os.path.join(head_assets.root, str(size)))
+    for size in avatars.SIZES
+}
 
-# 设置输出到滚动文件的日志：大小、数量、级别过滤、格式
-file_handler = RotatingFileHandler(LOG_FILE, maxBytes=5 * 1024 * 1024, backupCount=5)
-file_handler.setLevel(logging.INFO)
-file_handler.setFormatter(formatter)
-logger.addHandler(file_handler)
+# 协商使用二进制位置帧的连接
+binary_sids = set()
+
+# 按连接限流高频事件，配置见ratelimit.py
+limiter = ratelimit.RateLimiter()
+
+# 位置转发的最新者优先信箱：对手连接的发送队列积压达到POS_BACKLOG个包时不再排队，
+# 只记下房间，积压消化后由后台任务发送当时的最新局面，中间的位置帧全部合并
+POS_BACKLOG = 4
+POS_MAILBOX_INTERVAL = 0.01
+pos_mailbox = {}
+mailbox_task = None
+
+# 观战：观战者加入 watch:<房间id>，击球与位置由后台任务每隔SPECTATOR_INTERVAL秒合并后广播，
+# 玩家之间的转发不等待观战广播；位置更新只广播最新局面
+SPECTATOR_INTERVAL = 0.1
+MAX_SPECTATORS = 200
+watched_rooms = {}
+spectator_rooms = {}
+spectator_task = None
+
+# 日志写入logs目录下的JSON行文件，多进程部署时每个工作进程写各自的文件
+LOG_DIR = "logs"
+LOG_FILE = os.path.join(
+    LOG_DIR,
+    "starball.log"
+    if cluster.worker_index is None
+    else f"starball-{cluster.worker_index}.log",
+)
+logger = log_pipeline.setup("my_app", LOG_FILE)
+log_pipeline.install_signal("my_app")
 
 
 def initialize_table():
-    """创建数据库，建立表格"""
-    with sq.connect("starball.db") as conn:
-        conn.execute("PRAGMA foreign_keys = ON")
+    """创建数据库，建立表格，执行结构迁移"""
+    with db.connection() as conn:
         cur = conn.cursor()
 
         # 创建用户信息表
@@ -99,7 +193,15 @@ def initialize_table():
             FOREIGN KEY (player1_id) REFERENCES user_info(user_id),
             FOREIGN KEY (player2_id) REFERENCES user_info(user_id))"""
         )
+        version = migrate(conn)
         conn.commit()
+        logger.info("数据库结构版本: %s", version)
+
+
+def fixed_response(status, error=""):
+    """data为空的固定响应；error为空时message为ok。响应体按参数只编码一次"""
+    body = fast_json.envelope("fail" if error else "ok", error)
+    return app.response_class(body, status=status, mimetype="application/json")
 
 
 @app.route("/api/auth/register", methods=["POST"])
@@ -116,43 +218,55 @@ def register():
             raise ValueError("用户名或密码为空")
     except ValueError as reg_error:
         logger.warning("注册失败: %s", reg_error)
-        return jsonify({"message": "fail", "data": {}, "error": "无效的请求"}), 400
+        return fixed_response(400, "无效的请求")
 
     # 执行操作
     try:
-        with sq.connect("starball.db") as conn:
+        with db.connection() as conn:
             cur = conn.cursor()
             cur.execute("SELECT 1 FROM user_info WHERE user_name = ?", (user_name,))
             if cur.fetchone():
                 logger.info("用户名已被占用")
-                return (
-                    jsonify({"message": "fail", "data": {}, "error": "用户名已被占用"}),
-                    409,
-                )
+                return fixed_response(409, "用户名已被占用")
 
-            # 注册合法时执行加密，并插入表格
-            raw = password_plain.encode("utf-8")
-            password_hash = bcrypt.hashpw(raw, bcrypt.gensalt()).decode("utf-8")
+        # 注册合法时执行加密，并插入表格
+        password_hash = hash_password(password_plain)
+        with db.connection() as conn:
+            cur = conn.cursor()
             cur.execute(
                 """INSERT INTO user_info (user_name, password_hash) VALUES (?, ?)""",
                 (user_name, password_hash),
             )
-            conn.commit()
             user_id = cur.lastrowid
-            logger.info("用户%s注册成功", user_name)
-            return (
-                jsonify(
-                    {
-                        "message": "ok",
-                        "data": {"user_id": user_id, "coins": 300},
-                        "error": "",
-                    }
-                ),
-                201,
-            )
+            ledger.open_account(conn, user_id)
+        if leaderboard.loaded:
+            leaderboard.add_user(user_id, user_name)
+        token, expires_at = signer.issue(user_id)
+        logger.info("用户%s注册成功", user_name)
+        return (
+            jsonify(
+                {
+                    "message": "ok",
+                    "data": {
+                        "user_id": user_id,
+                        "coins": INITIAL_COINS,
+                        "token": token,
+                        "expires_at": expires_at,
+                    },
+                    "error": "",
+                }
+            ),
+            201,
+        )
+    except sq.IntegrityError:
+        logger.info("用户名已被占用")
+        return fixed_response(409, "用户名已被占用")
+    except HashPoolBusy:
+        logger.warning("密码服务繁忙, 拒绝注册请求")
+        return fixed_response(503, "服务繁忙")
     except sq.Error:
         logger.exception("数据库服务异常")
-        return jsonify({"message": "fail", "data": {}, "error": "数据库服务异常"}), 500
+        return fixed_response(500, "数据库服务异常")
 
 
 @app.route("/api/auth/login", methods=["POST"])
@@ -169,87 +283,178 @@ def login():
             raise ValueError("用户名或密码为空")
     except ValueError as log_error:
         logger.warning("登录失败: %s", log_error)
-        return jsonify({"message": "fail", "data": {}, "error": "无效的请求"}), 400
+        return fixed_response(400, "无效的请求")
 
     # 执行操作
     try:
-        with sq.connect("starball.db") as conn:
+        with db.connection() as conn:
             cur = conn.cursor()
             cur.execute(
                 "SELECT user_id, password_hash, coins FROM user_info WHERE user_name = ?",
                 (user_name,),
             )
             res = cur.fetchone()
-            if not res or not bcrypt.checkpw(
-                password.encode("utf-8"), res[1].encode("utf-8")
-            ):
-                logger.info("登陆失败")
-                return (
-                    jsonify(
-                        {
-                            "message": "fail",
-                            "data": {},
-                            "error": "用户名不存在或密码错误",
-                        }
-                    ),
-                    401,
-                )
+        if not res or not verify_password(password, res["password_hash"]):
+            logger.info("登陆失败")
+            return fixed_response(401, "用户名不存在或密码错误")
+
+        # 代价因子调整后，在登录成功时透明地更新哈希；服务繁忙时留待下次登录
+        if needs_rehash(res["password_hash"]):
+            try:
+                password_hash = hash_password(password)
+            except HashPoolBusy:
+                password_hash = None
+            if password_hash:
+                with db.connection() as conn:
+                    conn.execute(
+                        "UPDATE user_info SET password_hash = ? WHERE user_id = ?",
+                        (password_hash, res["user_id"]),
+                    )
+                logger.info("用户%s的密码哈希已更新", res["user_id"])
+
+        coins, _ = ledger.overlay(res["user_id"], res["coins"], 0)
+        token, expires_at = signer.issue(res["user_id"])
+        logger.info("登录成功")
+        return (
+            jsonify(
+                {
+                    "message": "ok",
+                    "data": {
+                        "user_id": res["user_id"],
+                        "coins": coins,
+                        "token": token,
+                        "expires_at": expires_at,
+                    },
+                    "error": "",
+                }
+            ),
+            200,
+        )
+    except HashPoolBusy:
+        logger.warning("密码服务繁忙, 拒绝登录请求")
+        return fixed_response(503, "服务繁忙")
+    except sq.Error:
+        logger.exception("数据库服务异常")
+        return fixed_response(500, "数据库服务异常")
+
 
-            logger.info("登录成功")
-            return (
-                jsonify(
-                    {
-                        "message": "ok",
-                        "data": {"user_id": res[0], "coins": res[2]},
-                        "error": "",
-                    }
-                ),
-                200,
+def bearer_claims():
+    """验证Authorization请求头中的令牌"""
+    scheme, _, token = request.headers.get("Authorization", "").partition(" ")
+    if scheme.lower() != "bearer":
+        raise InvalidToken("缺少令牌")
+    return signer.verify(token.strip())
+
+
+def request_user(claimed=None):
+    """HTTP请求的用户取自令牌；请求中另带的user_id必须与令牌一致"""
+    user_id = bearer_claims().user_id
+    if claimed not in (None, "") and int(claimed) != user_id:
+        raise InvalidToken(f"user_id {claimed} 与令牌不一致")
+    return user_id
+
+
+@app.route("/api/auth/logout", methods=["POST"])
+def logout():
+    """吊销当前令牌，并断开使用该令牌建立的socket连接"""
+    # 检查数据
+    try:
+        claims = bearer_claims()
+    except InvalidToken as auth_error:
+        logger.warning("退出登录失败: %s", auth_error)
+        return fixed_response(401, "未登录或登录已过期")
+
+    # 执行操作
+    try:
+        with db.connection() as conn:
+            conn.execute(
+                "INSERT OR IGNORE INTO revoked_token (token_id, user_id, expires_at) VALUES (?, ?, ?)",
+                (claims.token_id, claims.user_id, claims.expires_at),
             )
     except sq.Error:
         logger.exception("数据库服务异常")
-        return jsonify({"message": "fail", "data": {}, "error": "数据库服务异常"}), 500
+        return fixed_response(500, "数据库服务异常")
+    signer.revoke(claims)
+    for sid, session in list(socket_sessions.items()):
+        if session.token_id == claims.token_id:
+            socketio.server.disconnect(sid)
+    logger.info("用户%s退出登录", claims.user_id)
+    return fixed_response(200)
+
+
+def load_revocations():
+    """从数据库读取尚未过期的吊销记录，并删除已过期的记录"""
+    now = int(time.time())
+    with db.connection() as conn:
+        conn.execute("DELETE FROM revoked_token WHERE expires_at <= ?", (now,))
+        rows = conn.execute(
+            "SELECT token_id, expires_at FROM revoked_token WHERE expires_at > ?", (now,)
+        ).fetchall()
+    signer.load_revoked((row[0], row[1]) for row in rows)
 
 
 @app.route("/api/upload", methods=["POST"])
 def upload_head():
     """上传用户头像"""
-    # 检查数据
+    # 检查数据：Content-Length超过上限时在读取请求体之前拒绝；请求体边读取边解析，
+    # 文件超过上限或文件头不是图片时立即停止读取，不经过request.form/request.files的整体缓冲
+    request.max_content_length = avatars.MAX_UPLOAD_BYTES + avatars.FORM_OVERHEAD
     try:
-        user_id = int(request.form.get("user_id"))
-        if "head" not in request.files:
+        bearer_claims()
+        fields, head_name, content = avatars.read_upload(
+            request.stream, request.content_type
+        )
+        user_id = request_user(fields.get("user_id"))
+        if head_name is None:
             raise ValueError("未上传头像文件")
-        head_file = request.files["head"]
-        if head_file.filename == "":
+        if head_name == "":
             raise ValueError("头像文件名为空")
+    except InvalidToken as auth_error:
+        logger.warning("上传头像失败: %s", auth_error)
+        return fixed_response(401, "未登录或登录已过期")
+    except (RequestEntityTooLarge, avatars.AvatarTooLarge) as upload_error:
+        logger.warning("上传头像失败: %s", upload_error)
+        return fixed_response(413, "头像文件过大")
+    except avatars.InvalidAvatar as upload_error:
+        logger.warning("上传头像失败: %s", upload_error)
+        return fixed_response(400, "无效的图片")
     except (TypeError, ValueError) as upload_error:
         logger.warning("上传头像失败: %s", upload_error)
-        return jsonify({"message": "fail", "error": "无效的请求"}), 400
+        return fixed_response(400, "无效的请求")
 
-    # 执行操作
+    # 执行操作：文件名带缩略图内容的哈希，头像更新后URL随之变化，旧URL可以被永久缓存；
+    # 令牌验证通过即说明用户存在
     try:
-        filename = f"{user_id}.png"  
-        filepath = os.path.join("head", filename)  
-        os.makedirs(os.path.dirname(filepath), exist_ok=True) 
-        head_file.save(filepath)
+        # 解码与缩放在线程池中执行，不占用数据库连接
+        filename = avatars.store(head_assets.root, str(user_id), content)
 
-        with sq.connect("starball.db") as conn:
+        with db.connection() as conn:
             cur = conn.cursor()
+            cur.execute("SELECT head FROM user_info WHERE user_id = ?", (user_id,))
+            old = cur.fetchone()["head"]
             cur.execute(
                 "UPDATE user_info SET head = ? WHERE user_id = ?", (filename, user_id)
             )
-            if cur.rowcount == 0:
-                logger.warning("不存在的用户%s尝试上传头像", user_id)
-                return (
-                    jsonify({"message": "fail", "error": "无效的请求"}),
-                    404,
-                )
-            conn.commit()
-            logger.info("用户%s上传头像成功", user_id)
-            return jsonify({"message": "ok", "error": ""}), 200
+
+        # 删除被替换的旧头像
+        if old.startswith(f"{user_id}.") and old != filename:
+            for assets in head_sizes.values():
+                assets.forget(old)
+            avatars.remove(head_assets.root, old)
+        logger.info("用户%s上传头像成功", user_id)
+        return jsonify({"message": "ok", "data": {"head": filename}, "error": ""}), 200
+    except avatars.InvalidAvatar as upload_error:
+        logger.warning("上传头像失败: %s", upload_error)
+        return fixed_response(400, "无效的图片")
+    except avatars.AvatarPoolBusy:
+        logger.warning("头像处理排队已满")
+        return fixed_response(503, "服务繁忙")
+    except OSError:
+        logger.exception("头像保存失败")
+        return fixed_response(500, "头像保存失败")
     except sq.Error:
         logger.exception("数据库服务异常")
-        return jsonify({"message": "fail", "error": "数据库服务异常"}), 500
+        return fixed_response(500, "数据库服务异常")
 
 
 @app.route("/api/user", methods=["GET"])
@@ -260,12 +465,11 @@ def get_user_info():
         user_id = int(request.args.get("user_id"))
     except (TypeError, ValueError) as info_error:
         logger.warning("获取用户信息失败: %s", info_error)
-        return jsonify({"message": "fail", "data": {}, "error": "无效的请求"}), 400
+        return fixed_response(400, "无效的请求")
 
     # 执行操作
     try:
-        with sq.connect("starball.db") as conn:
-            conn.row_factory = sq.Row
+        with db.connection() as conn:
             cur = conn.cursor()
             cur.execute(
                 "SELECT bar_possess, coins, total_games, win_games, head "
@@ -277,34 +481,33 @@ def get_user_info():
             # 判定结果
             if not res:
                 logger.warning("不存在的用户尝试获取信息: user_id=%s", user_id)
-                return (
-                    jsonify({"message": "fail", "data": {}, "error": "获取信息失败"}),
-                    404,
-                )
-            bar_possess = res["bar_possess"]
+                return fixed_response(404, "获取信息失败")
             basic_info = {k: res[k] for k in res.keys() if k != "bar_possess"}
-            cur.execute("SELECT * FROM bar_info ORDER BY bar_id")
-            bars = cur.fetchall()
-            possess = []
-            for bar_row in bars:
-                bar_row = dict(bar_row)
-                bar_id = bar_row["bar_id"]
-                if (1 << (bar_id - 1)) & bar_possess:
-                    possess.append(bar_row)
+            basic_info["coins"], bar_possess = ledger.overlay(
+                user_id, res["coins"], res["bar_possess"]
+            )
+            possess, _ = catalog.split(bar_possess)
             logger.info("用户%s获取信息成功", user_id)
             return jsonify({"message": "ok", "data": basic_info | {"bar_possess": possess}, "error": ""}), 200
     except sq.Error:
         logger.exception("数据库服务异常")
-        return jsonify({"message": "fail", "data": {}, "error": "数据库服务异常"}), 500
+        return fixed_response(500, "数据库服务异常")
 
 
 @app.route('/bars/<filename>')
 def get_bars(filename):
-    return send_from_directory('bars', filename)
+    return bar_assets.serve(filename, request)
 
 @app.route('/head/<filename>')
 def get_head(filename):
-    return send_from_directory('head', filename)
+    # 默认返回小尺寸缩略图，size参数可选择其他固定尺寸
+    assets = head_sizes.get(request.args.get("size", avatars.DEFAULT_SIZE, type=int))
+    if assets is None:
+        return fixed_response(400, "无效的请求")
+    # 旧版头像({user_id}.png)与默认头像没有其他尺寸的缩略图，返回原图
+    if assets is not head_assets and filename not in assets:
+        assets = head_assets
+    return assets.serve(filename, request)
 
 
 @app.route("/api/bar/list", methods=["GET"])
@@ -315,58 +518,32 @@ def show_bar():
         user_id = int(request.args.get("user_id"))
     except (TypeError, ValueError) as info_error:
         logger.warning("获取球杆信息失败: %s", info_error)
-        return jsonify({"message": "fail", "data": {}, "error": "无效的请求"}), 400
+        return fixed_response(400, "无效的请求")
 
     # 执行操作
     try:
-        with sq.connect("starball.db") as conn:
-            conn.row_factory = sq.Row
-            cur = conn.cursor()
-            cur.execute(
-                "SELECT bar_possess FROM user_info WHERE user_id = ?", (user_id,)
-            )
-            res = cur.fetchone()
-            if not res:
-                logger.warning("不存在的用户尝试获取球杆信息: user_id=%s", user_id)
-                return (
-                    jsonify({"message": "fail", "data": {}, "error": "获取信息失败"}),
-                    404,
-                )
-            bar_possess = res[0]
-
-            cur.execute("SELECT * FROM bar_info ORDER BY bar_id")
-            bars = cur.fetchall()
-            if not bars:
-                logger.error("商城初始化错误")
-                return (
-                    jsonify({"message": "fail", "data": {}, "error": "商城初始化错误"}),
-                    500,
-                )
+        account = ledger.account(user_id)
+        if not account:
+            logger.warning("不存在的用户尝试获取球杆信息: user_id=%s", user_id)
+            return fixed_response(404, "获取信息失败")
+        bar_possess = account.bar_possess
 
-            # 计算用户球杆资源情况
-            possess, npossess = [], []
-            for bar_row in bars:
-                bar_row = dict(bar_row)
-                bar_id = bar_row["bar_id"]
-                if (1 << (bar_id - 1)) & bar_possess:
-                    possess.append(bar_row)
-                else:
-                    npossess.append(bar_row)
-
-            logger.info("获取球杆信息成功")
-            return (
-                jsonify(
-                    {
-                        "message": "ok",
-                        "data": {"bar_possess": possess, "bar_npossess": npossess},
-                        "error": "",
-                    }
-                ),
-                200,
-            )
+        possess, npossess = catalog.split(bar_possess)
+        if not possess and not npossess:
+            logger.error("商城初始化错误")
+            return fixed_response(500, "商城初始化错误")
+
+        # 目录与用户拥有情况均未变化时返回304
+        logger.info("获取球杆信息成功")
+        response = app.response_class(
+            catalog.listing(bar_possess), mimetype="application/json"
+        )
+        response.set_etag(catalog.etag(bar_possess))
+        response.headers["Cache-Control"] = "no-cache"
+        return response.make_conditional(request)
     except sq.Error:
         logger.exception("数据库服务异常")
-        return jsonify({"message": "fail", "data": {}, "error": "数据库服务异常"}), 500
+        return fixed_response(500, "数据库服务异常")
 
 
 @app.route("/api/auth/buy", methods=["POST"])
@@ -377,99 +554,47 @@ def buy_bar():
         data = request.get_json()
         if not data:
             raise ValueError("客户端未传递数据")
-        user_id = int(data.get("user_id"))
+        user_id = request_user(data.get("user_id"))
         bar_id = int(data.get("bar_id"))
         if not user_id or not bar_id:
             raise ValueError("用户id或球杆id为空")
+    except InvalidToken as auth_error:
+        logger.warning("购买失败: %s", auth_error)
+        return fixed_response(401, "未登录或登录已过期")
     except ValueError as buy_error:
         logger.warning("购买失败: %s", buy_error)
-        return jsonify({"message": "fail", "data": {}, "error": "无效的请求"}), 400
+        return fixed_response(400, "无效的请求")
 
-    # 执行操作
+    # 执行操作：余额检查与扣款在金币账本中一次完成
+    price = catalog.price(bar_id)
+    if price is None:
+        logger.info("购买失败, 无效的球杆id:%s", bar_id)
+        return fixed_response(404, "球杆不存在")
     try:
-        with sq.connect("starball.db") as conn:
-            conn.row_factory = sq.Row
-            cur = conn.cursor()
-            # 检查用户id合法性
-            cur.execute(
-                "SELECT coins, bar_possess FROM user_info WHERE user_id = ?", (user_id,)
-            )
-            res = cur.fetchone()
-            if not res:
-                logger.info("购买失败, 用户%s不存在", user_id)
-                return (
-                    jsonify({"message": "fail", "data": {}, "error": "用户不存在"}),
-                    404,
-                )
-            coins = res[0]
-            bar_possess = res[1]
-
-            # 检查球杆id合法性
-            cur.execute("SELECT price FROM bar_info WHERE bar_id = ?", (bar_id,))
-            res = cur.fetchone()
-            if not res:
-                logger.info("购买失败, 无效的球杆id:%s", bar_id)
-                return (
-                    jsonify({"message": "fail", "data": {}, "error": "球杆不存在"}),
-                    404,
-                )
-            price = res[0]
-
-            # 检查购买操作合法性
-            if bar_possess & (1 << (bar_id - 1)) or coins < price:
-                logger.warning("已拥有当前球杆或余额不足")
-                return (
-                    jsonify(
-                        {
-                            "message": "fail",
-                            "data": {},
-                            "error": "已拥有当前球杆或余额不足",
-                        }
-                    ),
-                    409,
-                )
-
-            # 购买成功
-            coins = coins - price
-            bar_possess = bar_possess | (1 << (bar_id - 1))
-            cur.execute(
-                "UPDATE user_info SET coins = ?, bar_possess = ? WHERE user_id = ?",
-                (coins, bar_possess, user_id),
-            )
-            conn.commit()
-
-            # 计算用户球杆资源情况
-            cur.execute("SELECT * FROM bar_info ORDER BY bar_id")
-            bars = cur.fetchall()
-            if not bars:
-                logger.error("商城初始化错误")
-                return (
-                    jsonify({"message": "fail", "data": {}, "error": "商城初始化错误"}),
-                    500,
-                )
-            
-            possess, npossess = [], []
-            for bar_row in bars:
-                bar_row = dict(bar_row)
-                bar_id = bar_row["bar_id"]
-                if (1 << (bar_id - 1)) & bar_possess:
-                    possess.append(bar_row)
-                else:
-                    npossess.append(bar_row)
-            logger.info("购买成功")
-            return (
-                jsonify(
-                    {
-                        "message": "ok",
-                        "data": {"coins": coins, "bar_possess": possess, "bar_npossess": npossess},
-                        "error": "",
-                    }
-                ),
-                200,
-            )
+        account = ledger.buy(user_id, bar_id, price)
+    except PurchaseRejected:
+        logger.warning("已拥有当前球杆或余额不足")
+        return fixed_response(409, "已拥有当前球杆或余额不足")
     except sq.Error:
         logger.exception("数据库服务异常")
-        return jsonify({"message": "fail", "data": {}, "error": "数据库服务异常"}), 500
+        return fixed_response(500, "数据库服务异常")
+    if not account:
+        logger.info("购买失败, 用户%s不存在", user_id)
+        return fixed_response(404, "用户不存在")
+
+    # 计算用户球杆资源情况
+    possess, npossess = catalog.split(account.bar_possess)
+    logger.info("购买成功")
+    return (
+        jsonify(
+            {
+                "message": "ok",
+                "data": {"coins": account.coins, "bar_possess": possess, "bar_npossess": npossess},
+                "error": "",
+            }
+        ),
+        200,
+    )
 
 
 @app.route("/api/room/create", methods=["POST"])
@@ -480,52 +605,40 @@ def create_room():
         data = request.get_json()
         if not data:
             raise ValueError("客户端未传递数据")
-        user_id = int(data.get("user_id"))
+        user_id = request_user(data.get("user_id"))
         if not user_id:
             raise ValueError("用户id为空")
+    except InvalidToken as auth_error:
+        logger.warning("创建房间失败: %s", auth_error)
+        return fixed_response(401, "未登录或登录已过期")
     except ValueError as crt_error:
         logger.warning("创建房间失败: %s", crt_error)
-        return jsonify({"message": "fail", "data": {}, "error": "无效的请求"}), 400
+        return fixed_response(400, "无效的请求")
 
-    # 执行操作
+    # 执行操作：令牌验证通过即说明用户存在
     try:
-        with sq.connect("starball.db") as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT 1 FROM user_info WHERE user_id = ?", (user_id,))
-            res = cur.fetchone()
-            if not res:
-                logger.warning("不存在的用户%s试图创建房间", user_id)
-                return (
-                    jsonify({"message": "fail", "data": {}, "error": "无效的请求"}),
-                    404,
-                )
+        if rooms.room_of(user_id):
+            logger.info("房间创建失败")
+            return fixed_response(409, "用户有尚未退出的房间")
 
-            cur.execute(
-                """SELECT room_id FROM room_info WHERE (player1_id = ? OR player2_id = ?)
-                AND state <> 2""",
-                (user_id, user_id),
-            )
-            res = cur.fetchone()
-            if res:
-                logger.info("房间创建失败")
-                return (
-                    jsonify(
-                        {"message": "fail", "data": {}, "error": "用户有尚未退出的房间"}
-                    ),
-                    409,
-                )
-
-            cur.execute("""INSERT INTO room_info (player1_id) VALUES (?)""", (user_id,))
-            conn.commit()
-            room_id = cur.lastrowid
-            logger.info("房间创建成功")
-            return (
-                jsonify({"message": "ok", "data": {"room_id": room_id}, "error": ""}),
-                200,
-            )
+        room = rooms.open_room(user_id)
+        logger.info("房间创建成功")
+        return (
+            jsonify({"message": "ok", "data": room_data(room), "error": ""}),
+            200,
+        )
     except sq.Error:
         logger.exception("数据库服务异常")
-        return jsonify({"message": "fail", "data": {}, "error": "数据库服务异常"}), 500
+        return fixed_response(500, "数据库服务异常")
+
+
+def room_data(room):
+    """房间接口返回的数据，多进程部署时附带房间所属工作进程的socket端口"""
+    data = {"room_id": room.room_id}
+    port = cluster.affinity_port(room.room_id)
+    if port is not None:
+        data["socket_port"] = port
+    return data
 
 
 @app.route("/api/room/join", methods=["POST"])
@@ -536,39 +649,203 @@ def join_later():
         data = request.get_json()
         if not data:
             raise ValueError("客户端未传递数据")
-        user_id = int(data.get("user_id"))
+        user_id = request_user(data.get("user_id"))
         room_id = int(data.get("room_id"))
         if not user_id or not room_id:
             raise ValueError("用户id或房间id为空")
+    except InvalidToken as auth_error:
+        logger.warning("进入房间失败: %s", auth_error)
+        return fixed_response(401, "未登录或登录已过期")
     except ValueError as join_error:
         logger.warning("进入房间失败: %s", join_error)
-        return jsonify({"message": "fail", "error": "无效的请求"}), 400
+        return fixed_response(400, "无效的请求")
+
+    # 执行操作：令牌验证通过即说明用户存在
+    try:
+        room = rooms.fill_room(room_id, user_id)
+        if not room:
+            logger.warning("房间不存在或者已满")
+            return fixed_response(404, "无效的请求")
+        room.table = TableState.rack()
+        logger.info("进入房间成功")
+        return jsonify({"message": "ok", "data": room_data(room), "error": ""}), 200
+    except sq.Error:
+        logger.exception("数据库服务异常")
+        return fixed_response(500, "数据库服务异常")
+
+
+@app.route("/api/match/enqueue", methods=["POST"])
+def enqueue_match():
+    """用户加入匹配队列"""
+    # 检查数据
+    try:
+        data = request.get_json()
+        if not data:
+            raise ValueError("客户端未传递数据")
+        user_id = request_user(data.get("user_id"))
+        if not user_id:
+            raise ValueError("用户id为空")
+    except InvalidToken as auth_error:
+        logger.warning("加入匹配失败: %s", auth_error)
+        return fixed_response(401, "未登录或登录已过期")
+    except (TypeError, ValueError) as match_error:
+        logger.warning("加入匹配失败: %s", match_error)
+        return fixed_response(400, "无效的请求")
 
     # 执行操作
+    global match_task
     try:
-        with sq.connect("starball.db") as conn:
+        with db.connection() as conn:
             cur = conn.cursor()
-            cur.execute("SELECT 1 FROM user_info WHERE user_id = ?", (user_id,))
-            if not cur.fetchone():
-                logger.warning("不存在的用户%s尝试进入房间", user_id)
-                return jsonify({"message": "fail", "error": "无效的请求"}), 404
             cur.execute(
-                "SELECT player2_id, state FROM room_info WHERE room_id = ?", (room_id,)
+                "SELECT total_games, win_games FROM user_info WHERE user_id = ?",
+                (user_id,),
             )
             res = cur.fetchone()
-            if not res or res[0] or res[1] != 0:
-                logger.warning("房间不存在或者已满")
-                return jsonify({"message": "fail", "error": "无效的请求"}), 404
-            cur.execute(
-                "UPDATE room_info SET player2_id = ?, state = 1 WHERE room_id = ?",
-                (user_id, room_id),
-            )
-            conn.commit()
-            logger.info("进入房间成功")
-            return jsonify({"message": "ok", "error": ""}), 200
+        if not res:
+            logger.warning("不存在的用户%s试图加入匹配", user_id)
+            return fixed_response(404, "无效的请求")
+        if rooms.room_of(user_id):
+            logger.info("用户%s有尚未退出的房间, 无法加入匹配", user_id)
+            return fixed_response(409, "用户有尚未退出的房间")
+
+        pair = matchmaker.enqueue(
+            user_id, win_rate(res["total_games"], res["win_games"])
+        )
+        if pair:
+            room = start_match(*pair)
+            if room:
+                return jsonify({"message": "ok", "data": match_data(room), "error": ""}), 200
+            if user_id not in matchmaker:
+                logger.info("用户%s有尚未退出的房间, 无法加入匹配", user_id)
+                return fixed_response(409, "用户有尚未退出的房间")
+        if match_task is None and len(matchmaker):
+            match_task = socketio.start_background_task(run_matchmaking)
+        logger.info("用户%s加入匹配队列", user_id)
+        return jsonify({"message": "ok", "data": {"matched": False}, "error": ""}), 200
     except sq.Error:
         logger.exception("数据库服务异常")
-        return jsonify({"message": "fail", "data": {}, "error": "数据库服务异常"}), 500
+        return fixed_response(500, "数据库服务异常")
+
+
+@app.route("/api/match/cancel", methods=["POST"])
+def cancel_match():
+    """用户退出匹配队列"""
+    # 检查数据
+    try:
+        data = request.get_json()
+        if not data:
+            raise ValueError("客户端未传递数据")
+        user_id = request_user(data.get("user_id"))
+    except InvalidToken as auth_error:
+        logger.warning("退出匹配失败: %s", auth_error)
+        return fixed_response(401, "未登录或登录已过期")
+    except (TypeError, ValueError) as match_error:
+        logger.warning("退出匹配失败: %s", match_error)
+        return fixed_response(400, "无效的请求")
+
+    # 执行操作
+    if not matchmaker.cancel(user_id):
+        logger.info("用户%s不在匹配队列中", user_id)
+        return fixed_response(404, "用户不在匹配队列中")
+    logger.info("用户%s退出匹配队列", user_id)
+    return fixed_response(200)
+
+
+@socketio.on("connect")
+def handle_connect(auth=None):
+    """建立连接时验证auth中的令牌并绑定身份；不带令牌的连接只能观战"""
+    token = auth.get("token") if isinstance(auth, dict) else None
+    if token is None:
+        return
+    try:
+        socket_sessions[request.sid] = signer.verify(token)
+    except InvalidToken as auth_error:
+        logger.warning("连接认证失败: %s", auth_error)
+        raise ConnectionRefusedError("未登录或登录已过期")
+
+
+def socket_user(data):
+    """连接认证时绑定的用户；事件中另带的user_id必须与之一致"""
+    session = socket_sessions.get(request.sid)
+    if session is None:
+        raise InvalidToken("连接未认证")
+    claimed = data.get("user_id") if isinstance(data, dict) else None
+    if claimed not in (None, "") and int(claimed) != session.user_id:
+        raise InvalidToken(f"user_id {claimed} 与连接的身份不一致")
+    return session.user_id
+
+
+@socketio.on("match_wait")
+def match_wait(data):
+    """排队中的用户登记socket连接，用于接收match_found"""
+    try:
+        user_id = socket_user(data)
+    except InvalidToken as auth_error:
+        logger.warning("登记匹配连接失败: %s", auth_error)
+        emit("fail", {"error": "未登录或登录已过期"})
+        return
+    except (AttributeError, TypeError, ValueError) as match_error:
+        logger.warning("登记匹配连接失败: %s", match_error)
+        emit("fail", {"error": "无效的请求"})
+        return
+    rooms.bind_sid(user_id, request.sid)
+    emit("match_wait_ok", {"queued": user_id in matchmaker})
+
+
+def match_data(room):
+    """匹配成功时返回给双方的数据"""
+    return room_data(room) | {
+        "matched": True,
+        "player1_id": room.player1_id,
+        "player2_id": room.player2_id,
+    }
+
+
+def start_match(player1_id, player2_id):
+    """
+    为配对的两名玩家创建房间并通知双方；任一玩家已有房间时放弃本次配对，
+    没有房间的玩家按原来的等待时间放回匹配队列
+    """
+    pair = (player1_id, player2_id)
+    try:
+        room = rooms.create_match(player1_id, player2_id)
+    except sq.Error:
+        for user_id in pair:
+            matchmaker.requeue(user_id)
+        raise
+    if not room:
+        for user_id in pair:
+            if rooms.room_of(user_id):
+                matchmaker.confirm(user_id)
+            else:
+                matchmaker.requeue(user_id)
+        logger.warning("玩家%s与%s匹配失败: 已有未结束的房间", player1_id, player2_id)
+        return None
+    for user_id in pair:
+        matchmaker.confirm(user_id)
+    room.table = TableState.rack()
+    logger.info("玩家%s与%s匹配成功, 房间%s", player1_id, player2_id, room.room_id)
+    for user_id in (player1_id, player2_id):
+        sid = rooms.sid_of(user_id)
+        if sid:
+            relay("match_found", match_data(room), sid)
+    return room
+
+
+def run_matchmaking():
+    """后台为等待中的玩家重新配对，队列为空时退出"""
+    global match_task
+    try:
+        while len(matchmaker):
+            socketio.sleep(MATCH_INTERVAL)
+            for pair in matchmaker.tick():
+                try:
+                    start_match(*pair)
+                except sq.Error:
+                    logger.exception("数据库服务异常")
+    finally:
+        match_task = None
 
 
 @socketio.on("join_room")
@@ -578,47 +855,41 @@ def handle_join_room(data):
     try:
         if not data:
             raise ValueError("客户端未传递数据")
-        user_id = int(data.get("user_id"))
+        user_id = socket_user(data)
         room_id = int(data.get("room_id"))
         if not user_id or not room_id:
             raise ValueError("用户id或房间id为空")
+    except InvalidToken as auth_error:
+        logger.warning("进入房间失败: %s", auth_error)
+        emit("fail", {"error": "未登录或登录已过期"})
+        return
     except ValueError as join_error:
         logger.warning("进入房间失败: %s", join_error)
         emit("fail", {"error": "无效的请求"})
         return
 
     # 执行操作
-    try:
-        with sq.connect("starball.db") as conn:
-            cur = conn.cursor()
-            cur.execute(
-                """SELECT room_id, player1_id, player2_id FROM room_info WHERE room_id = ? AND
-                (player1_id = ? OR player2_id = ?) AND state <> 2""",
-                (room_id, user_id, user_id),
-            )
-            res = cur.fetchone()
-            if not res:
-                logger.warning("用户不存在或者房间不存在")
-                emit("fail", {"error": "无效的请求"})
-                return
-            player1, player2 = res[1], res[2]
-            join_room(str(room_id))
-            user_sockets[user_id] = request.sid
-            if user_id == player1:
-                logger.info("房间%s创建者%s加入房间", room_id, player1)
-                emit("ok", {"room_id": room_id})
-                return
-            logger.info("玩家%s加入房间, 游戏正式开始", player2)
-            emit(
-                "game start",
-                {"player1_id": player1, "player2_id": player2, "room_id": room_id},
-                room=room_id,
-            )
-            return
-    except sq.Error:
-        logger.exception("数据库服务异常")
-        emit("fail", {"error": "数据库服务异常"})
+    room = rooms.get(room_id)
+    if room and user_id not in (room.player1_id, room.player2_id):
+        room = rooms.refresh(room)
+    if not room or user_id not in (room.player1_id, room.player2_id):
+        logger.warning("用户不存在或者房间不存在")
+        emit("fail", {"error": "无效的请求"})
+        return
+    player1, player2 = room.player1_id, room.player2_id
+    join_room(str(room_id))
+    rooms.bind_sid(user_id, request.sid)
+    room.touch()
+    if user_id == player1:
+        logger.info("房间%s创建者%s加入房间", room_id, player1)
+        emit("ok", {"room_id": room_id})
         return
+    logger.info("玩家%s加入房间, 游戏正式开始", player2)
+    emit(
+        "game start",
+        {"player1_id": player1, "player2_id": player2, "room_id": room_id},
+        room=room_id,
+    )
 
 
 @socketio.on("shoot")
@@ -628,7 +899,7 @@ def shoot(data):
     try:
         if not data:
             raise ValueError("客户端未传递数据")
-        user_id = data.get("user_id")
+        user_id = socket_user(data)
         angle = data.get("angle")
         power = data.get("power")
         if (
@@ -638,101 +909,720 @@ def shoot(data):
             or not (0 <= angle <= 360 and 0 <= power <= 100)
         ):
             raise ValueError("无效的请求")
-    except ValueError as shoot_error:
+    except InvalidToken as auth_error:
+        logger.warning("传递击球数据失败: %s", auth_error)
+        emit("fail", {"error": "未登录或登录已过期"})
+        return
+    except (TypeError, ValueError) as shoot_error:
         logger.warning("传递击球数据失败: %s", shoot_error)
         emit("fail", {"error": "无效的请求"})
         return
 
-    # 执行操作
+    # 执行操作：不在自己回合或上一杆尚未结束的击球在转发前拒绝
+    room = rooms.room_of(user_id)
+    if room and (
+        room.state != ROOM_PLAYING
+        or room.rules.shooter != user_id
+        or room.room_id in simulator
+    ):
+        logger.info("用户%s不在自己的回合击球", user_id)
+        emit("fail", {"error": "不是你的回合"})
+        return
+    target_sid = rooms.opponent_sid(user_id)
+    if not target_sid:
+        logger.warning("用户%s发出异常请求", user_id)
+        emit("fail", {"error": "异常请求"})
+        return
+    logger.info(
+        "击球数据发送成功",
+        extra={"event": "shoot", "room_id": room.room_id, "user_id": user_id},
+    )
+    relay("opponent_hit", {"angle": angle, "power": power}, target_sid)
+    emit("shoot_success")
+    if room.audience:
+        room.audience.hits.append({"user_id": user_id, "angle": angle, "power": power})
+    room.touch()
+    replays.shot(room.room_id, user_id, angle, power)
+    simulate_shot(room, angle, power)
+
+
+def relay(event, data, sid):
+    """向对手转发事件，对手连接在本进程时不经过消息队列"""
+    local = socketio.server.manager.is_connected(sid, "/")
+    socketio.emit(event, data, to=sid, ignore_queue=local)
+    metrics.relays.inc(event, "local" if local else "queue")
+
+
+def simulate_shot(room, angle, power):
+    """把击球加入批量模拟，必要时启动后台模拟任务"""
+    global physics_task
+    if room.table is None:
+        room.table = TableState.rack()
+    if not simulator.submit(room.room_id, room.table, shot_force(angle, power)):
+        logger.warning("房间%s上一杆尚未模拟完成", room.room_id)
+        return
+    if physics_task is None:
+        physics_task = socketio.start_background_task(run_physics)
+
+
+def run_physics():
+    """后台推进所有进行中的击球，静止后把最终局面写回房间并裁定本回合"""
+    global physics_task
     try:
-        with sq.connect("starball.db") as conn:
-            cur = conn.cursor()
-            cur.execute(
-                """SELECT player1_id, player2_id FROM room_info WHERE
-                (player1_id = ? OR player2_id = ?) AND state = 1""",
-                (user_id, user_id),
-            )
-            res = cur.fetchone()
-            if not res:
-                logger.warning("用户%s发出异常请求", user_id)
-                emit("fail", {"error": "异常请求"})
-                return
-            if res[0] == user_id:
-                target = res[1]
-            else:
-                target = res[0]
-            logger.info("击球数据发送成功")
-            emit(
-                "opponent_hit",
-                {"angle": angle, "power": power},
-                to=user_sockets[target],
-            )
-            emit("shoot_success")
-            return
+        while simulator.active:
+            for room_id, table, turn_data in simulator.advance(PHYSICS_FRAMES_PER_TICK):
+                room = rooms.get(room_id)
+                if turn_data["cueBallPocketed"]:
+                    table.reset_cue()
+                logger.info(
+                    "房间%s击球模拟完成: %s",
+                    room_id,
+                    turn_data,
+                    extra={"event": "shot_done", "room_id": room_id},
+                )
+                if room:
+                    room.table = table
+                    judge_turn(room, turn_data)
+            socketio.sleep(0)
+    finally:
+        physics_task = None
+
+
+def judge_turn(room, turn_data):
+    """用规则引擎裁定一杆的结果，通知房间内的玩家，决出胜负时结算对局"""
+    report = room.rules.analyze(turn_data, room.opponent(room.rules.shooter))
+    replays.result(room.room_id, report, room.table)
+    report["finalBallStates"] = room.table.ball_states()
+    socketio.emit("turn_result", report, to=room_targets(room.room_id))
+    winner_id = report["turnWinnerId"]
+    try:
+        if winner_id is None:
+            rooms.save_turn(room)
+        else:
+            settle_room(room, winner_id)
     except sq.Error:
         logger.exception("数据库服务异常")
-        emit("fail", {"error": "数据库服务异常"})
+
+
+@socketio.on("pos_codec")
+def pos_codec(data):
+    """客户端协商位置数据的传输格式：json(默认)或binary"""
+    codec = data.get("codec") if data else None
+    if codec == "binary":
+        binary_sids.add(request.sid)
+    elif codec == "json":
+        binary_sids.discard(request.sid)
+    else:
+        logger.warning("不支持的位置数据格式: %s", codec)
+        emit("fail", {"error": "无效的请求"})
         return
+    emit("codec_ok", {"codec": codec})
 
 
 @socketio.on("send_pos")
 def send_pos(data):
-    """传递击球方得到的球的位置"""
+    """传递击球方得到的球的位置，data中带frame字段时为二进制增量帧"""
     # 检查数据
     try:
         if not data:
             raise ValueError("客户端未传递数据")
-        user_id = data.get("user_id")
-        balls = data.get("balls", [])
-        error = False
-        if not balls:
-            raise ValueError("无效的请求")
-        for ball in balls:
-            ball_id = ball["ball_id"]
-            ball_posx = ball["ball_posx"]
-            ball_posy = ball["ball_posy"]
-            if (not 0 <= ball_id <= 21) or (not 0 <= ball_posy <= 400) or (not 0 <= ball_posx <= 800):
-                error = True
-                break
-        if not user_id or error:
+        user_id = socket_user(data)
+        frame = data.get("frame")
+        balls = None
+        if frame is not None:
+            flags, seq, base, packed = decode(frame)
+        else:
+            balls = data.get("balls", [])
+            error = False
+            if not balls:
+                raise ValueError("无效的请求")
+            for ball in balls:
+                ball_id = ball["ball_id"]
+                ball_posx = ball["ball_posx"]
+                ball_posy = ball["ball_posy"]
+                if (not 0 <= ball_id <= 21) or (not 0 <= ball_posy <= 400) or (not 0 <= ball_posx <= 800):
+                    error = True
+                    break
+            if error:
+                raise ValueError("无效的请求")
+            packed = from_json(balls)
+        if not user_id:
             raise ValueError("无效的请求")
-    except ValueError as pos_error:
+    except InvalidToken as auth_error:
+        logger.warning("传递位置数据失败: %s", auth_error)
+        emit("fail", {"error": "未登录或登录已过期"})
+        return
+    except (TypeError, ValueError, KeyError) as pos_error:
         logger.warning("传递位置数据失败: %s", pos_error)
         emit("fail", {"error": "无效的请求"})
         return
 
     # 执行操作
-    try:
-        with sq.connect("starball.db") as conn:
-            cur = conn.cursor()
-            cur.execute(
-                """SELECT player1_id, player2_id FROM room_info WHERE
-                (player1_id = ? OR player2_id = ?) AND state = 1""",
-                (user_id, user_id),
-            )
-            res = cur.fetchone()
-            if not res:
-                logger.warning("用户%s发出异常请求", user_id)
-                emit("fail", {"error": "异常请求"})
-                return
-            if res[0] == user_id:
-                target = res[1]
-            else:
-                target = res[0]
-            logger.info("位置数据发送成功")
-            emit(
-                "opponent_pos",
-                {"balls": balls},
-                to=user_sockets[target],
-            )
-            emit("send_success")
+    target_sid = rooms.opponent_sid(user_id)
+    if not target_sid:
+        logger.warning("用户%s发出异常请求", user_id)
+        emit("fail", {"error": "异常请求"})
+        return
+    room = rooms.room_of(user_id)
+    room.touch()
+    if room.positions is None:
+        room.positions = PositionState()
+    if frame is not None:
+        try:
+            room.positions.apply(flags, seq, base, packed)
+        except StaleFrame as stale:
+            logger.info("用户%s的位置帧需要重新同步: %s", user_id, stale)
+            emit("pos_resync", {"seq": room.positions.seq})
             return
+        relay_frame = bytes(frame)
+    else:
+        relay_frame = room.positions.update(packed)
+
+    # 按接收方协商的格式转发：二进制帧原样转发，JSON客户端收到完整局面
+    logger.info(
+        "位置数据发送成功",
+        extra={"event": "send_pos", "room_id": room.room_id, "user_id": user_id},
+    )
+    if target_sid in pos_mailbox or backlog(target_sid) >= POS_BACKLOG:
+        defer_pos(room, target_sid)
+    elif target_sid in binary_sids:
+        relay("opponent_pos", {"frame": relay_frame}, target_sid)
+    elif balls is not None:
+        relay("opponent_pos", {"balls": balls}, target_sid)
+    else:
+        relay("opponent_pos", {"balls": room.positions.to_json()}, target_sid)
+    emit("send_success", {"seq": room.positions.seq})
+    if room.audience:
+        room.audience.moved = True
+
+
+def backlog(sid):
+    """连接的发送队列中尚未写出的包数，连接不在本进程时返回0"""
+    eio_sid = socketio.server.manager.eio_sid_from_sid(sid, "/")
+    socket = socketio.server.eio.sockets.get(eio_sid) if eio_sid else None
+    return socket.queue.qsize() if socket else 0
+
+
+def defer_pos(room, sid):
+    """把位置转发放入信箱，信箱中已有的未发送位置被合并"""
+    global mailbox_task
+    if sid in pos_mailbox:
+        metrics.coalesced.inc("opponent_pos")
+    pos_mailbox[sid] = room
+    if mailbox_task is None:
+        mailbox_task = socketio.start_background_task(run_pos_mailbox)
+
+
+def run_pos_mailbox():
+    """后台检查信箱，接收方积压消化后发送最新局面：二进制连接收到关键帧，JSON连接收到完整局面"""
+    global mailbox_task
+    try:
+        while pos_mailbox:
+            socketio.sleep(POS_MAILBOX_INTERVAL)
+            for sid, room in list(pos_mailbox.items()):
+                if not socketio.server.manager.is_connected(sid, "/"):
+                    del pos_mailbox[sid]
+                elif backlog(sid) < POS_BACKLOG:
+                    del pos_mailbox[sid]
+                    if sid in binary_sids:
+                        relay("opponent_pos", {"frame": room.positions.keyframe()}, sid)
+                    else:
+                        relay("opponent_pos", {"balls": room.positions.to_json()}, sid)
+    finally:
+        mailbox_task = None
+
+
+def reject_event(sid, event):
+    """超出限流的事件：计数后丢弃，连续被拒绝的击球等低频事件只回复第一次"""
+    metrics.rate_limited.inc(event)
+    if limiter.should_notify(sid, event):
+        socketio.emit("fail", {"error": "操作过于频繁"}, to=sid, ignore_queue=True)
+
+
+@socketio.on("pos_resync")
+def pos_resync(data):
+    """接收方局面与增量帧不一致时，请求当前完整局面的关键帧"""
+    try:
+        user_id = socket_user(data)
+    except InvalidToken as auth_error:
+        logger.warning("请求同步位置失败: %s", auth_error)
+        emit("fail", {"error": "未登录或登录已过期"})
+        return
+    except (AttributeError, TypeError, ValueError) as sync_error:
+        logger.warning("请求同步位置失败: %s", sync_error)
+        emit("fail", {"error": "无效的请求"})
+        return
+    room = rooms.room_of(user_id)
+    if not room or room.positions is None:
+        emit("fail", {"error": "异常请求"})
+        return
+    emit("opponent_pos", {"frame": room.positions.keyframe()})
+
+
+def watch_room(room_id):
+    """观战者所在的socketio房间名"""
+    return f"watch:{room_id}"
+
+
+def room_targets(room_id):
+    """房间内的玩家与观战者"""
+    return [str(room_id), watch_room(room_id)]
+
+
+def close_rooms(room_id):
+    """对局结束：解散玩家与观战者的socketio房间"""
+    socketio.close_room(str(room_id))
+    socketio.close_room(watch_room(room_id))
+    room = watched_rooms.pop(room_id, None)
+    if room and room.audience:
+        for sid in room.audience.sids:
+            spectator_rooms.pop(sid, None)
+        room.audience = None
+
+
+@socketio.on("spectate")
+def spectate(data):
+    """观战者进入对局中的房间，返回当前局面"""
+    global spectator_task
+    # 检查数据
+    try:
+        room_id = int(data.get("room_id"))
+    except (AttributeError, TypeError, ValueError) as watch_error:
+        logger.warning("观战失败: %s", watch_error)
+        emit("fail", {"error": "无效的请求"})
+        return
+
+    # 执行操作
+    room = rooms.get(room_id)
+    if not room or room.state != ROOM_PLAYING:
+        emit("fail", {"error": "房间不存在或未开始"})
+        return
+    if rooms.user_of_sid(request.sid) is not None:
+        emit("fail", {"error": "玩家不能观战"})
+        return
+    if room.audience and len(room.audience.sids) >= MAX_SPECTATORS:
+        emit("fail", {"error": "观战人数已满"})
+        return
+    leave_audience(request.sid)
+    if room.audience is None:
+        room.audience = Audience()
+    room.audience.sids.add(request.sid)
+    spectator_rooms[request.sid] = room_id
+    watched_rooms[room_id] = room
+    join_room(watch_room(room_id))
+    logger.info("房间%s新增观战者, 共%s人", room_id, len(room.audience.sids))
+    emit("spectate_ok", resume_data(room) | {"spectators": len(room.audience.sids)})
+    if spectator_task is None:
+        spectator_task = socketio.start_background_task(run_spectators)
+
+
+@socketio.on("stop_spectate")
+def stop_spectate(data=None):
+    """观战者离开房间"""
+    leave_audience(request.sid)
+
+
+def leave_audience(sid):
+    """把连接移出所观战的房间，房间没有观战者时停止广播"""
+    room_id = spectator_rooms.pop(sid, None)
+    if room_id is None:
+        return
+    leave_room(watch_room(room_id), sid=sid)
+    room = watched_rooms.get(room_id)
+    if room and room.audience:
+        room.audience.sids.discard(sid)
+        if not room.audience.sids:
+            room.audience = None
+            del watched_rooms[room_id]
+
+
+def broadcast_spectators():
+    """向观战者广播：击球按顺序发出，位置只发最新局面；每条消息对整个房间只序列化一次"""
+    for room_id, room in list(watched_rooms.items()):
+        audience = room.audience
+        if audience is None:
+            continue
+        target = watch_room(room_id)
+        for hit in audience.hits:
+            socketio.emit("opponent_hit", hit, to=target)
+        audience.hits.clear()
+        if audience.moved and room.positions is not None:
+            audience.moved = False
+            socketio.emit("opponent_pos", {"balls": room.positions.to_json()}, to=target)
+
+
+def run_spectators():
+    """后台每隔SPECTATOR_INTERVAL秒广播一次，没有观战者时退出"""
+    global spectator_task
+    try:
+        while watched_rooms:
+            socketio.sleep(SPECTATOR_INTERVAL)
+            broadcast_spectators()
+    finally:
+        spectator_task = None
+
+
+def settle_room(room, winner_id):
+    """
+    结算对局并通知房间内的玩家，对局已被结算时返回None；
+    胜者只来自服务器端的裁定(judge_turn)或断线超时判负，不接受客户端上报的结果
+    """
+    room_id = room.room_id
+    rewards = ((winner_id, WIN_COINS, "win"), (room.opponent(winner_id), LOSE_COINS, "lose"))
+    settled = rooms.settle(room_id, winner_id, lambda conn: ledger.grant(conn, rewards, room_id))
+    notify_rejected()
+    if not settled:
+        logger.warning("房间%s结算失败: 胜者%s", room_id, winner_id)
+        return None
+    if leaderboard.loaded:
+        leaderboard.record_game(winner_id, room.opponent(winner_id))
+    simulator.cancel(room_id)
+    replays.finish(room_id, room.player1_id, room.player2_id, winner_id)
+    logger.info(
+        "房间%s对局结束, 胜者%s",
+        room_id,
+        winner_id,
+        extra={"event": "game_over", "room_id": room_id, "user_id": winner_id},
+    )
+    socketio.emit(
+        "game_settled",
+        {
+            "room_id": room_id,
+            "winner_id": winner_id,
+            "win_coins": WIN_COINS,
+            "lose_coins": LOSE_COINS,
+        },
+        to=room_targets(room_id),
+    )
+    close_rooms(room_id)
+    return settled
+
+
+def run_reaper():
+    """定期回收无人活动的房间，并把结束已久的房间移出热表"""
+    while True:
+        socketio.sleep(REAP_INTERVAL)
+        try:
+            for room in rooms.expire(WAITING_ROOM_TTL, PLAYING_ROOM_TTL):
+                simulator.cancel(room.room_id)
+                replays.finish(room.room_id, room.player1_id, room.player2_id)
+                logger.info("回收无人活动的房间%s", room.room_id)
+                socketio.emit("room_closed", {"room_id": room.room_id}, to=room_targets(room.room_id))
+                close_rooms(room.room_id)
+            archived = rooms.archive(ARCHIVE_AFTER)
+            if archived:
+                logger.info("归档已结束的房间%s个", archived)
+        except sq.Error:
+            logger.exception("数据库服务异常")
+
+
+def run_ledger_writer():
+    """定期把金币账本的变动批量写回数据库，失败时保留到下一次"""
+    while True:
+        socketio.sleep(LEDGER_FLUSH_INTERVAL)
+        try:
+            conflicts = ledger.flush()
+        except sq.Error:
+            logger.exception("写回金币账本失败")
+            continue
+        if conflicts:
+            logger.error("用户%s的余额与数据库不一致, 已按数据库中的余额重放其未写回的变动", conflicts)
+            notify_rejected()
+
+
+def notify_rejected():
+    """重放时被撤销的购买：通知用户的所有连接，球杆与余额以通知中的为准"""
+    for user_id, bar_id in ledger.take_rejected():
+        logger.error("用户%s购买的球杆%s在写回时被撤销: 余额不足或已拥有", user_id, bar_id)
+        account = ledger.account(user_id)
+        data = {"bar_id": bar_id, "coins": account.coins if account else 0}
+        for sid, session in list(socket_sessions.items()):
+            if session.user_id == user_id:
+                socketio.emit("purchase_revoked", data, to=sid)
+
+
+def run_revocation_sync():
+    """多进程部署时同步其他工作进程吊销的令牌"""
+    while True:
+        socketio.sleep(REVOCATION_SYNC)
+        try:
+            load_revocations()
+        except sq.Error:
+            logger.exception("同步令牌吊销记录失败")
+
+
+def run_leaderboard_refresh():
+    """多进程部署时其他工作进程结算的对局不会通知本进程，定期在线程池中重新构建排行榜后替换"""
+    global leaderboard
+    while True:
+        socketio.sleep(LEADERBOARD_REFRESH)
+        fresh = Leaderboard(db, app.json.dumps)
+        try:
+            tpool.execute(fresh.load)
+        except sq.Error:
+            logger.exception("重新构建排行榜失败")
+            continue
+        leaderboard = fresh
+
+
+def run_replay_writer():
+    """定期把已结束房间的回放交给线程池追加写入文件"""
+    while True:
+        socketio.sleep(REPLAY_FLUSH_INTERVAL)
+        batch = replays.take()
+        if not batch:
+            continue
+        try:
+            tpool.execute(replays.write, batch)
+        except OSError:
+            logger.exception("写入回放失败, 丢弃%s个房间", len(batch))
+
+
+@socketio.on("disconnect")
+def handle_disconnect(*args):
+    """连接断开：清理连接映射，对局中的玩家进入重连等待期"""
+    sid = request.sid
+    socket_sessions.pop(sid, None)
+    binary_sids.discard(sid)
+    limiter.forget(sid)
+    pos_mailbox.pop(sid, None)
+    leave_audience(sid)
+    user_id = rooms.unbind_sid(sid)
+    if user_id is None:
+        return
+    matchmaker.cancel(user_id)
+    room = rooms.room_of(user_id)
+    if not room:
+        return
+    token = object()
+    room.offline[user_id] = token
+    logger.info("房间%s的玩家%s断开连接, 等待重连", room.room_id, user_id)
+    socketio.emit(
+        "opponent_offline",
+        {"user_id": user_id, "grace": RECONNECT_GRACE},
+        to=str(room.room_id),
+    )
+    socketio.start_background_task(expire_offline, room.room_id, user_id, token)
+
+
+def expire_offline(room_id, user_id, token):
+    """等待期结束仍未重连：对局中判对手获胜，等待中的房间直接关闭"""
+    socketio.sleep(RECONNECT_GRACE)
+    room = rooms.get(room_id)
+    if not room or room.offline.get(user_id) is not token:
+        return
+    logger.info("房间%s的玩家%s未在等待期内重连", room_id, user_id)
+    try:
+        if room.state == ROOM_PLAYING:
+            settle_room(room, room.opponent(user_id))
+        else:
+            rooms.close_room(room_id)
+            replays.finish(room_id, room.player1_id, room.player2_id)
+            socketio.emit("room_closed", {"room_id": room_id}, to=room_targets(room_id))
+            close_rooms(room_id)
     except sq.Error:
         logger.exception("数据库服务异常")
-        emit("fail", {"error": "数据库服务异常"})
+
+
+@socketio.on("rejoin")
+def rejoin(data):
+    """断线重连：把用户映射到新的连接，并返回房间当前的权威局面与击球方"""
+    try:
+        user_id = socket_user(data)
+    except InvalidToken as auth_error:
+        logger.warning("重连失败: %s", auth_error)
+        emit("fail", {"error": "未登录或登录已过期"})
+        return
+    except (AttributeError, TypeError, ValueError) as rejoin_error:
+        logger.warning("重连失败: %s", rejoin_error)
+        emit("fail", {"error": "无效的请求"})
         return
+    room = rooms.room_of(user_id)
+    if not room:
+        logger.info("用户%s重连时房间已结束", user_id)
+        emit("fail", {"error": "房间已结束"})
+        return
+
+    room_id = room.room_id
+    join_room(str(room_id))
+    rooms.bind_sid(user_id, request.sid)
+    room.offline.pop(user_id, None)
+    room.touch()
+    logger.info("房间%s的玩家%s重新连接", room_id, user_id)
+    emit("resume", resume_data(room))
+    socketio.emit(
+        "opponent_online", {"user_id": user_id}, to=str(room_id), skip_sid=request.sid
+    )
+
+
+def resume_data(room):
+    """重连时返回的房间快照：服务器模拟的最终局面优先，击球模拟中时使用最近一次转发的位置"""
+    if room.table is not None and room.room_id not in simulator:
+        balls = room.table.ball_states()
+    elif room.positions is not None:
+        balls = room.positions.to_json()
+    else:
+        balls = []
+    return {
+        "room_id": room.room_id,
+        "player1_id": room.player1_id,
+        "player2_id": room.player2_id,
+        "state": room.state,
+        "turn": room.rules.shooter,
+        "solid_player_id": room.rules.solid_player or None,
+        "balls": balls,
+        "seq": room.positions.seq if room.positions is not None else 0,
+    }
+
+
+@app.route("/api/leaderboard", methods=["GET"])
+def show_leaderboard():
+    """排行榜前N名，响应按N缓存"""
+    # 检查数据
+    try:
+        limit = int(request.args.get("limit", LEADERBOARD_DEFAULT_TOP))
+        if not 1 <= limit <= MAX_TOP:
+            raise ValueError(f"limit超出范围: {limit}")
+    except (TypeError, ValueError) as rank_error:
+        logger.warning("获取排行榜失败: %s", rank_error)
+        return fixed_response(400, "无效的请求")
+
+    # 执行操作
+    try:
+        if not leaderboard.loaded:
+            leaderboard.load()
+        return app.response_class(leaderboard.top_json(limit), mimetype="application/json")
+    except sq.Error:
+        logger.exception("数据库服务异常")
+        return fixed_response(500, "数据库服务异常")
+
+
+@app.route("/api/leaderboard/around", methods=["GET"])
+def show_leaderboard_around():
+    """用户的名次及前后各radius名；不带user_id时按rank参数定位"""
+    # 检查数据
+    try:
+        user_id = request.args.get("user_id")
+        user_id = None if user_id is None else int(user_id)
+        rank = None if user_id is not None else int(request.args.get("rank"))
+        radius = int(request.args.get("radius", 5))
+        if not 0 <= radius <= MAX_LEADERBOARD_RADIUS or (rank is not None and rank < 1):
+            raise ValueError("rank或radius超出范围")
+    except (TypeError, ValueError) as rank_error:
+        logger.warning("获取排名失败: %s", rank_error)
+        return fixed_response(400, "无效的请求")
+
+    # 执行操作
+    try:
+        if not leaderboard.loaded:
+            leaderboard.load()
+        if user_id is not None:
+            rank = leaderboard.rank(user_id)
+            if rank is None:
+                return fixed_response(404, "用户不存在")
+        elif rank > len(leaderboard):
+            return fixed_response(404, "名次超出榜单")
+        return jsonify(
+            {
+                "message": "ok",
+                "data": {
+                    "rank": rank,
+                    "total": len(leaderboard),
+                    "ranks": leaderboard.around(rank, radius),
+                },
+                "error": "",
+            }
+        )
+    except sq.Error:
+        logger.exception("数据库服务异常")
+        return fixed_response(500, "数据库服务异常")
+
+
+@app.route("/api/replay", methods=["GET"])
+def show_replay():
+    """获取已结束对局的回放，带shot参数时只返回其中一杆"""
+    global replay_reader
+    # 检查数据
+    try:
+        room_id = int(request.args.get("room_id"))
+        shot = request.args.get("shot")
+        shot = None if shot is None else int(shot)
+    except (TypeError, ValueError) as replay_error:
+        logger.warning("获取回放失败: %s", replay_error)
+        return fixed_response(400, "无效的请求")
+
+    # 执行操作：索引中没有的房间可能是读取索引之后才写出的，重新读取一次
+    try:
+        if replay_reader is None:
+            replay_reader = ReplayReader(REPLAY_DIR)
+        info = replay_reader.info(room_id)
+        if info is None:
+            replay_reader.reload()
+            info = replay_reader.info(room_id)
+        if info is None:
+            logger.info("房间%s没有回放", room_id)
+            return fixed_response(404, "回放不存在")
+        if shot is None:
+            shots = list(replay_reader.shots(room_id))
+        elif 0 <= shot < info["shots"]:
+            shots = [replay_reader.shot(room_id, shot)]
+        else:
+            return fixed_response(404, "击球不存在")
+        return jsonify({"message": "ok", "data": info | {"records": shots}, "error": ""}), 200
+    except (OSError, ValueError):
+        logger.exception("读取回放失败")
+        return fixed_response(500, "回放读取失败")
+
+
+@app.route("/metrics", methods=["GET"])
+def show_metrics():
+    """Prometheus文本格式的运行指标"""
+    return app.response_class(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+
+# 进程内状态的瞬时值，在抓取时求值
+metrics.registry.gauge("starball_active_rooms", "内存中未结束的房间数", lambda: len(rooms))
+metrics.registry.gauge(
+    "starball_connected_sids",
+    "连接到本进程的socket数",
+    lambda: sum(1 for _ in socketio.server.manager.get_participants("/", None)),
+)
+metrics.registry.gauge("starball_bcrypt_pending", "排队及执行中的bcrypt任务数", passwords.pending)
+metrics.registry.gauge("starball_avatar_pending", "排队及执行中的头像任务数", avatars.pending)
+metrics.registry.gauge("starball_physics_active_shots", "模拟中的击球数", lambda: simulator.active)
+metrics.registry.gauge("starball_match_queue", "匹配队列中的玩家数", lambda: len(matchmaker))
+metrics.registry.gauge("starball_db_connections_in_use", "被借出的数据库连接数", db.in_use)
+metrics.registry.gauge("starball_ledger_pending", "尚未写回的金币账本条目数", ledger.pending)
+metrics.registry.gauge("starball_replay_rooms", "缓冲回放的进行中房间数", lambda: len(replays))
+metrics.registry.gauge("starball_replay_pending", "等待写出回放的已结束房间数", replays.pending)
+metrics.registry.gauge("starball_spectators", "观战连接数", lambda: len(spectator_rooms))
+metrics.registry.gauge("starball_authenticated_sids", "已认证的socket连接数", lambda: len(socket_sessions))
+metrics.registry.gauge("starball_revoked_tokens", "内存中尚未过期的令牌吊销记录数", signer.revoked)
+metrics.instrument_app(app)
+ratelimit.limit_socketio(socketio, limiter, reject_event)
+metrics.instrument_socketio(socketio)
 
 
 if __name__ == "__main__":
     initialize_table()
-    socketio.run(app, host="0.0.0.0", port=5000, debug=True)
\ No newline at end of file
+    catalog.load()
+    load_revocations()
+    if cluster.WORKERS <= 1:
+        rooms.load()
+        leaderboard.load()
+        socketio.start_background_task(run_reaper)
+        socketio.start_background_task(run_replay_writer)
+        socketio.start_background_task(run_ledger_writer)
+        # 重载器会在子进程中再次执行本模块，后台任务将在两个进程中各运行一份
+        socketio.run(app, host="0.0.0.0", port=5000, debug=True, use_reloader=False)
+    elif cluster.worker_index is None:
+        cluster.supervise()
+    else:
+        rooms.load()
+        leaderboard.load()
+        socketio.start_background_task(run_leaderboard_refresh)
+        socketio.start_background_task(run_revocation_sync)
+        socketio.start_background_task(run_reaper)
+        socketio.start_background_task(run_replay_writer)
+        socketio.start_background_task(run_ledger_writer)
+        cluster.serve(app, "0.0.0.0", 5000)
\ No newline at end of file
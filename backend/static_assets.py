@@ -0,0 +1,129 @@
+"""/bars与/head图片的静态资源层：内容哈希文件名、强ETag、长期缓存、304以及小文件内存LRU"""
+
+import hashlib
+import os
+import re
+import tempfile
+from collections import OrderedDict
+from flask import Response, send_file
+from werkzeug.exceptions import NotFound
+from werkzeug.security import safe_join
+
+# 内存缓存的总容量与单个文件的上限，超过上限的文件直接交给send_file(wsgi.file_wrapper)发送
+CACHE_BYTES = int(os.environ.get("STARBALL_ASSET_CACHE_BYTES", str(32 * 1024 * 1024)))
+CACHE_FILE_BYTES = 256 * 1024
+
+# 文件名中带内容哈希的资源内容永不变化，其余资源(球杆图片、默认头像)缓存一小时后重新验证
+HASHED_NAME = re.compile(r"^[^/]+\.([0-9a-f]{16})\.[A-Za-z0-9]+$")
+IMMUTABLE = "public, max-age=31536000, immutable"
+REVALIDATE = "public, max-age=3600"
+
+
+def content_digest(data):
+    """文件内容的摘要，用于文件名与ETag"""
+    return hashlib.sha256(data).hexdigest()[:16]
+
+
+def write_atomic(path, data):
+    """
+    先写临时文件再替换，读取方不会看到写了一半的文件；
+    临时文件名唯一，线程池中同时写同一路径时互不干扰，后完成的覆盖先完成的
+    """
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as handle:
+            handle.write(data)
+        os.chmod(temp, 0o644)
+        os.replace(temp, path)
+    except BaseException:
+        try:
+            os.unlink(temp)
+        except OSError:
+            pass
+        raise
+
+
+class StaticAssets:
+    """一个目录下的静态资源，命中的小文件从内存返回，未命中时由服务器零拷贝发送"""
+
+    def __init__(self, root, cache_bytes=CACHE_BYTES, file_bytes=CACHE_FILE_BYTES):
+        self.root = root
+        self.cache_bytes = cache_bytes
+        self.file_bytes = file_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def _load(self, filename, path):
+        """读取小文件放入缓存，返回 (内容, ETag, 文件签名)，文件过大时返回None"""
+        stat = os.stat(path)
+        if stat.st_size > self.file_bytes:
+            return None
+        with open(path, "rb") as handle:
+            data = handle.read()
+        entry = (data, content_digest(data), (stat.st_size, stat.st_mtime_ns))
+        self.forget(filename)
+        self._entries[filename] = entry
+        self.size += len(data)
+        while self.size > self.cache_bytes and self._entries:
+            _, (old, _, _) = self._entries.popitem(last=False)
+            self.size -= len(old)
+        return entry
+
+    def _entry(self, filename, path, immutable):
+        """查找缓存；未带哈希的文件可能被原地覆盖，命中时比较文件签名"""
+        entry = self._entries.get(filename)
+        if entry is not None:
+            if immutable:
+                self._entries.move_to_end(filename)
+                return entry
+            stat = os.stat(path)
+            if entry[2] == (stat.st_size, stat.st_mtime_ns):
+                self._entries.move_to_end(filename)
+                return entry
+        return self._load(filename, path)
+
+    def __contains__(self, filename):
+        """目录下是否存在该文件"""
+        if filename in self._entries:
+            return True
+        path = safe_join(self.root, filename)
+        return path is not None and os.path.isfile(path)
+
+    def forget(self, filename):
+        """移除缓存的文件，文件被删除或替换时调用"""
+        entry = self._entries.pop(filename, None)
+        if entry is not None:
+            self.size -= len(entry[0])
+
+    def serve(self, filename, request):
+        """返回资源响应，If-None-Match与ETag一致时返回304"""
+        path = safe_join(self.root, filename)
+        if path is None or not os.path.isfile(path):
+            raise NotFound()
+        matched = HASHED_NAME.match(filename)
+        cache_control = IMMUTABLE if matched else REVALIDATE
+
+        entry = self._entry(filename, path, bool(matched))
+        if entry is None:
+            # 大文件：ETag取文件名中的哈希，正文交给wsgi.file_wrapper发送
+            response = send_file(path, conditional=True, etag=matched.group(1) if matched else True)
+        else:
+            data, etag, _ = entry
+            response = Response(data, mimetype=_mimetype(filename))
+            response.set_etag(etag)
+            response = response.make_conditional(request)
+        response.headers["Cache-Control"] = cache_control
+        return response
+
+
+def _mimetype(filename):
+    extension = os.path.splitext(filename)[1].lower()
+    return {
+        ".png": "image/png",
+        ".jpg": "image/jpeg",
+        ".jpeg": "image/jpeg",
+        ".gif": "image/gif",
+        ".webp": "image/webp",
+    }.get(extension, "application/octet-stream")
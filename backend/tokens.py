@@ -0,0 +1,114 @@
+"""会话令牌：HMAC-SHA256签名、带过期时间，验证只需一次HMAC计算与一次字典查找，不访问数据库
+
+令牌为 base64url(载荷).base64url(签名)，载荷为 "user_id.过期时间.令牌id"。
+
+STARBALL_SECRET     签名密钥；未配置时在启动时随机生成，重启后已签发的令牌全部失效。
+                    多进程部署时主进程生成的密钥通过环境变量传给工作进程
+STARBALL_TOKEN_TTL  令牌有效期(秒)，默认7天
+"""
+
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+import time
+
+TOKEN_TTL = int(os.environ.get("STARBALL_TOKEN_TTL", str(7 * 24 * 60 * 60)))
+
+# 吊销记录只需保留到令牌过期；超过上限时先清理已过期的记录
+MAX_REVOKED = 100000
+
+
+def load_secret():
+    """读取签名密钥，未配置时生成一个并写回环境变量，供之后启动的工作进程继承"""
+    secret = os.environ.get("STARBALL_SECRET")
+    if not secret:
+        secret = os.environ["STARBALL_SECRET"] = secrets.token_hex(32)
+    return secret.encode("utf-8")
+
+
+def _encode(raw):
+    return base64.urlsafe_b64encode(raw).rstrip(b"=").decode("ascii")
+
+
+def _decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+class InvalidToken(Exception):
+    """令牌缺失、格式错误、签名不符、已过期或已吊销"""
+
+
+class Claims:
+    """验证通过的令牌内容"""
+
+    __slots__ = ("user_id", "expires_at", "token_id")
+
+    def __init__(self, user_id, expires_at, token_id):
+        self.user_id = user_id
+        self.expires_at = expires_at
+        self.token_id = token_id
+
+
+class TokenSigner:
+    """签发与验证令牌，并在内存中保存尚未过期的吊销记录"""
+
+    def __init__(self, secret, ttl=TOKEN_TTL, clock=time.time):
+        self.secret = secret
+        self.ttl = ttl
+        self.clock = clock
+        self._revoked = {}
+
+    def revoked(self):
+        """尚未过期的吊销记录数"""
+        return len(self._revoked)
+
+    def _sign(self, payload):
+        return hmac.new(self.secret, payload, hashlib.sha256).digest()
+
+    def issue(self, user_id):
+        """签发令牌，返回 (令牌, 过期时间)"""
+        expires_at = int(self.clock()) + self.ttl
+        payload = f"{user_id}.{expires_at}.{secrets.token_hex(8)}".encode("ascii")
+        return f"{_encode(payload)}.{_encode(self._sign(payload))}", expires_at
+
+    def verify(self, token):
+        """验证令牌并返回Claims，不通过时抛出InvalidToken"""
+        if not token or not isinstance(token, str):
+            raise InvalidToken("缺少令牌")
+        try:
+            encoded, signature = token.split(".")
+            payload = _decode(encoded)
+            valid = hmac.compare_digest(_decode(signature), self._sign(payload))
+        except ValueError:
+            raise InvalidToken("令牌格式错误") from None
+        if not valid:
+            raise InvalidToken("令牌签名不符")
+        user_id, expires_at, token_id = payload.decode("ascii").split(".")
+        expires_at = int(expires_at)
+        if expires_at <= self.clock():
+            raise InvalidToken("令牌已过期")
+        if token_id in self._revoked:
+            raise InvalidToken("令牌已吊销")
+        return Claims(int(user_id), expires_at, token_id)
+
+    def revoke(self, claims):
+        """吊销一个已验证的令牌，记录保留到令牌过期"""
+        if len(self._revoked) >= MAX_REVOKED:
+            self.prune()
+        self._revoked[claims.token_id] = claims.expires_at
+
+    def load_revoked(self, rows):
+        """合并其他进程写入数据库的 (令牌id, 过期时间) 吊销记录"""
+        self._revoked.update(rows)
+        self.prune()
+
+    def prune(self):
+        """清理已过期的吊销记录"""
+        now = self.clock()
+        self._revoked = {
+            token_id: expires_at
+            for token_id, expires_at in self._revoked.items()
+            if expires_at > now
+        }
@@ -3,6 +3,7 @@ import './login.css';
 import Bg from '../../components/layout/bg';
 import { registerUser, loginUser, getUserInfo } from '../../api/Login';
 import { useNavigate } from 'react-router-dom';
+import { socket } from '../../utils/socket';
 
 const StoreUserInfo = (data) => {
     localStorage.setItem('CueOwned', JSON.stringify(data.bar_possess));
@@ -41,6 +42,9 @@ const Login = () => {
                 
                 const user_id = response.data.data.user_id;
                 localStorage.setItem('user_id', user_id);
+                localStorage.setItem('token', response.data.data.token);
+                // 用新令牌重新建立socket连接
+                socket.disconnect().connect();
                 localStorage.setItem('username', username);
 
                 const res = await getUserInfo(user_id);
@@ -69,6 +73,8 @@ const Login = () => {
 
                 localStorage.setItem('username', username);
                 localStorage.setItem('user_id', response.data.data.user_id);
+                localStorage.setItem('token', response.data.data.token);
+                socket.disconnect().connect();
                 // ✅ 登录成功后立即获取用户信息
                 const res = await getUserInfo(user_id);
                 localStorage.setItem('userInfo', JSON.stringify(res.data.data));
@@ -4,4 +4,6 @@ import { io } from "socket.io-client";
 const backendUrl = import.meta.env.VITE_BACKEND_URL; // ✅ 使用 Vite 环境变量
 export const socket = io(backendUrl, {
     transports: ["websocket"],
+    // 每次(重新)连接时携带登录令牌，未登录时只能观战
+    auth: (cb) => cb({ token: localStorage.getItem("token") }),
 });